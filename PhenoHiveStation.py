@@ -1,18 +1,29 @@
+import atexit
 import base64
 import configparser
+import numbers
 import os
 import statistics
+import threading
 import time
-import Adafruit_GPIO.SPI as SPI
-import ST7735 as TFT
-import hx711
-import RPi.GPIO as GPIO
+import numpy as np
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-from picamera2 import Picamera2, Preview
-from image_processing import get_total_length
+from influxdb_client import Point
+from image_processing import analyse_image, RoiTracker, frame_signature, frame_difference
+from analysis_cache import AnalysisCache
+from analysis_queue import AnalysisQueue
+from image_store import ImageStore, make_thumbnail
+from measurement_store import MeasurementStore
+from spool import Spool, drop_field, rejected_by_db
+from connection import ConnectionHealth
+from work_memory import WorkMemory
+from camera import CameraManager, encode_jpeg
+from buttons import ButtonEvents
+from hardware import Hardware
+from load_cell_sampler import LoadCellSampler, robust_stats
+from profiling import TIMER
 from utils import save_to_csv
 from show_display import Display
 
@@ -20,6 +31,12 @@ CONFIG_FILE = "config.ini"
 LOGGER = logging.getLogger("PhenoHiveStation")
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 DATE_FORMAT_FILE = "%Y-%m-%dT%H-%M-%SZ"  # Date format for file names (no ':', which is not illegal in Windows)
+SAMPLE_TIMEOUT = 1.0  # Maximum time to wait for each load cell sample of the sampler (in seconds)
+# Fields written as integers to the DB (counts, sizes and flags), the other numeric fields are written as floats so that
+# the type of a field never changes between points (InfluxDB rejects a point whose field type differs)
+INTEGER_FIELDS = frozenset({"status", "branch_points", "tips", "height", "bbox_x", "bbox_y", "bbox_width",
+                            "bbox_height", "picture_width", "picture_height", "carried_forward", "queue_depth",
+                            "spool_points"})
 
 
 class PhenoHiveStation:
@@ -39,8 +56,12 @@ class PhenoHiveStation:
     SPI_PORT = -1
     SPI_DEVICE = -1
     LED = -1
+    CAPTURE_MODE = ""
+    keep_warm = False
+    settle_timeout = -1.0
     BUT_LEFT = -1
     BUT_RIGHT = -1
+    BOUNCE_TIME = -1
 
     # Station variables
     parser = None
@@ -49,32 +70,78 @@ class PhenoHiveStation:
     bucket = ""
     url = ""
     station_id = ""
+    concurrent = False
+    queued_analysis = False
     image_path = ""
     csv_path = ""
+    cache_path = ""
+    queue_path = ""
+    timings_path = ""
+    spool_enabled = False
+    spool_folder = ""
+    image_store_enabled = False
+    image_store_path = ""
+    thumbnail_width = -1
+    spool_max_mb = -1.0
+    spool_batch = -1
+    spool_drain = -1
+    spool_pictures = False
+    send_pictures = True
+    gzip = False
+    batch_size = -1
+    flush_interval = -1
+    max_retries = -1
+    check_interval = -1.0
+    cache_size = -1
+    cache_max_mb = -1.0
     pot_limit = -1
     channel = ""
     kernel_size = -1
+    engine = ""
+    downscale = -1.0
+    low_memory = False
+    memory_budget = -1.0
+    roi_margin = -1
+    change_threshold = -1.0
+    archive_duplicates = True
     fill_size = -1
     time_interval = -1
+    catchup_policy = ""
     load_cell_cal = -1.0
+    load_cell_sampler = False
+    sampler_size = -1
+    sampler_rejection = -1.0
+    adaptive_weighing = False
+    weight_tolerance = -1.0
+    weight_min_samples = -1
+    weight_max_samples = -1
+    weight_max_time = -1.0
+    read_timeout = -1.0
+    csv_rotation = ""
+    csv_max_mb = -1.0
+    csv_flush_rows = -1
+    csv_flush_interval = -1.0
+    csv_fsync = False
     tare = -1.0
     status = -1
     last_error = ("", "")
 
     @staticmethod
-    def get_instance() -> 'PhenoHiveStation':
+    def get_instance(config_path: str = CONFIG_FILE) -> 'PhenoHiveStation':
         """
         Static access method to create a new instance of the station if not already initialised.
         Otherwise, return the current instance.
+        :param config_path: path to the config file used to initialise the station (default = config.ini)
         :return: A PhenoHiveStation instance
         """
         if PhenoHiveStation.__instance is None:
-            PhenoHiveStation()
+            PhenoHiveStation(config_path)
         return PhenoHiveStation.__instance
 
-    def __init__(self) -> None:
+    def __init__(self, config_path: str = CONFIG_FILE) -> None:
         """
         Initialize the station
+        :param config_path: path to the config file (default = config.ini)
         :raises RuntimeError: If trying to instantiate a new PhenoHiveStation if one was already instantiated
                                 (use get_instance() instead)
         """
@@ -87,50 +154,93 @@ class PhenoHiveStation:
         self.parser = configparser.ConfigParser()
 
         # Parse Config.ini file
-        self.parse_config_file(CONFIG_FILE)
+        self.parse_config_file(config_path)
         self.status = 0  # 0: idle, 1: measuring, -1: error
 
-        # InfluxDB client initialization
-        self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
-        self.connected = self.client.ping()
+        # Analysis cache (disabled if cache_size is 0), bounded to cache_size entries and cache_max_mb MB
+        self.cache = AnalysisCache(self.cache_path, self.cache_size, self.cache_max_mb) \
+            if self.cache_size > 0 else None
+        # Region of interest tracking between consecutive images (disabled if roi_margin is 0)
+        self.roi_tracker = RoiTracker(self.roi_margin) if self.roi_margin > 0 else None
+        # Reusable working buffers and memory budget of the image analysis (low-memory mode)
+        self.work_memory = WorkMemory(self.memory_budget) if self.low_memory else None
+        # Content-addressed store of the photos: only a thumbnail and the hash of the photos are sent to the DB
+        self.image_store = ImageStore(self.image_store_path) if self.image_store_enabled else None
+        # Signature of the previous photo, to detect unchanged photos
+        self.last_signature = None
+        # Concurrent measurement pipeline: the load cell is sampled during the camera warm-up and the data of a round is
+        # sent to the DB while the next round is prepared (one worker each, so that the reads and sends stay ordered)
+        self._error_lock = threading.Lock()
+        self.pending_send: Future | None = None
+        self.weight_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="load_cell") \
+            if self.concurrent else None
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db_send") if self.concurrent else None
+        # Queued analysis: the photos are put on a persistent queue with their measurement record, and a background
+        # worker analyses them and saves/sends the completed records (see analysis_worker)
+        self.analysis_queue = AnalysisQueue(self.queue_path) if self.queued_analysis else None
+        self.analysis_thread = None
+        self.last_growth = -1.0  # growth value of the last analysed photo
+        self._queue_event = threading.Event()
+
+        # Drivers of the devices, real or simulated depending on the [Hardware] section of the config file
+        self.hardware = Hardware(self.parser["Hardware"] if self.parser.has_section("Hardware") else None)
+        LOGGER.debug(f"Hardware backends: {self.hardware.backends}")
+
+        # Points that could not be sent to the DB, sent again once the DB is reachable (disabled if spool is 0)
+        self.spool = Spool(self.spool_folder, self.spool_max_mb) if self.spool_enabled else None
+        # InfluxDB client initialization, with the batching write API if batch_size is not 0 (the points are written
+        # in the background, the failed batches are reported by on_write_error), the spool is drained synchronously
+        self.client, self.write_api, self.sync_write_api = self.hardware.database(
+            self.url, self.token, self.org, gzip=self.gzip, batch_size=self.batch_size,
+            flush_interval=self.flush_interval, max_retries=self.max_retries,
+            success_callback=self.on_write_success, error_callback=self.on_write_error)
+        # The DB is pinged at most once per check interval, with an exponential backoff while it is unreachable
+        self.db_health = ConnectionHealth(self.client.ping, self.check_interval)
+        self.connected = self.db_health.is_up()
         self.last_connection = datetime.now().strftime(DATE_FORMAT)
         LOGGER.debug(f"InfluxDB client initialised with url : {self.url}, org : {self.org} and token : {self.token}" +
                      f", Ping returned : {self.connected}")
 
         # Screen initialisation
         LOGGER.debug("Initialising screen")
-        self.st7735 = TFT.ST7735(
-            self.DC,
-            rst=self.RST,
-            spi=SPI.SpiDev(
-                self.SPI_PORT,
-                self.SPI_DEVICE,
-                max_speed_hz=self.SPEED_HZ
-            )
-        )
+        self.st7735 = self.hardware.display(self.WIDTH, self.HEIGHT, self.DC, self.RST, self.SPI_PORT, self.SPI_DEVICE,
+                                            self.SPEED_HZ)
         self.disp = Display(self)
         self.disp.show_image("assets/logo_elia.jpg")
 
         # Hx711
-        self.hx = DebugHx711(dout_pin=5, pd_sck_pin=6)
+        self.hx = self.hardware.load_cell(self.read_timeout)
         try:
             LOGGER.debug("Resetting HX711")
             self.hx.reset()
-        except hx711.GenericHX711Exception as e:
+        except Exception as e:
             self.register_error(type(e)(f"Error while resetting HX711 : {e}"))
         else:
             LOGGER.debug("HX711 reset")
+        # Continuous sampling of the load cell into a ring buffer, the weight is then read from the last samples
+        self.sampler = LoadCellSampler(self.hx, self.sampler_size, self.sampler_rejection) \
+            if self.load_cell_sampler else None
+        if self.sampler is not None:
+            self.sampler.start()
 
         # Camera and LED init
-        self.cam = Picamera2()
-        GPIO.setwarnings(False)
-        GPIO.setup(self.LED, GPIO.OUT)
-        GPIO.output(self.LED, GPIO.HIGH)
+        self.cam, preview = self.hardware.camera()
+        if self.CAPTURE_MODE == "memory":
+            # RGB888 frames are BGR arrays, directly usable by OpenCV
+            self.cam.configure(self.cam.create_preview_configuration(main={"format": "RGB888"}))
+        # The camera is configured once, and kept running between captures if keep_warm is enabled
+        self.camera = CameraManager(self.cam, keep_warm=self.keep_warm, settle_timeout=self.settle_timeout,
+                                    preview=preview)
+        self.gpio = self.hardware.gpio()
+        self.gpio.setwarnings(False)
+        self.gpio.setup(self.LED, self.gpio.OUT)
+        self.gpio.output(self.LED, self.gpio.HIGH)
 
         # Button init
-        GPIO.setup(self.BUT_LEFT, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(self.BUT_RIGHT, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self.gpio.setup(self.BUT_LEFT, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.setup(self.BUT_RIGHT, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        # The button presses are delivered to the menus through a queue by the GPIO edge-detection callbacks
+        self.buttons = ButtonEvents(self.gpio, {"left": self.BUT_LEFT, "right": self.BUT_RIGHT}, self.BOUNCE_TIME)
 
         # Initial (placeholder) measurement data
         self.data = {
@@ -138,12 +248,50 @@ class PhenoHiveStation:
             "error_time": self.last_error[0],  # last registered error
             "error_message": str(self.last_error[1]),  # last registered error
             "growth": -1.0,  # plant's growth
+            "branch_points": -1,  # number of branch points of the plant skeleton
+            "tips": -1,  # number of end points of the plant skeleton
+            "height": -1,  # plant's height above the pot (in pixels)
+            "area": -1.0,  # area of the plant contour (in pixels)
+            "bbox_x": -1,  # bounding box of the plant contour (in pixels)
+            "bbox_y": -1,
+            "bbox_width": -1,
+            "bbox_height": -1,
             "weight": -1.0,  # plant's (measured) weight
             "weight_g": -1.0,  # plant's (measured) weight in grams (if calibrated)
             "standard_deviation": -1.0,  # measured weight standard deviation
-            "picture": ""  # last picture as a base-64 string
+            "precision_g": -1.0,  # half-width of the 95% confidence interval of the weight in grams (adaptive weighing)
+            "sample_rate": -1.0,  # load cell samples per second (load cell sampler)
+            "rejected_ratio": -1.0,  # ratio of the load cell samples rejected as outliers (load cell sampler)
+            "read_rate": -1.0,  # load cell reads per second
+            "failed_read_ratio": -1.0,  # ratio of the load cell reads that failed (timeout or invalid data)
+            "read_latency": -1.0,  # 95th percentile of the load cell read latency (in seconds)
+            "picture": "",  # last picture as a base-64 string (thumbnail of the picture with the image store)
+            "picture_hash": "",  # SHA-256 hash of the last picture in the image store
+            "picture_width": -1,  # size of the last picture (in pixels)
+            "picture_height": -1,
+            "carried_forward": 0,  # 1 if the photo was unchanged and the previous growth value was reused
+            "start_jitter": -1.0,  # delay between the measurement slot and the start of the measurement (in seconds)
+            "settle_time": -1.0,  # time taken by the camera exposure to converge before the photo (in seconds)
+            "queue_depth": 0,  # number of photos waiting for analysis when the photo was queued (queued analysis)
+            "spool_points": 0,  # number of points waiting in the offline spool after the last send
+            "spool_age": 0.0  # age of the oldest point of the offline spool (in seconds)
         }
-        self.to_save = ["growth", "weight", "weight_g", "standard_deviation"]
+        self.to_save = ["growth", "branch_points", "tips", "height", "area", "bbox_x", "bbox_y", "bbox_width",
+                        "bbox_height", "weight", "weight_g", "standard_deviation", "precision_g", "sample_rate",
+                        "rejected_ratio", "read_rate", "failed_read_ratio", "read_latency", "carried_forward",
+                        "start_jitter", "settle_time", "queue_depth", "spool_points", "spool_age", "picture_hash",
+                        "picture_width", "picture_height"]
+
+        # Measurements saved locally, in buffered CSV files rotated by day/size with a time index
+        # (see measurement_store)
+        self.measurements = MeasurementStore(self.csv_path, self.to_save, self.csv_rotation, self.csv_max_mb,
+                                             self.csv_flush_rows, self.csv_flush_interval, self.csv_fsync)
+        atexit.register(self.measurements.close)
+
+        if self.analysis_queue is not None:
+            # Start the analysis worker, it also processes the jobs left in the queue before a reboot
+            self.analysis_thread = threading.Thread(target=self.analysis_worker, name="analysis", daemon=True)
+            self.analysis_thread.start()
 
     def parse_config_file(self, path: str) -> None:
         """
@@ -162,13 +310,41 @@ class PhenoHiveStation:
         self.bucket = str(self.parser["InfluxDB"]["bucket"])
         self.url = str(self.parser["InfluxDB"]["url"])
         self.station_id = str(self.parser["Station"]["ID"])
+        self.concurrent = self.parser["Station"].getboolean("concurrent", False)
+        self.queued_analysis = self.parser["Station"].getboolean("queued_analysis", False)
         self.image_path = str(self.parser["Paths"]["image_folder"])
         self.csv_path = str(self.parser["Paths"]["csv_path"])
+        self.cache_path = str(self.parser["Paths"].get("cache_path", "data/analysis_cache.sqlite"))
+        self.queue_path = str(self.parser["Paths"].get("queue_path", "data/analysis_queue.sqlite"))
+        self.timings_path = str(self.parser["Paths"].get("timings_path", "data/timings.csv"))
+        self.spool_folder = str(self.parser["Paths"].get("spool_folder", "data/spool/"))
+        self.image_store_path = str(self.parser["Paths"].get("image_store", "data/image_store/"))
+        self.spool_enabled = self.parser["InfluxDB"].getboolean("spool", False)
+        self.spool_max_mb = float(self.parser["InfluxDB"].get("spool_max_mb", "50"))
+        self.spool_batch = int(self.parser["InfluxDB"].get("spool_batch", "5000"))
+        self.spool_drain = int(self.parser["InfluxDB"].get("spool_drain", "20000"))
+        self.spool_pictures = self.parser["InfluxDB"].getboolean("spool_pictures", False)
+        self.send_pictures = self.parser["InfluxDB"].getboolean("send_pictures", True)
+        self.gzip = self.parser["InfluxDB"].getboolean("gzip", False)
+        self.batch_size = int(self.parser["InfluxDB"].get("batch_size", "0"))
+        self.flush_interval = int(self.parser["InfluxDB"].get("flush_interval", "10000"))
+        self.max_retries = int(self.parser["InfluxDB"].get("max_retries", "3"))
+        self.check_interval = float(self.parser["InfluxDB"].get("check_interval", "300"))
+        self.cache_size = int(self.parser["image_arg"].get("cache_size", "0"))
+        self.cache_max_mb = float(self.parser["image_arg"].get("cache_max_mb", "50"))
         self.pot_limit = int(self.parser["image_arg"]["pot_limit"])
         self.channel = str(self.parser["image_arg"]["channel"])
         self.kernel_size = int(self.parser["image_arg"]["kernel_size"])
+        self.engine = str(self.parser["image_arg"].get("engine", "plantcv"))
+        self.downscale = float(self.parser["image_arg"].get("downscale", "1"))
+        self.low_memory = self.parser["image_arg"].getboolean("low_memory", False)
+        self.memory_budget = float(self.parser["image_arg"].get("memory_budget", "0"))
+        self.roi_margin = int(self.parser["image_arg"].get("roi_margin", "0"))
+        self.change_threshold = float(self.parser["image_arg"].get("change_threshold", "0"))
+        self.archive_duplicates = self.parser["image_arg"].getboolean("archive_duplicates", True)
         self.fill_size = int(self.parser["image_arg"]["fill_size"])
         self.time_interval = int(self.parser["time_interval"]["time_interval"])
+        self.catchup_policy = str(self.parser["time_interval"].get("catchup_policy", "skip"))
         self.WIDTH = int(self.parser["Display"]["width"])
         self.HEIGHT = int(self.parser["Display"]["height"])
         self.SPEED_HZ = int(self.parser["Display"]["speed_hz"])
@@ -179,8 +355,28 @@ class PhenoHiveStation:
         self.load_cell_cal = float(self.parser["cal_coef"]["load_cell_cal"])
         self.tare = float(self.parser["cal_coef"]["tare"])
         self.LED = int(self.parser["Camera"]["led"])
+        self.CAPTURE_MODE = str(self.parser["Camera"].get("capture_mode", "file"))
+        self.keep_warm = self.parser["Camera"].getboolean("keep_warm", False)
+        self.settle_timeout = float(self.parser["Camera"].get("settle_timeout", "8"))
+        self.image_store_enabled = self.parser["Camera"].getboolean("image_store", False)
+        self.thumbnail_width = int(self.parser["Camera"].get("thumbnail_width", "160"))
         self.BUT_LEFT = int(self.parser["Buttons"]["left"])
         self.BUT_RIGHT = int(self.parser["Buttons"]["right"])
+        self.BOUNCE_TIME = int(self.parser["Buttons"].get("bouncetime", "200"))
+        self.load_cell_sampler = self.parser.getboolean("LoadCell", "sampler", fallback=False)
+        self.sampler_size = self.parser.getint("LoadCell", "buffer_size", fallback=100)
+        self.sampler_rejection = self.parser.getfloat("LoadCell", "rejection", fallback=3.5)
+        self.adaptive_weighing = self.parser.getboolean("LoadCell", "adaptive", fallback=False)
+        self.weight_tolerance = self.parser.getfloat("LoadCell", "tolerance_g", fallback=0.5)
+        self.weight_min_samples = self.parser.getint("LoadCell", "min_samples", fallback=5)
+        self.weight_max_samples = self.parser.getint("LoadCell", "max_samples", fallback=100)
+        self.weight_max_time = self.parser.getfloat("LoadCell", "max_time", fallback=10)
+        self.read_timeout = self.parser.getfloat("LoadCell", "read_timeout", fallback=0.5)
+        self.csv_rotation = self.parser.get("Measurements", "rotation", fallback="none")
+        self.csv_max_mb = self.parser.getfloat("Measurements", "max_mb", fallback=0)
+        self.csv_flush_rows = self.parser.getint("Measurements", "flush_rows", fallback=1)
+        self.csv_flush_interval = self.parser.getfloat("Measurements", "flush_interval", fallback=0)
+        self.csv_fsync = self.parser.getboolean("Measurements", "fsync", fallback=False)
 
     def register_error(self, exception: Exception) -> None:
         """
@@ -189,89 +385,370 @@ class PhenoHiveStation:
         """
         LOGGER.error(f"{type(exception).__name__}: {exception}")
         timestamp = datetime.now().strftime(DATE_FORMAT)
-        self.status = -1
-        self.last_error = (timestamp, exception)
-        self.data["status"] = self.status
-        self.data["error_time"] = self.last_error[0]
-        self.data["error_message"] = str(self.last_error[1])
+        # Errors may be registered by the load cell thread of the concurrent pipeline
+        with self._error_lock:
+            self.status = -1
+            self.last_error = (timestamp, exception)
+            self.data["status"] = self.status
+            self.data["error_time"] = self.last_error[0]
+            self.data["error_message"] = str(self.last_error[1])
 
-    def send_to_db(self) -> bool:
+    @TIMER.stage("send")
+    def send_to_db(self, data: dict | None = None, timestamp: str | None = None) -> bool:
         """
-        Saves the measurements to the csv file, then sends it to InfluxDB (if connected)
-        Uses `PhenoHiveStation.measurements` dictionary containing the measurements and their values.
-        :return True if the data was sent to the DB, False otherwise
+        Saves the measurements to the csv file, then sends it to InfluxDB (if connected) as a single point
+        With the offline spool, the points that could not be sent are spooled with their measurement time, and the
+        spooled points are sent after the measurements once the DB is reachable
+        :param data: measurements to save and send (default = the current measurement data, `PhenoHiveStation.data`)
+        :param timestamp: time of the measurements, saved in the csv file and used as the time of the DB point
+        (default = now)
+        :return True if the data was sent to the DB (or queued by the batching write API), False otherwise
         """
-        # Check connection with the database
-        self.connected = self.client.ping()
-        timestamp = datetime.now().strftime(DATE_FORMAT)
+        if data is None:
+            data = self.data
+        if timestamp is None:
+            timestamp = datetime.now().strftime(DATE_FORMAT)
+        # Check connection with the database (cached, see ConnectionHealth)
+        with TIMER.stage("db_ping"):
+            self.connected = self.db_health.is_up()
 
-        # If the csv file does not exist, create it with the headers
-        if not os.path.exists(self.csv_path):
-            save_to_csv(["time"] + self.to_save, self.csv_path)
-
-        # Save data to the corresponding csv file
-        measurements_list = [timestamp]
-        for key in self.to_save:
-            measurements_list.append(self.data[key])
-        save_to_csv(measurements_list, "data/measurements.csv")
+        with TIMER.stage("csv"):
+            # Save data to the measurement store (written to the csv file according to the flush policy)
+            self.measurements.append(timestamp, [data[key] for key in self.to_save])
 
         if not self.connected:
+            if self.spool is not None:
+                self.spool_points(data, timestamp)
             return False
 
-        points = []
-        for field, value in self.data.items():
-            p = Point(f"station_{self.station_id}").field(field, value)
-            points.append(p)
+        point = self.make_point(data, timestamp, self.send_pictures)
 
         # Send data to the DB
-        LOGGER.debug(f"Sending data to the DB: {str(points)}")
+        LOGGER.debug(f"Sending data to the DB: {str(point)[:500]}")
+        with TIMER.stage("db_write"):
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=point)
+            except Exception as e:
+                # A point rejected by the DB (HTTP 4xx) would be rejected again: it is not spooled
+                if not rejected_by_db(e):
+                    self.db_health.report_failure()
+                    if self.spool is not None:
+                        self.spool_points(data, timestamp)
+                raise
+        if self.batch_size <= 0:
+            self.db_health.report_success()
+        if self.spool is not None:
+            self.drain_spool()
+        return True
+
+    def make_point(self, data: dict, timestamp: str, picture: bool = True) -> Point:
+        """
+        Build the DB point of a measurement: all the measurements are fields of a single point, tagged with the station
+        ID and timestamped with the measurement time (the point may be written later, by the batching write API or the
+        offline spool). The numeric fields are written as floats, except the INTEGER_FIELDS
+        :param data: measurements
+        :param timestamp: time of the measurements (in local time)
+        :param picture: include the picture (default = True)
+        :return: the point
+        """
+        point = Point(f"station_{self.station_id}").tag("station_id", self.station_id)
+        for field, value in data.items():
+            if field != "picture" or picture:
+                if isinstance(value, numbers.Real) and not isinstance(value, bool):
+                    value = int(value) if field in INTEGER_FIELDS else float(value)
+                point.field(field, value)
+        return point.time(datetime.strptime(timestamp, DATE_FORMAT).astimezone())
+
+    def on_write_success(self, conf: tuple, data: str) -> None:
+        """
+        Callback of the batching write API after a successful write: the DB is reachable
+        """
+        self.db_health.report_success()
+
+    def on_write_error(self, conf: tuple, data: str | bytes, exception: Exception) -> None:
+        """
+        Callback of the batching write API when a batch could not be written (after its retries): the DB is considered
+        unreachable and the points of the batch are spooled. A batch rejected by the DB (HTTP 4xx, see rejected_by_db)
+        would be rejected again: it is moved to the rejected file of the spool, and the DB is not marked unreachable
+        :param conf: (bucket, org, precision) of the batch
+        :param data: points of the batch in line protocol
+        :param exception: the error of the last try
+        """
+        lines = (data.decode() if isinstance(data, bytes) else data).splitlines()
+        if rejected_by_db(exception):
+            LOGGER.error(f"{len(lines)} points rejected by the DB: {type(exception).__name__}: {exception}")
+            if self.spool is not None:
+                self.spool.quarantine(lines)
+            return
+        self.db_health.report_failure()
+        LOGGER.warning(f"Could not write a batch to the DB: {type(exception).__name__}: {exception}")
+        if self.spool is not None:
+            if not self.spool_pictures:
+                # Like spool_points, the pictures are not spooled unless spool_pictures is enabled
+                lines = [drop_field(line, "picture") for line in lines]
+            with TIMER.stage("spool"):
+                self.spool.put(lines)
+
+    def spool_points(self, data: dict, timestamp: str) -> None:
+        """
+        Save measurements that could not be sent to the offline spool, with their measurement time
+        The picture is not spooled unless spool_pictures is enabled, to keep the spool small
+        :param data: measurements to spool
+        :param timestamp: time of the measurements
+        """
+        with TIMER.stage("spool"):
+            self.spool.put([self.make_point(data, timestamp, self.spool_pictures).to_line_protocol()])
+        self.report_spool()
+
+    def drain_spool(self) -> int:
+        """
+        Send the points of the offline spool to the DB in batches, at most spool_drain points per call so that a long
+        outage is caught up over several rounds
+        The batches are written synchronously (even with the batching write API), so that a segment is only deleted
+        once the DB accepted its points
+        :return: the number of points sent
+        """
+        with TIMER.stage("spool_drain"):
+            sent = self.spool.drain(
+                lambda lines: self.sync_write_api.write(bucket=self.bucket, org=self.org, record=lines),
+                self.spool_drain, self.spool_batch)
+        stats = self.report_spool()
+        if sent > 0:
+            LOGGER.info(f"Sent {sent} spooled points to the DB, {stats['points']} points left")
+        return sent
+
+    def report_spool(self) -> dict:
+        """
+        Store the number of spooled points and the age of the oldest one in the measurement data
+        :return: the statistics of the spool (see Spool.stats)
+        """
+        stats = self.spool.stats()
+        self.data["spool_points"] = stats["points"]
+        self.data["spool_age"] = round(stats["age"], 1)
+        if stats["points"] > 0:
+            LOGGER.debug(f"Spool: {stats['points']} points ({stats['bytes']} bytes), oldest {stats['age']:.0f}s ago, "
+                         f"{stats['dropped']} dropped, {stats['rejected']} rejected by the DB")
+        return stats
+
+    def save_timings(self, timestamp: str | None = None) -> bool:
+        """
+        Save the statistics of the pipeline stage durations (see profiling.StageTimer) to the timings csv file, then
+        send them to InfluxDB (if connected) as the `station_<id>_timings` measurement, one point per stage
+        :param timestamp: time of the statistics (default = now)
+        :return: True if the statistics were sent to the DB, False otherwise
+        """
+        if timestamp is None:
+            timestamp = datetime.now().strftime(DATE_FORMAT)
+        stats = TIMER.stats()
+        fields = ["last", "p50", "p95", "max", "count"]
+        if not os.path.exists(self.timings_path):
+            save_to_csv(["time", "stage"] + fields, self.timings_path)
+        for stage, values in sorted(stats.items()):
+            save_to_csv([timestamp, stage] + [round(values[field], 4) for field in fields], self.timings_path)
+
+        if not self.connected:
+            return False
+        point_time = datetime.strptime(timestamp, DATE_FORMAT).astimezone()
+        points = []
+        for stage, values in stats.items():
+            p = Point(f"station_{self.station_id}_timings").tag("station_id", self.station_id).tag("stage", stage)
+            for field in fields:
+                p.field(field, values[field])
+            points.append(p.time(point_time))
         self.write_api.write(bucket=self.bucket, org=self.org, record=points)
         return True
 
-    def get_weight(self, n: int = 15) -> tuple[float, float]:
+    def get_weight(self, n: int = 15, fresh: bool = True) -> tuple[float, float]:
         """
         Get the weight from the load cell (median of n measurements)
+        With the load cell sampler, the median and standard deviation of the samples are computed without the outliers
         :param n: the number of measurements to take (default = 15)
+        :param fresh: with the load cell sampler, only use the samples read after the call (e.g. once a weight is placed
+                      on the load cell), otherwise the whole buffer is used (default = True)
         :return: The median of the measurements (-1 in case of error) and the observed standard deviation
         """
+        if self.adaptive_weighing:
+            # The number of measurements depends on their noise (n is ignored)
+            median, std_dev, precision = self.get_adaptive_weight(fresh)
+            # -1 if the precision is unknown (no data, or less than two samples)
+            self.data["precision_g"] = round(precision * abs(self.load_cell_cal), 3) \
+                if median != -1.0 and np.isfinite(precision) else -1.0
+            return median, std_dev
+        if self.sampler is not None:
+            return self.get_sampled_weight(n, fresh)
         measurements = self.hx.get_raw_data(times=n)
         if not measurements:
             self.register_error(RuntimeError("Error while getting raw data (no data), check load cell connection"))
             return -1.0, -1.0
         return statistics.median(measurements), statistics.stdev(measurements)
 
-    def capture_and_display(self) -> tuple[str, str]:
+    def get_sampled_weight(self, n: int, fresh: bool) -> tuple[float, float]:
+        """
+        Get the weight from the samples of the load cell sampler, waiting for at least n samples
+        :param n: the minimum number of samples
+        :param fresh: only use the samples read after the call, otherwise the whole buffer is used
+        :return: The median of the samples without the outliers (-1 in case of error) and their standard deviation
+        """
+        since = time.monotonic() if fresh else None
+        if not self.sampler.wait_samples(n, since, timeout=n * SAMPLE_TIMEOUT):
+            LOGGER.warning(f"Less than {n} load cell samples after {n * SAMPLE_TIMEOUT}s")
+        stats = self.sampler.snapshot(since=since)
+        if stats.samples == 0:
+            self.register_error(RuntimeError("Error while getting raw data (no data), check load cell connection"))
+            return -1.0, -1.0
+        self.data["sample_rate"] = round(stats.sample_rate, 2)
+        self.data["rejected_ratio"] = round(stats.rejected, 3)
+        LOGGER.debug(f"Load cell: {stats.samples} samples at {stats.sample_rate:.1f} SPS, "
+                     f"{stats.rejected:.1%} rejected, {self.sampler.failed} failed reads")
+        return stats.median, stats.std
+
+    def get_adaptive_weight(self, fresh: bool = True) -> tuple[float, float, float]:
         """
-        Take a photo, display it on the screen and return it in base64
-        :return: a tuple with the photo in base64 and the path to the photo
+        Get the weight from the load cell, taking measurements until the 95% confidence interval of their median is
+        within the tolerance (tolerance_g, converted with the calibration coefficient), or until the maximum number of
+        measurements or the maximum time is reached. The outliers are rejected as with the load cell sampler.
+        :param fresh: with the load cell sampler, only use the samples read after the call, otherwise start from the
+                      samples of the buffer (default = True)
+        :return: The median of the measurements (-1 in case of error), their standard deviation and the achieved
+                 precision (half-width of the confidence interval, in raw load cell units)
+        """
+        start = time.monotonic()
+        tolerance = self.weight_tolerance / abs(self.load_cell_cal)
+        since = start if fresh else None
+        limit = self.weight_max_samples if self.sampler is None else min(self.weight_max_samples, self.sampler.size)
+        values, times = [], []
+        while True:
+            if self.sampler is not None:
+                stats = self.sampler.snapshot(limit, since)
+            else:
+                stats = robust_stats(np.array(values, np.float64), np.array(times), self.sampler_rejection)
+            precision = stats.precision()
+            if stats.samples >= self.weight_min_samples and precision <= tolerance:
+                break
+            remaining = start + self.weight_max_time - time.monotonic()
+            if stats.samples >= limit or remaining <= 0:
+                LOGGER.debug(f"Weighing stopped before reaching the tolerance ({stats.samples} samples)")
+                break
+            if self.sampler is not None:
+                self.sampler.wait_samples(stats.samples + 1, since, timeout=remaining)
+            else:
+                measurement = self.hx.get_raw_data(times=1)
+                if not measurement:
+                    break
+                values.append(measurement[0])
+                times.append(time.monotonic())
+
+        if stats.samples == 0:
+            self.register_error(RuntimeError("Error while getting raw data (no data), check load cell connection"))
+            return -1.0, -1.0, -1.0
+        if self.sampler is not None:
+            self.data["sample_rate"] = round(stats.sample_rate, 2)
+            self.data["rejected_ratio"] = round(stats.rejected, 3)
+        LOGGER.debug(f"Adaptive weighing: {stats.samples} samples in {time.monotonic() - start:.2f}s, "
+                     f"precision {precision * abs(self.load_cell_cal):.3f}g (tolerance {self.weight_tolerance}g)")
+        return stats.median, stats.std, precision
+
+    @TIMER.stage("capture")
+    def capture_and_display(self) -> tuple[str, str, np.ndarray | None, np.ndarray | None]:
+        """
+        Take a photo, display it on the screen and return it in base64 (a thumbnail of the photo with the image store)
+        In memory capture mode, the captured frame is also returned so that it can be analysed without reading the
+        photo back from the disk, and the JPEG data so that it can be archived with archive_photo
+        :return: a tuple with the photo in base64, the path to the photo, the frame and the JPEG data
+                (the frame and JPEG data are None in file capture mode, where the photo is already saved)
         """
         # Take the photo
-        GPIO.output(self.LED, GPIO.LOW)
-        path_img = self.save_photo(preview=False, time_to_wait=6)
-        time.sleep(2)
-        GPIO.output(self.LED, GPIO.HIGH)
+        self.gpio.output(self.LED, self.gpio.LOW)
+        if self.CAPTURE_MODE == "memory":
+            frame, path_img, jpeg = self.capture_to_memory()
+        else:
+            frame, jpeg = None, None
+            path_img = self.save_photo(preview=False)
+        self.gpio.output(self.LED, self.gpio.HIGH)
+        self.data["settle_time"] = round(self.camera.settle_time, 3)
         # Display the photo
         if path_img != "":
-            LOGGER.debug(f"Photo taken and saved at {path_img}")
-            self.disp.show_image(path_img)
-            # Convert image to base64
-            with open(path_img, "rb") as image_file:
-                pic = base64.b64encode(image_file.read()).decode('utf-8')
-            time.sleep(2)
-            return pic, path_img
+            LOGGER.debug(f"Photo taken, path: {path_img}, exposure settled in {self.camera.settle_time:.2f}s" +
+                         ("" if self.camera.settled else " (timeout)"))
+            if frame is not None:
+                self.disp.show_array(frame)
+                self.data["picture_width"], self.data["picture_height"] = frame.shape[1], frame.shape[0]
+            else:
+                self.disp.show_image(path_img)
+            if self.image_store is not None:
+                # The full photo stays in the image store, see tools/transfer_images.py
+                pic, size = make_thumbnail(path_img, frame, self.thumbnail_width)
+                self.data["picture_width"], self.data["picture_height"] = size
+            elif frame is not None:
+                pic = base64.b64encode(jpeg).decode('utf-8')
+            else:
+                # Convert image to base64
+                with open(path_img, "rb") as image_file:
+                    pic = base64.b64encode(image_file.read()).decode('utf-8')
+            self.hardware.sleep(2)
+            return pic, path_img, frame, jpeg
         else:
-            return "", ""
+            return "", "", None, None
+
+    def capture_to_memory(self, time_to_wait: float | None = None) -> tuple[np.ndarray | None, str, np.ndarray | None]:
+        """
+        Take a photo in memory and encode it as a JPEG, the same frame is used for the display and the analysis
+        The photo is not saved, use archive_photo to save the JPEG data at the returned path
+        :param time_to_wait: maximum time to wait for the exposure to converge (in seconds, default = settle_timeout)
+        :return: the frame (BGR), the path of the photo and the JPEG data (None, "", None in case of error)
+        """
+        name = datetime.now().strftime(DATE_FORMAT_FILE)
+        path_img = self.image_path + "/%s.jpg" % name
+        try:
+            frame = self.camera.capture_array(timeout=time_to_wait)
+            jpeg = encode_jpeg(frame)
+        except Exception as e:
+            self.register_error(type(e)(f"Error while capturing the photo: {e}"))
+            return None, "", None
+        return frame, path_img, jpeg
+
+    def archive_photo(self, path_img: str, jpeg: np.ndarray) -> None:
+        """
+        Save a photo captured in memory
+        :param path_img: path of the photo
+        :param jpeg: JPEG data of the photo
+        """
+        try:
+            with open(path_img, "wb") as f:
+                f.write(jpeg)
+        except OSError as e:
+            self.register_error(type(e)(f"Error while saving the photo: {e}"))
+
+    def is_unchanged(self, path_img: str, frame: np.ndarray | None) -> bool:
+        """
+        Check if the photo is visually identical to the last analysed one (e.g. at night or when the plant is dormant),
+        using the mean difference of their downsampled grey versions
+        The unchanged photos are compared with the last analysed photo rather than with each other, so that a slow
+        growth is still detected once it accumulates above the change threshold
+        :param path_img: path to the photo (read if frame is None)
+        :param frame: the photo in memory, or None
+        :return: True if the difference with the last analysed photo is below the change threshold
+        """
+        if self.change_threshold <= 0:
+            return False
+        signature = frame_signature(path_img, frame)
+        if self.last_signature is not None:
+            difference = frame_difference(signature, self.last_signature)
+            LOGGER.debug(f"Difference with the last analysed photo: {difference}")
+            if difference < self.change_threshold:
+                return True
+        # The photo is analysed, it becomes the reference of the next photos
+        self.last_signature = signature
+        return False
 
-    def save_photo(self, preview: bool = False, time_to_wait: int = 8) -> str:
+    def save_photo(self, preview: bool = False, time_to_wait: float | None = None) -> str:
         """
         Take a photo and save it
+        The preview photos of a warm camera are taken without waiting for the exposure to converge again
         :param preview: if True the photo will be saved as "img.jpg" (used for the display)
-        :param time_to_wait: time to wait before taking the photo (in seconds)
+        :param time_to_wait: maximum time to wait for the exposure to converge (in seconds, default = settle_timeout)
         :return: the path to the photo
         """
-        self.cam.start_preview(Preview.NULL)
-        self.cam.start()
-        time.sleep(time_to_wait)
         if not preview:
             name = datetime.now().strftime(DATE_FORMAT_FILE)
         else:
@@ -279,23 +756,26 @@ class PhenoHiveStation:
 
         path_img = self.image_path + "/%s.jpg" % name
         try:
-            self.cam.capture_file(file_output=path_img)
+            self.camera.capture_file(path_img, timeout=time_to_wait, settle=not (preview and self.camera.running))
         except Exception as e:
             self.register_error(type(e)(f"Error while capturing the photo: {e}"))
             path_img = ""
-        self.cam.stop_preview()
-        self.cam.stop()
         return path_img
 
     def measurement_pipeline(self) -> tuple[int, float]:
         """
-        Measurement pipeline
+        Measurement pipeline (see queued_measurement_pipeline and concurrent_measurement_pipeline for the queued
+        analysis and concurrent modes)
         :return: a tuple with the growth value and the weight
         """
+        if self.analysis_queue is not None:
+            return self.queued_measurement_pipeline()
+        if self.concurrent:
+            return self.concurrent_measurement_pipeline()
         LOGGER.info("Starting measurement pipeline")
         self.status = 1
         self.disp.show_collecting_data("Starting measurement pipeline")
-        time.sleep(1)
+        self.hardware.sleep(1)
 
         # Take and process the photo
         try:
@@ -306,7 +786,7 @@ class PhenoHiveStation:
         except Exception as e:
             self.register_error(type(e)(f"Error while taking the photo: {e}"))
             self.disp.show_collecting_data("Error while taking the photo")
-            time.sleep(5)
+            self.hardware.sleep(5)
             return 0, 0
 
         # Get weight
@@ -318,11 +798,11 @@ class PhenoHiveStation:
 
             # Measurement finished, display the weight
             self.disp.show_collecting_data(f"Weight : {round(weight, 2)}")
-            time.sleep(2)
+            self.hardware.sleep(2)
         except Exception as e:
             self.register_error(type(e)(f"Error while getting the weight: {e}"))
             self.disp.show_collecting_data("Error while getting the weight")
-            time.sleep(5)
+            self.hardware.sleep(5)
             return 0, 0
 
         # Send data to the DB
@@ -335,44 +815,300 @@ class PhenoHiveStation:
                 # Data could not be sent to the database but the measurements were still saved to the csv file
                 LOGGER.warning("Could not send data to the DB, no connection")
                 self.disp.show_collecting_data("Could not send data to the DB, no connection")
-            time.sleep(2)
+            self.hardware.sleep(2)
         except Exception as e:
             self.register_error(type(e)(f"Error while sending data to the DB: {e}"))
             self.disp.show_collecting_data("Error while sending data to the DB")
-            time.sleep(5)
+            self.hardware.sleep(5)
             return 0, 0
 
         LOGGER.info("Measurement pipeline finished")
         self.disp.show_collecting_data("Measurement pipeline finished")
-        time.sleep(1)
+        self.hardware.sleep(1)
         self.status = 0
         return growth_value, weight
 
-    def picture_pipeline(self) -> tuple[str, int]:
+    def concurrent_measurement_pipeline(self) -> tuple[int, float]:
+        """
+        Concurrent measurement pipeline: the load cell is sampled in the background while the camera warms up and the
+        photo is processed, and the data of the round is sent to the DB in the background while the next round is
+        prepared. The result of the send is reported at the next round (or by wait_pending_send).
+        The errors are registered with the same messages as in the sequential pipeline.
+        :return: a tuple with the growth value and the weight
+        """
+        LOGGER.info("Starting measurement pipeline (concurrent)")
+        self.status = 1
+        self.disp.show_collecting_data("Starting measurement pipeline")
+        timestamp = datetime.now().strftime(DATE_FORMAT)
+
+        # Sample the load cell during the camera warm-up
+        weight_future = self.weight_executor.submit(self.measure_weight)
+
+        # Take and process the photo
+        try:
+            self.disp.show_collecting_data("Taking photo")
+            pic, growth_value = self.picture_pipeline()
+            self.data["picture"] = pic
+            self.data["growth"] = growth_value
+        except Exception as e:
+            self.register_error(type(e)(f"Error while taking the photo: {e}"))
+            self.disp.show_collecting_data("Error while taking the photo")
+            self.hardware.sleep(5)
+            return 0, 0
+
+        # Get weight
+        try:
+            weight, std_dev = weight_future.result()
+            self.data["weight"] = weight
+            self.data["weight_g"] = weight * self.load_cell_cal
+            self.data["standard_deviation"] = std_dev
+            self.disp.show_collecting_data(f"Weight : {round(weight, 2)}")
+        except Exception as e:
+            self.register_error(type(e)(f"Error while getting the weight: {e}"))
+            self.disp.show_collecting_data("Error while getting the weight")
+            self.hardware.sleep(5)
+            return 0, 0
+
+        # Report the send of the previous round, then send this round in the background
+        sent = self.wait_pending_send()
+        self.pending_send = self.db_executor.submit(self.send_to_db, dict(self.data), timestamp)
+
+        LOGGER.info("Measurement pipeline finished")
+        self.disp.show_collecting_data("Measurement pipeline finished")
+        if sent:
+            self.status = 0
+        return growth_value, weight
+
+    def wait_pending_send(self) -> bool:
+        """
+        Wait for the background DB send of the previous round (concurrent pipeline) and report its result
+        :return: False if the send raised an error, True otherwise (or if there was no pending send)
+        """
+        if self.pending_send is None:
+            return True
+        future, self.pending_send = self.pending_send, None
+        try:
+            if future.result():
+                LOGGER.debug("Data sent to the DB")
+            else:
+                # Data could not be sent to the database but the measurements were still saved to the csv file
+                LOGGER.warning("Could not send data to the DB, no connection")
+        except Exception as e:
+            self.register_error(type(e)(f"Error while sending data to the DB: {e}"))
+            self.disp.show_collecting_data("Error while sending data to the DB")
+            self.hardware.sleep(5)
+            return False
+        return True
+
+    def queued_measurement_pipeline(self) -> tuple[float, float]:
+        """
+        Measurement pipeline with a background image analysis: the photo is taken and the plant is weighed, then the
+        measurement record is put on the analysis queue. The analysis worker completes the record with the plant
+        traits, then saves it and sends it to the DB with the capture time (see analysis_worker).
+        :return: a tuple with the growth value of the last analysed photo and the weight
+        """
+        LOGGER.info("Starting measurement pipeline (queued analysis)")
+        self.status = 1
+        self.disp.show_collecting_data("Starting measurement pipeline")
+        timestamp = datetime.now().strftime(DATE_FORMAT)
+        # In concurrent mode, sample the load cell during the camera warm-up
+        weight_future = self.weight_executor.submit(self.measure_weight) if self.weight_executor is not None else None
+
+        # Take the photo, the analysis is done by the worker
+        try:
+            self.disp.show_collecting_data("Taking photo")
+            pic, path_img, frame, jpeg = self.capture_and_display()
+            unchanged = False
+            if pic != "" and path_img != "":
+                unchanged = self.store_photo(path_img, frame, jpeg)
+            # The worker reads the photo from the image folder
+            del frame, jpeg
+        except Exception as e:
+            self.register_error(type(e)(f"Error while taking the photo: {e}"))
+            self.disp.show_collecting_data("Error while taking the photo")
+            self.hardware.sleep(5)
+            return 0, 0
+
+        # Get weight
+        try:
+            weight, std_dev = weight_future.result() if weight_future is not None else self.weight_pipeline()
+            self.data["weight"] = weight
+            self.data["weight_g"] = weight * self.load_cell_cal
+            self.data["standard_deviation"] = std_dev
+            self.disp.show_collecting_data(f"Weight : {round(weight, 2)}")
+            self.hardware.sleep(2)
+        except Exception as e:
+            self.register_error(type(e)(f"Error while getting the weight: {e}"))
+            self.disp.show_collecting_data("Error while getting the weight")
+            self.hardware.sleep(5)
+            return 0, 0
+
+        # Queue the photo analysis with the measurement record
+        try:
+            depth = self.analysis_queue.depth() + 1
+            # An unchanged photo is not analysed: its record carries the traits of the last analysed photo, so that
+            # they are known even if the job is processed after a reboot
+            record = dict(self.data, picture=pic, carried_forward=int(unchanged), queue_depth=depth)
+            if not unchanged:
+                record["growth"] = -1.0
+            self.analysis_queue.put(timestamp, "" if unchanged else path_img, record)
+            self._queue_event.set()
+        except Exception as e:
+            self.register_error(type(e)(f"Error while queuing the photo analysis: {e}"))
+            self.disp.show_collecting_data("Error while queuing the photo analysis")
+            self.hardware.sleep(5)
+            return 0, 0
+
+        LOGGER.info(f"Measurement pipeline finished, {depth} photo(s) waiting for analysis")
+        self.disp.show_collecting_data(f"Photo queued for analysis ({depth} waiting)")
+        self.hardware.sleep(1)
+        self.status = 0
+        return self.last_growth, weight
+
+    def analysis_worker(self) -> None:
+        """
+        Background image analysis worker (queued analysis mode): the queued photos are analysed in capture order, their
+        measurement record is completed with the plant traits (or the traits of the previous photo if it was
+        unchanged), then saved to the csv file and sent to the DB with the capture time.
+        A job is only removed from the queue once its record is saved, so that the pending jobs survive a reboot.
+        The worker does not use the display.
+        """
+        LOGGER.info(f"Analysis worker started, {self.analysis_queue.depth()} photo(s) waiting for analysis")
+        last_traits = None
+        while True:
+            try:
+                self._queue_event.clear()
+                job = self.analysis_queue.peek()
+                if job is None:
+                    self._queue_event.wait()
+                    continue
+                job_id, timestamp, path_img, record = job
+
+                if path_img != "":
+                    try:
+                        with TIMER.stage("analysis"):
+                            traits = analyse_image(image_path=path_img, channel=self.channel,
+                                                   kernel_size=self.kernel_size, engine=self.engine,
+                                                   pot_limit=self.pot_limit, fill_size=self.fill_size,
+                                                   cache=self.cache, downscale=self.downscale,
+                                                   tracker=self.roi_tracker, memory=self.work_memory)
+                        last_traits = traits._asdict()
+                        record.update(last_traits)
+                        # Traits carried forward by the next unchanged photos
+                        self.data.update(last_traits)
+                        LOGGER.debug(f"Plant traits of the photo taken at {timestamp} : {traits}")
+                    except KeyError:
+                        self.register_error(KeyError("Error while processing the photo, no segment found in the "
+                                                     "image. Check that the plant is clearly visible."))
+                        record["growth"] = 0.0
+                    except Exception as e:
+                        self.register_error(type(e)(f"Error while processing the photo: {e}"))
+                elif record["carried_forward"] and last_traits is not None:
+                    # The previous photo was analysed after this one was queued
+                    record.update(last_traits)
+
+                try:
+                    if not self.send_to_db(record, timestamp):
+                        LOGGER.warning("Could not send data to the DB, no connection")
+                except Exception as e:
+                    self.register_error(type(e)(f"Error while sending data to the DB: {e}"))
+                self.analysis_queue.done(job_id)
+                self.last_growth = record["growth"]
+                LOGGER.debug(f"Photo taken at {timestamp} analysed, {self.analysis_queue.depth()} photo(s) waiting")
+            except Exception as e:
+                # Keep the worker alive, the job is retried
+                self.register_error(type(e)(f"Error in the analysis worker: {e}"))
+                self.hardware.sleep(5)
+
+    @TIMER.stage("unchanged_check")
+    def store_photo(self, path_img: str, frame: np.ndarray | None, jpeg: np.ndarray | None) -> bool:
+        """
+        Check if the photo is unchanged since the previous one, and archive it (memory capture mode) unless it is
+        unchanged and archive_duplicates is disabled (it is then removed in file capture mode)
+        The archived photos are added to the image store (if enabled)
+        :param path_img: path to the photo
+        :param frame: the photo in memory, or None in file capture mode
+        :param jpeg: the JPEG data of the photo, or None in file capture mode
+        :return: True if the photo is unchanged
+        """
+        unchanged = self.is_unchanged(path_img, frame)
+        if unchanged and not self.archive_duplicates:
+            LOGGER.debug("Photo unchanged, not archived")
+            if jpeg is None:
+                os.remove(path_img)
+        elif jpeg is not None:
+            self.archive_photo(path_img, jpeg)
+        self.data["picture_hash"] = ""
+        if self.image_store is not None and os.path.exists(path_img):
+            with TIMER.stage("image_store"):
+                self.data["picture_hash"] = self.image_store.put_file(path_img)
+        return unchanged
+
+    @TIMER.stage("picture")
+    def picture_pipeline(self) -> tuple[str, float]:
         """
         Picture processing pipeline
+        The plant traits (skeleton branch points and tips, height, area, bounding box) are stored in the measurement
+        data along the growth value.
+        If the photo is unchanged since the previous measurement, the previous values are carried forward
+        (and the photo is not archived if archive_duplicates is disabled)
         :return: the picture and the growth value
         """
         # Take and display the photo
-        pic, path_img = self.capture_and_display()
+        pic, path_img, frame, jpeg = self.capture_and_display()
+        self.data["carried_forward"] = 0
+        if pic == "" or path_img == "":
+            return pic, -1.0
+
+        unchanged = self.store_photo(path_img, frame, jpeg)
+        if unchanged:
+            growth_value = self.data["growth"]
+            self.data["carried_forward"] = 1
+            LOGGER.debug(f"Photo unchanged, growth value carried forward : {growth_value}")
+            self.disp.show_collecting_data(f"Unchanged, growth : {round(growth_value, 2)}")
+            self.hardware.sleep(2)
+            return pic, growth_value
+
         self.disp.show_collecting_data("Processing photo")
-        time.sleep(1)
-        # Process the segment lengths to get the growth value
-        growth_value = -1
-        if pic != "" and path_img != "":
-            try:
-                growth_value = get_total_length(image_path=path_img, channel=self.channel, kernel_size=self.kernel_size)
-            except KeyError:
-                self.register_error(KeyError("Error while processing the photo, no segment found in the image."
-                                             "Check that the plant is clearly visible."))
-                self.disp.show_collecting_data("Error while processing the photo")
-                time.sleep(5)
-                return pic, 0
-            LOGGER.debug(f"Growth value : {growth_value}")
-            self.disp.show_collecting_data(f"Growth value : {round(growth_value, 2)}")
-            time.sleep(2)
+        self.hardware.sleep(1)
+        # Process the photo to get the growth value and the other plant traits
+        try:
+            with TIMER.stage("analysis"):
+                traits = analyse_image(image_path=path_img, channel=self.channel, kernel_size=self.kernel_size,
+                                       engine=self.engine, pot_limit=self.pot_limit, fill_size=self.fill_size,
+                                       cache=self.cache, image=frame, downscale=self.downscale,
+                                       tracker=self.roi_tracker, memory=self.work_memory)
+        except KeyError:
+            self.register_error(KeyError("Error while processing the photo, no segment found in the image."
+                                         "Check that the plant is clearly visible."))
+            self.disp.show_collecting_data("Error while processing the photo")
+            self.hardware.sleep(5)
+            return pic, 0.0
+        self.data.update(traits._asdict())
+        growth_value = traits.growth
+        LOGGER.debug(f"Plant traits : {traits}")
+        if self.cache is not None:
+            LOGGER.debug(f"Analysis cache: {self.cache.stats()}")
+        if self.work_memory is not None and self.work_memory.downscale > self.downscale:
+            LOGGER.debug(f"Photo processed at 1/{self.work_memory.downscale:g} of its resolution to stay within the "
+                         f"memory budget ({self.memory_budget:g} MB)")
+        self.disp.show_collecting_data(f"Growth value : {round(growth_value, 2)}")
+        self.hardware.sleep(2)
         return pic, growth_value
 
+    def save_read_health(self) -> None:
+        """
+        Store the health metrics of the last load cell reads in the measurement data, so that a slow or flaky load cell
+        is visible before it causes a failed measurement
+        """
+        health = self.hx.health.stats()
+        self.data["read_rate"] = round(health["reads_per_second"], 2)
+        self.data["failed_read_ratio"] = round(health["failed_ratio"], 3)
+        self.data["read_latency"] = round(health["latency_p95"], 4)
+        if health["failed_ratio"] > 0:
+            LOGGER.warning(f"Load cell: {health['failed_ratio']:.1%} of the last reads failed, read latency p95 "
+                           f"{health['latency_p95'] * 1000:.0f}ms")
+
     def weight_pipeline(self, n=10) -> tuple[float, float]:
         """
         Weight collection pipeline
@@ -380,37 +1116,22 @@ class PhenoHiveStation:
         :return: The median of the measurements (-1 in case of error) and the observed standard deviation
         """
         self.disp.show_collecting_data("Measuring weight")
+        return self.measure_weight(n)
+
+    @TIMER.stage("load_cell")
+    def measure_weight(self, n=10) -> tuple[float, float]:
+        """
+        Measure the weight of the plant, without using the display (may run in the background)
+        :param n: The number of measurements to take (default = 10)
+        :return: The median of the measurements (-1 in case of error) and the observed standard deviation
+        """
         start = time.time()
-        median_weight, std_dev = self.get_weight(n)
+        # With the load cell sampler, the weight is read immediately from the buffer
+        median_weight, std_dev = self.get_weight(n, fresh=False)
+        self.save_read_health()
         median_weight = median_weight - self.tare
         if median_weight == -1.0:
             return -1.0, -1.0
         elapsed = time.time() - start
         LOGGER.debug(f"Weight: {median_weight} in {elapsed}s (with standard deviation: {std_dev}")
         return median_weight, std_dev
-
-
-class DebugHx711(hx711.HX711):
-    """
-    DebugHx711 class, inherits from hx711.HX711
-    Modified to avoid the infinite loop in the _read function
-    """
-
-    def __init__(self, dout_pin, pd_sck_pin):
-        super().__init__(dout_pin, pd_sck_pin)
-
-    def _read(self, times: int = 10):
-        # Custom read function to debug (times=10 to reduce the time of the measurement)
-        return super()._read(times)
-
-    def get_raw_data(self, times: int = 5):
-        # Modified read function to debug (with a max of 1000 tries) to avoid infinite loops.
-        # Furthermore, we check if the data is valid (not False or -1) before appending it to the list
-        data_list = []
-        count = 0
-        while len(data_list) < times and count < 1000:
-            data = self._read()
-            if data not in [False, -1]:
-                data_list.append(data)
-            count += 1
-        return data_list
@@ -0,0 +1,144 @@
+"""
+Persistent cache of the image analysis results
+The results are keyed by the hash of the image content and the processing parameters, so that an image that was
+already analysed with the same parameters is never processed twice.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MAX_SIZE_MB = 50  # Default maximum size of the cache database (in MB)
+
+
+class AnalysisCache:
+    """
+    Content-addressed, size-bounded cache of analysis results stored in a SQLite database.
+    When the cache is full (number of entries or size of the database file), the least recently used entries are
+    evicted. The values must be JSON serializable.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_mb: float = MAX_SIZE_MB) -> None:
+        """
+        Open (or create) the cache
+        :param path: path to the SQLite database file
+        :param max_entries: maximum number of entries kept in the cache
+        :param max_mb: maximum size of the database file (in MB, 0 = no limit)
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_size = int(max_mb * 2 ** 20)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if self._db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Incremental auto-vacuum, so that the pages freed by the evictions are returned to the file system (a
+            # database created without it is rebuilt once)
+            self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._db.execute("VACUUM")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._db.commit()
+        self._size = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    @staticmethod
+    def make_key(content: bytes, *params) -> str:
+        """
+        Build a cache key from the image content and the processing parameters
+        :param content: raw image content (file bytes or pixel buffer)
+        :param params: processing parameters (e.g. channel, kernel size, engine version)
+        :return: the cache key
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        return digest + ":" + ":".join(str(p) for p in params)
+
+    def get(self, key: str) -> object | None:
+        """
+        Get a value from the cache and mark it as recently used
+        :param key: cache key (see make_key)
+        :return: the cached value, or None if the key is not in the cache
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: object) -> None:
+        """
+        Add a value to the cache, evicting the least recently used entries if the cache is full
+        :param key: cache key (see make_key)
+        :param value: value to store (JSON serializable)
+        """
+        with self._lock:
+            exists = self._db.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+            self._db.execute("INSERT OR REPLACE INTO results (key, value, last_used) VALUES (?, ?, ?)",
+                             (key, json.dumps(value), time.time()))
+            if not exists:
+                self._size += 1
+            if self._size > self.max_entries:
+                self._db.execute("DELETE FROM results WHERE key IN "
+                                 "(SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                                 (self._size - self.max_entries,))
+                self._size = self.max_entries
+            self._db.commit()
+            if self.max_size > 0:
+                self._enforce_size()
+
+    def _used_size(self) -> int:
+        """
+        Size of the database pages in use (the lock must be held)
+        :return: the size in bytes
+        """
+        pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+        free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * self._db.execute("PRAGMA page_size").fetchone()[0]
+
+    def _enforce_size(self) -> None:
+        """
+        Evict the least recently used entries while the database exceeds its maximum size, then shrink the file (the
+        lock must be held)
+        """
+        used = self._used_size()
+        if used <= self.max_size:
+            return
+        while used > self.max_size and self._size > 0:
+            # Evict the share of the entries matching the excess size (at least one entry)
+            count = max(1, -(-self._size * (used - self.max_size) // used))
+            self._db.execute("DELETE FROM results WHERE key IN "
+                             "(SELECT key FROM results ORDER BY last_used LIMIT ?)", (count,))
+            self._db.commit()
+            self._size = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            used = self._used_size()
+        # Run to completion (a single step of the pragma only frees one page)
+        self._db.executescript("PRAGMA incremental_vacuum;")
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics
+        :return: a dictionary with the number of hits, misses, the hit ratio, the number of entries and the size of the
+                 database file (in bytes)
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": self._size,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        }
+
+    def close(self) -> None:
+        """
+        Close the cache database
+        """
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,88 @@
+"""
+Persistent work queue of the photos waiting for image analysis
+The captures are stored in a SQLite database with their measurement record, so that the pending analyses survive a
+reboot and are processed in capture order by the background analysis worker.
+"""
+import json
+import sqlite3
+import threading
+
+
+class AnalysisQueue:
+    """
+    First-in first-out queue of image analysis jobs stored in a SQLite database.
+    A job is only removed from the queue once it is marked as done, so that a job interrupted by a reboot is processed
+    again. The records must be JSON serializable.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open (or create) the queue
+        :param path: path to the SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs "
+                         "(id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, path TEXT NOT NULL, "
+                         "record TEXT NOT NULL)")
+        self._db.commit()
+
+    def put(self, timestamp: str, path: str, record: dict) -> int:
+        """
+        Add a job at the end of the queue
+        :param timestamp: capture time of the photo
+        :param path: path to the photo ("" if the photo does not need to be analysed)
+        :param record: measurement record of the capture, completed by the analysis
+        :return: the id of the job
+        """
+        with self._lock:
+            cursor = self._db.execute("INSERT INTO jobs (timestamp, path, record) VALUES (?, ?, ?)",
+                                      (timestamp, path, json.dumps(record)))
+            self._db.commit()
+        return cursor.lastrowid
+
+    def peek(self) -> tuple[int, str, str, dict] | None:
+        """
+        Get the oldest job of the queue, without removing it (see done)
+        :return: a tuple (id, timestamp, path, record), or None if the queue is empty
+        """
+        with self._lock:
+            row = self._db.execute("SELECT id, timestamp, path, record FROM jobs ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        job_id, timestamp, path, record = row
+        return job_id, timestamp, path, json.loads(record)
+
+    def done(self, job_id: int) -> None:
+        """
+        Remove a processed job from the queue
+        :param job_id: id of the job
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._db.commit()
+
+    def depth(self) -> int:
+        """
+        Number of jobs waiting in the queue (including the job being processed)
+        :return: the depth of the queue
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def oldest(self) -> str | None:
+        """
+        Capture time of the oldest job of the queue, to measure how far the analysis is behind the captures
+        :return: the timestamp of the oldest job, or None if the queue is empty
+        """
+        with self._lock:
+            row = self._db.execute("SELECT timestamp FROM jobs ORDER BY id LIMIT 1").fetchone()
+        return None if row is None else row[0]
+
+    def close(self) -> None:
+        """
+        Close the queue database
+        """
+        with self._lock:
+            self._db.close()
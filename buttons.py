@@ -0,0 +1,145 @@
+"""
+Event-driven button handling: the button presses are detected by GPIO edge-detection callbacks, debounced and delivered
+to the menus through a queue, so that the menus block while waiting for a press instead of polling the buttons.
+Also contains a simulated GPIO backend to run the menus without a Raspberry Pi.
+"""
+import queue
+import threading
+import time
+
+BOUNCE_TIME = 200  # Minimum time between two presses of the same button (in milliseconds)
+
+
+class ButtonEvents:
+    """
+    Queue of the button presses, filled by the GPIO edge-detection callbacks
+    """
+
+    def __init__(self, gpio, pins: dict[str, int], bouncetime: int = BOUNCE_TIME) -> None:
+        """
+        Register the edge-detection callbacks of the buttons (the pins must already be set up as pulled-up inputs)
+        :param gpio: GPIO module (RPi.GPIO) or SimulatedGPIO instance
+        :param pins: GPIO pin of each button, by button name (e.g. {"left": 21, "right": 16})
+        :param bouncetime: minimum time between two presses of the same button (in milliseconds)
+        """
+        self.gpio = gpio
+        self.pins = dict(pins)
+        self.bouncetime = bouncetime
+        self.events = queue.Queue()
+        self._names = {pin: name for name, pin in self.pins.items()}
+        self._last_press = {pin: 0.0 for pin in self._names}
+        self._lock = threading.Lock()
+        for pin in self._names:
+            gpio.add_event_detect(pin, gpio.FALLING, callback=self._on_edge, bouncetime=bouncetime)
+
+    def _on_edge(self, pin: int) -> None:
+        """
+        Edge-detection callback (called from the GPIO thread): queue the press if the button is still pressed and was
+        not pressed during the bounce time
+        :param pin: GPIO pin of the button
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_press[pin] < self.bouncetime / 1000:
+                return
+            self._last_press[pin] = now
+        # The buttons are active low, ignore the glitches that are already released
+        if self.gpio.input(pin):
+            return
+        self.events.put(self._names[pin])
+
+    def wait(self, timeout: float | None = None) -> str | None:
+        """
+        Wait for the next button press
+        :param timeout: maximum time to wait (in seconds, default = None, wait forever)
+        :return: the name of the pressed button, or None if no button was pressed before the timeout
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def poll(self) -> str | None:
+        """
+        Get the next button press without waiting
+        :return: the name of the pressed button, or None if no button was pressed
+        """
+        return self.wait(timeout=0)
+
+    def clear(self) -> None:
+        """
+        Discard the pending button presses
+        """
+        while self.poll() is not None:
+            pass
+
+    def close(self) -> None:
+        """
+        Remove the edge-detection callbacks
+        """
+        for pin in self._names:
+            self.gpio.remove_event_detect(pin)
+
+
+class SimulatedGPIO:
+    """
+    Stand-in for RPi.GPIO, keeps the pin levels in memory and calls the edge-detection callbacks when a button press is
+    simulated with press(). Only the subset of the RPi.GPIO API used by the station is implemented.
+    """
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_UP = 22
+    PUD_DOWN = 21
+    FALLING = 32
+    RISING = 31
+    BOTH = 33
+
+    def __init__(self) -> None:
+        self.levels = {}
+        self.callbacks = {}
+
+    def setwarnings(self, flag: bool) -> None:
+        pass
+
+    def setmode(self, mode: int) -> None:
+        pass
+
+    def setup(self, pin: int, direction: int, pull_up_down: int | None = None, initial: int | None = None) -> None:
+        if direction == self.IN:
+            self.levels[pin] = self.LOW if pull_up_down == self.PUD_DOWN else self.HIGH
+        else:
+            self.levels[pin] = self.LOW if initial is None else initial
+
+    def input(self, pin: int) -> int:
+        return self.levels.get(pin, self.HIGH)
+
+    def output(self, pin: int, value: int) -> None:
+        self.levels[pin] = value
+
+    def add_event_detect(self, pin: int, edge: int, callback=None, bouncetime: int | None = None) -> None:
+        self.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin: int) -> None:
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self) -> None:
+        self.callbacks.clear()
+
+    def press(self, pin: int, duration: float = 0.05) -> None:
+        """
+        Simulate a button press (active low): the pin goes low, the callback is called, then the pin is released
+        :param pin: GPIO pin of the button
+        :param duration: time the button stays pressed (in seconds)
+        """
+        self.levels[pin] = self.LOW
+        edge, callback = self.callbacks.get(pin, (None, None))
+        if callback is not None and edge in (self.FALLING, self.BOTH):
+            callback(pin)
+        time.sleep(duration)
+        self.levels[pin] = self.HIGH
+        if callback is not None and edge in (self.RISING, self.BOTH):
+            callback(pin)
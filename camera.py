@@ -0,0 +1,277 @@
+"""
+Camera helpers: in-memory capture, a camera manager keeping the camera warm between captures, and a fake camera to run
+the capture pipeline without a Raspberry Pi camera
+"""
+import glob
+import logging
+import time
+import cv2
+import numpy as np
+
+LOGGER = logging.getLogger("PhenoHive")
+JPEG_QUALITY = 90  # Quality of the archived JPEG images (OpenCV default is 95)
+SETTLE_TIMEOUT = 8.0  # Maximum time to wait for the auto exposure and white balance to converge (in seconds)
+SETTLE_TOLERANCE = 0.02  # Maximum relative change of the exposure and colour gains between two converged frames
+SETTLE_FRAMES = 3  # Number of consecutive frames with stable metadata required for the convergence
+
+
+def encode_jpeg(frame: np.ndarray, quality: int = JPEG_QUALITY) -> np.ndarray:
+    """
+    Encode a frame to JPEG in memory
+    :param frame: BGR frame
+    :param quality: JPEG quality (0-100)
+    :raises RuntimeError: If the frame could not be encoded
+    :return: the JPEG data as a 1D uint8 array (supports the buffer protocol, e.g. for base64 or file writes)
+    """
+    ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Could not encode the frame to JPEG")
+    return data
+
+
+def exposure_settled(previous: dict | None, metadata: dict, tolerance: float = SETTLE_TOLERANCE) -> bool:
+    """
+    Check if the auto exposure and white balance are converged, from the metadata of two consecutive frames
+    The AeLocked flag is used when the camera reports it, the white balance is converged when the colour gains are
+    stable, and the exposure when the product of the exposure time and the analogue gain is stable.
+    :param previous: metadata of the previous frame, or None
+    :param metadata: metadata of the current frame
+    :param tolerance: maximum relative change between the two frames
+    :return: True if the exposure and white balance are converged
+    """
+    if previous is None:
+        return False
+    if not metadata.get("AeLocked", True):
+        return False
+
+    def stable(old: float, new: float) -> bool:
+        return abs(new - old) <= tolerance * max(abs(old), 1e-9)
+
+    exposure = metadata.get("ExposureTime", 0) * metadata.get("AnalogueGain", 1.0)
+    previous_exposure = previous.get("ExposureTime", 0) * previous.get("AnalogueGain", 1.0)
+    gains = metadata.get("ColourGains", (1.0, 1.0))
+    previous_gains = previous.get("ColourGains", (1.0, 1.0))
+    return stable(previous_exposure, exposure) and all(stable(old, new) for old, new in zip(previous_gains, gains))
+
+
+class CameraManager:
+    """
+    Camera session configured once and kept warm between captures (or restarted for each capture if keep_warm is
+    disabled). Instead of a fixed warm-up delay, each capture waits until the metadata of the frames report a converged
+    auto exposure and white balance, with a maximum timeout. The settle time of each capture is recorded.
+    """
+
+    def __init__(self, cam, keep_warm: bool = True, settle_timeout: float = SETTLE_TIMEOUT,
+                 tolerance: float = SETTLE_TOLERANCE, stable_frames: int = SETTLE_FRAMES, preview=None) -> None:
+        """
+        Initialize the camera manager
+        :param cam: Picamera2 (or FakeCamera) instance, already configured
+        :param keep_warm: keep the camera running between captures (default = True)
+        :param settle_timeout: maximum time to wait for the convergence of the exposure (in seconds)
+        :param tolerance: maximum relative change of the exposure and colour gains between two converged frames
+        :param stable_frames: number of consecutive converged frames required
+        :param preview: preview started with the camera (e.g. Preview.NULL), or None
+        """
+        self.cam = cam
+        self.keep_warm = keep_warm
+        self.settle_timeout = settle_timeout
+        self.tolerance = tolerance
+        self.stable_frames = stable_frames
+        self.preview = preview
+        self.running = False
+        self.settle_time = -1.0  # Settle time of the last capture (in seconds)
+        self.settled = False  # True if the exposure of the last capture converged before the timeout
+        self.captures = 0
+
+    def start(self) -> None:
+        """
+        Start the camera (if not already running)
+        """
+        if self.running:
+            return
+        if self.preview is not None:
+            self.cam.start_preview(self.preview)
+        self.cam.start()
+        self.running = True
+
+    def stop(self) -> None:
+        """
+        Stop the camera (if running)
+        """
+        if not self.running:
+            return
+        self.cam.stop()
+        if self.preview is not None:
+            self.cam.stop_preview()
+        self.running = False
+
+    def close(self) -> None:
+        """
+        Stop and close the camera
+        """
+        self.stop()
+        self.cam.close()
+
+    def wait_settled(self, timeout: float | None = None) -> float:
+        """
+        Wait until the auto exposure and white balance are converged, or until the timeout
+        :param timeout: maximum time to wait (in seconds, default = settle_timeout)
+        :return: the settle time (in seconds)
+        """
+        timeout = self.settle_timeout if timeout is None else timeout
+        start = time.monotonic()
+        previous = None
+        stable = 0
+        self.settled = False
+        while time.monotonic() - start < timeout:
+            # Blocks until the next frame
+            metadata = self.cam.capture_metadata()
+            stable = stable + 1 if exposure_settled(previous, metadata, self.tolerance) else 0
+            previous = metadata
+            if stable >= self.stable_frames:
+                self.settled = True
+                break
+        self.settle_time = time.monotonic() - start
+        if not self.settled:
+            LOGGER.warning(f"Camera exposure not converged after {timeout}s")
+        return self.settle_time
+
+    def capture_array(self, timeout: float | None = None, settle: bool = True) -> np.ndarray:
+        """
+        Capture a frame in memory once the exposure is converged
+        :param timeout: maximum time to wait for the convergence (in seconds, default = settle_timeout)
+        :param settle: wait for the convergence (default = True), e.g. False for the preview frames of a warm camera
+        :return: the frame as a BGR array
+        """
+        self.start()
+        try:
+            if settle:
+                self.wait_settled(timeout)
+            frame = self.cam.capture_array("main")
+            self.captures += 1
+        finally:
+            if not self.keep_warm:
+                self.stop()
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            # XBGR8888 frames have a dummy alpha channel
+            frame = frame[..., :3]
+        return frame
+
+    def capture_file(self, file_output: str, timeout: float | None = None, settle: bool = True) -> None:
+        """
+        Capture a photo to a file once the exposure is converged
+        :param file_output: path of the file to write
+        :param timeout: maximum time to wait for the convergence (in seconds, default = settle_timeout)
+        :param settle: wait for the convergence (default = True)
+        """
+        self.start()
+        try:
+            if settle:
+                self.wait_settled(timeout)
+            self.cam.capture_file(file_output)
+            self.captures += 1
+        finally:
+            if not self.keep_warm:
+                self.stop()
+
+
+class FakeCamera:
+    """
+    Stand-in for Picamera2 that returns sample images (or a synthetic frame) instead of capturing from a sensor.
+    Only the subset of the Picamera2 API used by the station is implemented.
+    """
+
+    def __init__(self, images: str = "", size: tuple[int, int] = (640, 480), frame_rate: float = 30.0,
+                 settle_frames: int = 10) -> None:
+        """
+        Initialize the fake camera
+        :param images: glob pattern of the sample images to return in turn (default: synthetic frames)
+        :param size: size (width, height) of the synthetic frames
+        :param frame_rate: simulated frame rate, capture_metadata waits for the next frame
+        :param settle_frames: number of frames after the start before the simulated auto exposure is converged
+        """
+        self.images = sorted(glob.glob(images)) if images else []
+        self.size = size
+        self.frame_rate = frame_rate
+        self.settle_frames = settle_frames
+        self.started = False
+        self.captures = 0
+        self.frames = 0  # Number of frames since the start
+
+    def create_preview_configuration(self, main: dict | None = None, **kwargs) -> dict:
+        return {"main": main or {}, **kwargs}
+
+    def create_still_configuration(self, main: dict | None = None, **kwargs) -> dict:
+        return {"main": main or {}, **kwargs}
+
+    def configure(self, config: dict) -> None:
+        size = config.get("main", {}).get("size")
+        if size is not None:
+            self.size = tuple(size)
+
+    def start_preview(self, *args, **kwargs) -> None:
+        pass
+
+    def stop_preview(self) -> None:
+        pass
+
+    def start(self) -> None:
+        self.started = True
+        self.frames = 0
+
+    def stop(self) -> None:
+        self.started = False
+
+    def close(self) -> None:
+        self.stop()
+
+    def capture_metadata(self) -> dict:
+        """
+        Wait for the next frame and return its metadata: the simulated exposure converges exponentially and is locked
+        after settle_frames frames
+        :raises RuntimeError: If the camera is not started
+        :return: the frame metadata (same keys as Picamera2)
+        """
+        if not self.started:
+            raise RuntimeError("Camera must be started before capturing")
+        time.sleep(1 / self.frame_rate)
+        self.frames += 1
+        remaining = max(0, self.settle_frames - self.frames)
+        error = 1 - 0.5 ** remaining
+        return {
+            "AeLocked": remaining == 0,
+            "ExposureTime": int(10000 * (1 + error)),
+            "AnalogueGain": 1.0 + error,
+            "ColourGains": (1.8 + 0.5 * error, 1.5 - 0.3 * error),
+            "Lux": 400.0
+        }
+
+    def capture_array(self, name: str = "main") -> np.ndarray:
+        """
+        Return the next sample image, or a synthetic frame (a dark vertical stem with two leaves on a light background)
+        :param name: stream name (ignored)
+        :raises RuntimeError: If the camera is not started
+        :return: the frame as a BGR array
+        """
+        if not self.started:
+            raise RuntimeError("Camera must be started before capturing")
+        self.captures += 1
+        if self.images:
+            frame = cv2.imread(self.images[(self.captures - 1) % len(self.images)], cv2.IMREAD_COLOR)
+            if frame is not None:
+                return frame
+        width, height = self.size
+        frame = np.full((height, width, 3), 230, np.uint8)
+        cv2.line(frame, (width // 2, height - 20), (width // 2, height // 4), (40, 120, 40), 6)
+        cv2.line(frame, (width // 2, height // 2), (width // 2 + width // 6, height // 3), (40, 120, 40), 5)
+        cv2.line(frame, (width // 2, height // 2 + 30), (width // 2 - width // 6, height // 3 + 40), (40, 120, 40), 5)
+        return frame
+
+    def capture_file(self, file_output: str, name: str = "main") -> None:
+        """
+        Capture a frame and save it as a JPEG file
+        :param file_output: path of the file to write
+        :param name: stream name (ignored)
+        """
+        with open(file_output, "wb") as f:
+            f.write(encode_jpeg(self.capture_array(name)))
@@ -0,0 +1,92 @@
+"""
+Cached health of the connection to the DB: the DB is pinged at most once per check interval while it is reachable, and
+with an exponential backoff while it is not, instead of before every write. The results of the writes also update the
+health without a ping.
+"""
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger("PhenoHive")
+CHECK_INTERVAL = 300.0  # Time during which a reachable DB is not pinged again (in seconds)
+MIN_BACKOFF = 10.0  # Time before the first retry after a failed ping or write (in seconds)
+MAX_BACKOFF = 600.0  # Maximum time between two retries (in seconds)
+
+
+class ConnectionHealth:
+    """
+    Connection state of the DB, updated by pings (when the cached state expired) and by the results of the writes
+    """
+
+    def __init__(self, ping, check_interval: float = CHECK_INTERVAL, min_backoff: float = MIN_BACKOFF,
+                 max_backoff: float = MAX_BACKOFF, clock=time.monotonic) -> None:
+        """
+        Initialize the connection health, the DB is pinged at the first check
+        :param ping: function returning True if the DB is reachable (e.g. InfluxDBClient.ping)
+        :param check_interval: time during which a reachable DB is not pinged again (in seconds)
+        :param min_backoff: time before the first retry after a failure (in seconds), doubled after each failure
+        :param max_backoff: maximum time between two retries (in seconds)
+        :param clock: monotonic clock function (default = time.monotonic)
+        """
+        self.ping = ping
+        self.check_interval = check_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.connected = False
+        self.failures = 0  # Number of consecutive failures
+        self.pings = 0  # Number of pings sent
+        self._next_check = clock()  # Time of the next ping
+        self._lock = threading.Lock()
+
+    def is_up(self) -> bool:
+        """
+        Get the state of the connection, pinging the DB only if the cached state expired
+        :return: True if the DB is considered reachable
+        """
+        with self._lock:
+            if self.clock() < self._next_check:
+                return self.connected
+            self.pings += 1
+        try:
+            reachable = bool(self.ping())
+        except Exception as e:
+            LOGGER.debug(f"DB ping failed: {type(e).__name__}: {e}")
+            reachable = False
+        if reachable:
+            self.report_success()
+        else:
+            self.report_failure()
+        return reachable
+
+    def report_success(self) -> None:
+        """
+        Record a successful ping or write: the DB is not pinged during the check interval
+        """
+        with self._lock:
+            if not self.connected:
+                LOGGER.info("DB reachable")
+            self.connected = True
+            self.failures = 0
+            self._next_check = self.clock() + self.check_interval
+
+    def report_failure(self) -> None:
+        """
+        Record a failed ping or write: the DB is considered unreachable until the next retry, after an exponential
+        backoff
+        """
+        with self._lock:
+            backoff = min(self.max_backoff, self.min_backoff * 2 ** self.failures)
+            if self.connected or self.failures == 0:
+                LOGGER.warning(f"DB unreachable, next retry in {backoff:g}s")
+            self.connected = False
+            self.failures += 1
+            self._next_check = self.clock() + backoff
+
+    def time_until_check(self) -> float:
+        """
+        Time until the cached state expires
+        :return: the time in seconds (0 if the next check pings the DB)
+        """
+        with self._lock:
+            return max(0.0, self._next_check - self.clock())
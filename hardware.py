@@ -0,0 +1,318 @@
+"""
+Hardware abstraction layer of the station: the display, load cell, camera, GPIO and database drivers are created by the
+backend selected in the [Hardware] section of config.ini.
+The real drivers (default) are only imported when they are used, so that the simulated backend can run the whole
+measurement loop without a Raspberry Pi: the load cell replays recorded HX711 samples, the camera returns sample images,
+the display is rendered to an in-memory framebuffer and the database points are recorded locally. The simulated time can
+be accelerated to run the measurement loop headless as a load and regression benchmark (see tools/simulate.py).
+"""
+import logging
+import os
+import random
+import threading
+import time
+import numpy as np
+from buttons import SimulatedGPIO
+from camera import FakeCamera
+from load_cell_sampler import ReadHealth, READ_TIMEOUT, read_samples
+
+LOGGER = logging.getLogger("PhenoHive")
+BACKENDS = ("real", "simulated")
+DEVICES = ("display", "load_cell", "camera", "gpio", "database")
+HX711_DOUT_PIN = 5
+HX711_SCK_PIN = 6
+HX711_SAMPLE_RATE = 10.0  # Output data rate of the HX711 (in samples per second, 10 or 80)
+SIMULATED_FRAME_RATE = 30.0  # Frame rate of the simulated camera (in frames per second)
+
+
+class Hardware:
+    """
+    Factory of the station drivers, with the backend of each device read from the [Hardware] section of the config file
+    """
+
+    def __init__(self, config=None) -> None:
+        """
+        Initialize the factory
+        :param config: [Hardware] section of the config file (or a dictionary), None for the real drivers
+        :raises ValueError: If a backend is unknown or the speed-up factor is not positive
+        """
+        config = {} if config is None else config
+        default = str(config.get("backend", "real"))
+        # The backend of each device can be overridden, e.g. `camera = simulated` to run without the camera module
+        self.backends = {device: str(config.get(device, "") or default) for device in DEVICES}
+        for device, backend in self.backends.items():
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown {device} backend '{backend}', should be one of {BACKENDS}")
+        self.hx711_samples = str(config.get("hx711_samples", ""))
+        self.sample_images = str(config.get("sample_images", ""))
+        self.framebuffer_folder = str(config.get("framebuffer_folder", ""))
+        self.influx_file = str(config.get("influx_file", ""))
+        # The time is only accelerated when no real device is used
+        self.speedup = float(config.get("speedup", "1")) if self.simulated else 1.0
+        if self.speedup <= 0:
+            raise ValueError(f"The speed-up factor must be positive, got {self.speedup}")
+
+    @property
+    def simulated(self) -> bool:
+        """
+        True if all the devices are simulated
+        """
+        return all(backend == "simulated" for backend in self.backends.values())
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Wait for the given (simulated) time, e.g. to leave a message on the display
+        :param seconds: time to wait (in seconds), divided by the speed-up factor
+        """
+        time.sleep(seconds / self.speedup)
+
+    def display(self, width: int, height: int, dc: int, rst: int, spi_port: int, spi_device: int, speed_hz: int):
+        """
+        Create the display driver
+        :return: the ST7735 display, or a FramebufferDisplay
+        """
+        if self.backends["display"] == "simulated":
+            return FramebufferDisplay(width, height, self.framebuffer_folder)
+        import Adafruit_GPIO.SPI as SPI
+        import ST7735 as TFT
+        return TFT.ST7735(dc, rst=rst, spi=SPI.SpiDev(spi_port, spi_device, max_speed_hz=speed_hz))
+
+    def load_cell(self, read_timeout: float = READ_TIMEOUT):
+        """
+        Create the load cell driver
+        :param read_timeout: maximum time to wait for a sample (in seconds)
+        :return: the DebugHx711 load cell, or a ReplayHx711
+        """
+        if self.backends["load_cell"] == "simulated":
+            return ReplayHx711(self.hx711_samples, HX711_SAMPLE_RATE * self.speedup, read_timeout / self.speedup)
+        from load_cell import DebugHx711
+        return DebugHx711(dout_pin=HX711_DOUT_PIN, pd_sck_pin=HX711_SCK_PIN, read_timeout=read_timeout)
+
+    def camera(self) -> tuple[object, object]:
+        """
+        Create the camera driver
+        :return: a tuple with the Picamera2 camera and its null preview, or a FakeCamera and None
+        """
+        if self.backends["camera"] == "simulated":
+            return FakeCamera(self.sample_images, frame_rate=SIMULATED_FRAME_RATE * self.speedup), None
+        from picamera2 import Picamera2, Preview
+        return Picamera2(), Preview.NULL
+
+    def gpio(self):
+        """
+        Create the GPIO driver
+        :return: the RPi.GPIO module, or a SimulatedGPIO
+        """
+        if self.backends["gpio"] == "simulated":
+            return SimulatedGPIO()
+        import RPi.GPIO as GPIO
+        return GPIO
+
+    def database(self, url: str, token: str, org: str, gzip: bool = False, batch_size: int = 0,
+                 flush_interval: int = 10000, max_retries: int = 3, success_callback=None,
+                 error_callback=None) -> tuple[object, object, object]:
+        """
+        Create the database client
+        :param url: url of the InfluxDB server
+        :param token: InfluxDB token
+        :param org: InfluxDB organization
+        :param gzip: compress the write requests (default = False)
+        :param batch_size: number of points per write request of the batching write API (0 = synchronous writes)
+        :param flush_interval: maximum time a point waits in the batch before it is written (in milliseconds)
+        :param max_retries: number of retries of a failed batch
+        :param success_callback: batching write API callback (conf, data) called after a successful write
+        :param error_callback: batching write API callback (conf, data, exception) called when a batch is dropped
+        :return: a tuple with the client, its write API and a synchronous write API (the same one without batching),
+                 used when the result of each write is needed (e.g. to drain the offline spool)
+        """
+        if self.backends["database"] == "simulated":
+            client = MemoryInfluxClient(self.influx_file)
+            write_api = client.write_api(success_callback=success_callback)
+            return client, write_api, write_api
+        from influxdb_client import InfluxDBClient, WriteOptions
+        from influxdb_client.client.write_api import SYNCHRONOUS
+        client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=gzip)
+        sync_api = client.write_api(write_options=SYNCHRONOUS)
+        if batch_size <= 0:
+            return client, sync_api, sync_api
+        options = WriteOptions(batch_size=batch_size, flush_interval=flush_interval, jitter_interval=0,
+                               max_retries=max_retries)
+        return client, client.write_api(write_options=options, success_callback=success_callback,
+                                        error_callback=error_callback), sync_api
+
+
+class ReplayHx711:
+    """
+    Stand-in for DebugHx711 replaying recorded raw samples in turn (or synthetic samples) at the HX711 data rate.
+    The failed reads of the recording (False or -1) are replayed as timed-out reads and filtered like by DebugHx711.
+    """
+
+    def __init__(self, samples: str = "", sample_rate: float = HX711_SAMPLE_RATE, read_timeout: float = READ_TIMEOUT,
+                 seed: int = 0) -> None:
+        """
+        Initialize the load cell
+        :param samples: path to a file of raw samples, one per line (default: synthetic samples)
+        :param sample_rate: simulated data rate (in samples per second)
+        :param read_timeout: duration of a failed read (in seconds)
+        :param seed: seed of the synthetic samples, so that the simulated runs are reproducible
+        """
+        self.samples = load_samples(samples) if samples else []
+        self.sample_rate = sample_rate
+        self.read_timeout = read_timeout
+        self.reads = 0
+        self.health = ReadHealth()
+        self._random = random.Random(seed)
+
+    def reset(self) -> bool:
+        self.reads = 0
+        return True
+
+    def _read(self, times: int = 1) -> int | bool:
+        """
+        Wait for the next sample and return it
+        :param times: ignored
+        :return: the raw sample, or False/-1 for a failed read
+        """
+        start = time.monotonic()
+        self.reads += 1
+        if self.samples:
+            sample = self.samples[(self.reads - 1) % len(self.samples)]
+        else:
+            # Noisy constant weight, with an occasional outlier
+            sample = 100000 + self._random.gauss(0, 50)
+            if self._random.random() < 0.01:
+                sample += self._random.choice((-1, 1)) * 5000
+            sample = int(sample)
+        failed = sample in [False, -1]
+        time.sleep(self.read_timeout if failed else 1 / self.sample_rate)
+        self.health.record(time.monotonic() - start, not failed)
+        return sample
+
+    def get_raw_data(self, times: int = 5) -> list[int]:
+        return read_samples(self._read, times, self.read_timeout)
+
+
+def load_samples(path: str) -> list[int | bool]:
+    """
+    Load recorded raw HX711 samples (see `tools/simulate.py record`)
+    :param path: path to the file, one sample per line (empty lines and lines starting with # are ignored)
+    :raises RuntimeError: If the file contains no sample
+    :return: the list of samples (False for the failed reads recorded as "False")
+    """
+    samples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            samples.append(False if line == "False" else int(float(line)))
+    if not samples:
+        raise RuntimeError(f"No sample found in {path}")
+    return samples
+
+
+class FramebufferDisplay:
+    """
+    Stand-in for the ST7735 display rendering the screens to an in-memory RGB framebuffer.
+    The last screen is also saved as a PNG file if a folder is given.
+    """
+
+    def __init__(self, width: int, height: int, folder: str = "") -> None:
+        """
+        Initialize the display
+        :param width: width of the display (in pixels)
+        :param height: height of the display (in pixels)
+        :param folder: folder where the last screen is saved (default: memory only)
+        """
+        self.width = width
+        self.height = height
+        self.folder = folder
+        self.framebuffer = np.zeros((height, width, 3), np.uint8)
+        self.frames = 0  # Number of screens displayed
+
+    def begin(self) -> None:
+        pass
+
+    def clear(self) -> None:
+        self.framebuffer[:] = 0
+
+    def display(self, image) -> None:
+        """
+        Render a screen to the framebuffer
+        :param image: PIL image of the screen, resized to the display size if needed
+        """
+        image = image.convert("RGB")
+        if image.size != (self.width, self.height):
+            image = image.resize((self.width, self.height))
+        self.framebuffer[:] = np.asarray(image)
+        self.frames += 1
+        if self.folder:
+            image.save(os.path.join(self.folder, "screen.png"))
+
+
+class MemoryInfluxClient:
+    """
+    Stand-in for the InfluxDB client recording the written points in memory (and appending them to a line protocol file
+    if a path is given). Only the subset of the influxdb_client API used by the station is implemented.
+    """
+
+    def __init__(self, path: str = "", max_points: int = 100000) -> None:
+        """
+        Initialize the client
+        :param path: path to the line protocol file (default: memory only)
+        :param max_points: maximum number of points kept in memory (the oldest are dropped)
+        """
+        self.path = path
+        self.max_points = max_points
+        self.points = []  # Written points as (bucket, line protocol)
+        self.writes = 0  # Number of write calls
+        self.success_callback = None
+        self._lock = threading.Lock()
+
+    def ping(self) -> bool:
+        return True
+
+    def write_api(self, write_options=None, success_callback=None, **kwargs) -> 'MemoryInfluxClient':
+        self.success_callback = success_callback
+        return self
+
+    def write(self, bucket: str, org: str = "", record=None, **kwargs) -> None:
+        """
+        Record points
+        :param bucket: destination bucket
+        :param org: destination organization (ignored)
+        :param record: a Point, a line protocol string or a list of them
+        """
+        lines = [line for line in _line_protocol(record) if line]
+        with self._lock:
+            self.writes += 1
+            self.points.extend((bucket, line) for line in lines)
+            del self.points[:-self.max_points]
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.writelines(line + "\n" for line in lines)
+        if self.success_callback is not None:
+            self.success_callback((bucket, org, "ns"), "\n".join(lines))
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _line_protocol(record) -> list[str]:
+    """
+    Convert a record to line protocol
+    :param record: a Point, a line protocol string, None or a list of them
+    :return: the list of lines
+    """
+    if record is None:
+        return []
+    if isinstance(record, (list, tuple)):
+        return [line for item in record for line in _line_protocol(item)]
+    if isinstance(record, bytes):
+        record = record.decode()
+    if isinstance(record, str):
+        return record.splitlines()
+    return [record.to_line_protocol()]
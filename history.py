@@ -0,0 +1,299 @@
+"""
+Query of the measurement history saved by the station (see measurement_store.py), as NumPy arrays
+The files are memory-mapped and only the index blocks overlapping the requested time range are parsed, the columns are
+converted to arrays at once (the times with the NumPy datetime parser), so that a few days are read instantly and years
+of measurements in seconds. Used by tools/query.py.
+"""
+import mmap
+import os
+import re
+import time
+import numpy as np
+from measurement_store import segments, load_index, block_ranges, format_time, TIME_FORMAT
+
+STATISTICS = ("mean", "min", "max")
+EXPORT_FORMATS = ("csv", "npz", "parquet")
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(text: str) -> float:
+    """
+    Parse a duration such as 90s, 15m, 1h, 7d or 2w
+    :param text: number followed by a unit (s, m, h, d or w), seconds if there is no unit
+    :raises ValueError: If the duration is invalid
+    :return: the duration in seconds
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw]?)", text.strip())
+    if match is None:
+        raise ValueError(f"Invalid duration '{text}', expected e.g. 90s, 15m, 1h, 7d or 2w")
+    return float(match.group(1)) * UNITS[match.group(2) or "s"]
+
+
+def parse_when(text: str, now: float | None = None) -> float:
+    """
+    Parse a time: a date (2024-05-01), a date and time (2024-05-01T12:00:00, with an optional Z) or a time relative to
+    now (-7d)
+    :param text: the time
+    :param now: current time in seconds since the epoch, in the time of the files (default = the local time, like the
+    station writes it)
+    :raises ValueError: If the time is invalid
+    :return: the time in seconds since the epoch, comparable to the times of the files
+    """
+    if text.startswith("-"):
+        if now is None:
+            now = time.time() + time.localtime().tm_gmtoff
+        return now - parse_duration(text[1:])
+    return float(np.datetime64(text.strip().rstrip("Z"), "s").astype(np.int64))
+
+
+def to_array(values: list[str]) -> np.ndarray:
+    """
+    Convert the values of a column to an array
+    :param values: values as strings
+    :return: a float array, or a string array if a value is not a number
+    """
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        return np.array(values, dtype=str)
+
+
+def missing_values(like: np.ndarray, n: int) -> np.ndarray:
+    """
+    Values of a column missing from a file (written by a station version without this measurement)
+    :param like: values of the column in another file, giving the type
+    :param n: number of values
+    :return: NaN for a numeric column, empty strings otherwise
+    """
+    if like.dtype.kind == "f":
+        return np.full(n, np.nan)
+    return np.full(n, "", dtype=like.dtype)
+
+
+class History:
+    """
+    Measurement history of a station: the file at the configured csv path and its rotated files
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        List the files of the history
+        :param path: configured csv path (csv_path in the [Paths] section of config.ini)
+        :raises FileNotFoundError: If there is no measurement file
+        """
+        self.path = path
+        self.files = segments(path)
+        if not self.files:
+            raise FileNotFoundError(f"No measurement file found at {path}")
+
+    def fields(self) -> list[str]:
+        """
+        Names of the columns of the history (the columns of all the files, the time first)
+        :return: the names
+        """
+        names = []
+        for path in self.files:
+            with open(path) as f:
+                for name in f.readline().rstrip("\n").split(","):
+                    if name not in names:
+                        names.append(name)
+        return names
+
+    def _read(self, path: str, ranges: list[tuple[int, int]], fields: list[str] | None) -> dict[str, np.ndarray]:
+        """
+        Parse byte ranges of a file
+        :param path: path to the CSV file
+        :param ranges: (start offset, end offset) ranges of complete rows
+        :param fields: names of the columns to read (None for all)
+        :return: the columns, with the times as seconds since the epoch (int64)
+        """
+        if not ranges:
+            return {}
+        with open(path, "rb") as f:
+            header = f.readline().decode().rstrip("\n").split(",")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                lines = b"".join(data[first:last] for first, last in ranges).decode(errors="replace").split("\n")
+        # The incomplete and malformed rows (e.g. a row being written) are ignored
+        rows = [row for row in (line.split(",") for line in lines) if len(row) == len(header)]
+        if not rows:
+            return {}
+        columns = dict(zip(header, zip(*rows)))
+        try:
+            times = np.array([value.rstrip("Z") for value in columns["time"]], dtype="datetime64[s]")
+        except ValueError:
+            # Slow path: drop the rows with an invalid time
+            valid = [i for i, value in enumerate(columns["time"]) if re.fullmatch(r"[\d\-:T]+Z?", value)]
+            columns = {name: [values[i] for i in valid] for name, values in columns.items()}
+            times = np.array([value.rstrip("Z") for value in columns["time"]], dtype="datetime64[s]")
+        result = {"time": times.astype(np.int64)}
+        for name in header if fields is None else fields:
+            if name != "time" and name in columns:
+                result[name] = to_array(list(columns[name]))
+        return result
+
+    def _combine(self, parts: list[dict[str, np.ndarray]], fields: list[str] | None) -> dict[str, np.ndarray]:
+        """
+        Concatenate the columns read from several files, sorted by time
+        :param parts: columns of each file
+        :param fields: names of the columns (None for all the columns found)
+        :return: the columns
+        """
+        parts = [part for part in parts if part]
+        if not parts:
+            names = ["time"] + [name for name in (fields or []) if name != "time"]
+            return {name: np.array([], dtype=np.int64 if name == "time" else np.float64) for name in names}
+        names = ["time"]
+        for part in parts:
+            names.extend(name for name in part if name not in names)
+        if fields is not None:
+            names = ["time"] + [name for name in fields if name != "time" and name in names]
+        result = {}
+        for name in names:
+            like = next(part[name] for part in parts if name in part)
+            values = [part[name] if name in part else missing_values(like, len(part["time"])) for part in parts]
+            if any(value.dtype.kind != like.dtype.kind for value in values):
+                values = [value.astype(str) for value in values]
+            result[name] = np.concatenate(values)
+        # The rows are in write order: the queued analysis may save a measurement after a more recent one
+        order = np.argsort(result["time"], kind="stable")
+        return {name: values[order] for name, values in result.items()}
+
+    def range(self, start: float | None = None, end: float | None = None,
+              fields: list[str] | None = None) -> dict[str, np.ndarray]:
+        """
+        Read the measurements within a time range
+        :param start: start of the range (seconds since the epoch, see parse_when, included), None for no start
+        :param end: end of the range (excluded), None for no end
+        :param fields: names of the columns to read (default = all)
+        :return: the columns as arrays sorted by time: "time" (seconds since the epoch) and the measurements (float, or
+                 str for the non-numeric columns)
+        """
+        parts = [self._read(path, block_ranges(path, start, end), fields) for path in self.files]
+        result = self._combine(parts, fields)
+        mask = np.ones(len(result["time"]), dtype=bool)
+        if start is not None:
+            mask &= result["time"] >= start
+        if end is not None:
+            mask &= result["time"] < end
+        return {name: values[mask] for name, values in result.items()}
+
+    def last(self, n: int, fields: list[str] | None = None) -> dict[str, np.ndarray]:
+        """
+        Read the n most recent measurements, only the most recent index blocks are read
+        :param n: number of measurements
+        :param fields: names of the columns to read (default = all)
+        :return: the columns as arrays sorted by time (see range)
+        """
+        # Blocks of all the files, most recent first; the rows not indexed yet are always read
+        blocks = []
+        tails = []
+        for path in self.files:
+            size = os.path.getsize(path)
+            indexed = load_index(path)
+            blocks.extend((high, path, (first, last)) for first, last, low, high in indexed)
+            tail = block_ranges(path, float("inf"), None, size)
+            tails.extend((path, ranges) for ranges in tail)
+        blocks.sort(key=lambda block: block[0], reverse=True)
+        selected = {path: [ranges] for path, ranges in tails}
+        parts = [self._read(path, ranges, fields) for path, ranges in selected.items()]
+        times = np.concatenate([part["time"] for part in parts if part] or [np.array([], dtype=np.int64)])
+        for high, path, ranges in blocks:
+            # The remaining blocks are older than the n most recent measurements found
+            if len(times) >= n and high < np.partition(times, len(times) - n)[len(times) - n]:
+                break
+            part = self._read(path, [ranges], fields)
+            if part:
+                parts.append(part)
+                times = np.concatenate([times, part["time"]])
+        result = self._combine(parts, fields)
+        return {name: values[-n:] if n > 0 else values[:0] for name, values in result.items()}
+
+    def downsample(self, bucket: float, start: float | None = None, end: float | None = None,
+                   fields: list[str] | None = None, statistics: tuple[str, ...] = STATISTICS,
+                   missing: float | None = None) -> dict[str, np.ndarray]:
+        """
+        Aggregate the measurements of a time range per time bucket
+        :param bucket: duration of the buckets (in seconds), the buckets are aligned on the epoch (e.g. on the days)
+        :param start: start of the range (seconds since the epoch, included), None for no start
+        :param end: end of the range (excluded), None for no end
+        :param fields: names of the columns to aggregate (default = all the numeric columns)
+        :param statistics: statistics computed per bucket, among mean, min and max
+        :param missing: value written for a missing measurement (e.g. -1), ignored by the statistics (default = none)
+        :raises ValueError: If a statistic is unknown or the bucket is not positive
+        :return: the columns: "time" (start of the bucket), "count" (number of measurements) and <field>_<statistic>,
+                 only the non-empty buckets are returned
+        """
+        for statistic in statistics:
+            if statistic not in STATISTICS:
+                raise ValueError(f"Unknown statistic '{statistic}', should be one of {STATISTICS}")
+        if bucket <= 0:
+            raise ValueError(f"The bucket duration must be positive, got {bucket}")
+        data = self.range(start, end, fields)
+        buckets = (data["time"] // bucket).astype(np.int64)
+        # The rows are sorted by time: each bucket is a contiguous slice
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]]) if len(buckets) else np.array([], dtype=int)
+        result = {"time": (buckets[starts] * bucket).astype(np.int64), "count": np.diff(np.r_[starts, len(buckets)])}
+        for name, values in data.items():
+            if name == "time" or values.dtype.kind != "f":
+                continue
+            if missing is not None:
+                values = np.where(values == missing, np.nan, values)
+            if not len(starts):
+                for statistic in statistics:
+                    result[f"{name}_{statistic}"] = np.array([], dtype=np.float64)
+                continue
+            valid = ~np.isnan(values)
+            for statistic in statistics:
+                if statistic == "mean":
+                    sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+                    counts = np.add.reduceat(valid.astype(np.int64), starts)
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        result[f"{name}_mean"] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+                elif statistic == "min":
+                    result[f"{name}_min"] = np.fmin.reduceat(values, starts)
+                else:
+                    result[f"{name}_max"] = np.fmax.reduceat(values, starts)
+        return result
+
+
+def export(columns: dict[str, np.ndarray], path: str, export_format: str = "") -> None:
+    """
+    Save columns to a file: csv (the times formatted like in the measurement files), npz (compressed NumPy arrays) or
+    parquet (requires pyarrow)
+    :param columns: the columns, with a "time" column in seconds since the epoch
+    :param path: path to the file
+    :param export_format: csv, npz or parquet (default = from the extension of the file)
+    :raises ValueError: If the format is unknown
+    :raises RuntimeError: If pyarrow is not installed for the parquet format
+    """
+    export_format = export_format or os.path.splitext(path)[1].lstrip(".").lower()
+    if export_format == "npz":
+        np.savez_compressed(path, **columns)
+    elif export_format == "parquet":
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("The parquet format requires pyarrow (pip install pyarrow)")
+        arrays = {name: values.astype("datetime64[s]") if name == "time" else values
+                  for name, values in columns.items()}
+        pyarrow.parquet.write_table(pyarrow.table(arrays), path, compression="zstd")
+    elif export_format == "csv":
+        with open(path, "w") as f:
+            write_csv(columns, f)
+    else:
+        raise ValueError(f"Unknown export format '{export_format}', should be one of {EXPORT_FORMATS}")
+
+
+def write_csv(columns: dict[str, np.ndarray], f) -> None:
+    """
+    Write columns as CSV, the times formatted like in the measurement files
+    :param columns: the columns, with a "time" column in seconds since the epoch
+    :param f: text file (e.g. sys.stdout)
+    """
+    names = list(columns)
+    f.write(",".join(names) + "\n")
+    values = [[format_time(value, TIME_FORMAT) for value in columns[name].tolist()] if name == "time"
+              else columns[name].tolist() for name in names]
+    for row in zip(*values):
+        f.write(",".join(str(value) for value in row) + "\n")
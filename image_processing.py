@@ -1,10 +1,39 @@
 """
 Script python qui process les images prisent par la caméra pour évaluer la croissance des plantes
 """
-from plantcv import plantcv as pcv
+import contextlib
 import numpy as np
-import datetime
 import cv2
+from typing import NamedTuple
+from analysis_cache import AnalysisCache
+from skeleton import SkeletonGraph, analyse_skeleton
+from work_memory import WorkMemory
+
+# Available growth engines, selected with the `engine` key of the [image_arg] section of config.ini
+#   plantcv: reference implementation using plantcv
+#   opencv: native implementation using only OpenCV and NumPy (faster, lighter on memory)
+ENGINES = ("plantcv", "opencv")
+# Version of each engine, part of the analysis cache key: bump it when the results of an engine change
+ENGINE_VERSIONS = {"plantcv": 3, "opencv": 3}
+# Margin (in pixels) cropped on each side of the edge image to remove the border artefacts
+CROP_MARGIN = 5
+# Canny hysteresis thresholds used by plantcv (skimage defaults: 10% and 20% of the dtype range)
+CANNY_SIGMA = 2
+CANNY_LOW = 0.1 * 255
+CANNY_HIGH = 0.2 * 255
+# Downscale factors that can be applied directly while decoding a JPEG file
+REDUCED_READ_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+# CMYK channel index in a BGR image (k is computed from the maximum of the three channels)
+CMYK_CHANNELS = {"c": 2, "m": 1, "y": 0, "k": None}
+
+
+def _plantcv():
+    """
+    Import plantcv lazily, the import is slow and only needed by the plantcv engine
+    :return: the plantcv module
+    """
+    from plantcv import plantcv as pcv
+    return pcv
 
 
 def get_height_pix(image_path: str, pot_limit: int, channel: str = 'k', kernel_size: int = 3,
@@ -17,100 +46,690 @@ def get_height_pix(image_path: str, pot_limit: int, channel: str = 'k', kernel_s
     (c = cyan, m = magenta, y = yellow, k=black)
     :param kernel_size: kernel size for the median blur
     :param fill_size: PCV will identify objects in the image and fills those that are less than size
+    :raises: KeyError if no edges are found above the pot
     :return: the height of the plant in pixels
     """
-    date = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-    path = "data/images/edges_img/edge%s.jpg" % date
+    pcv = _plantcv()
     pcv.params.debug = None
 
-    img, path, _ = pcv.readimage(image_path)
+    img, _, _ = pcv.readimage(image_path)
 
     height, width = img.shape[0], img.shape[1]
 
     k = pcv.rgb2gray_cmyk(rgb_img=img, channel=channel)
     k_mblur = pcv.median_blur(k, kernel_size)
-    %cv2.imwrite(path, date)
 
-    edges = pcv.canny_edge_detect(k_mblur, sigma=2)
-    edges_crop = pcv.crop(edges, 5, 5, height - pot_limit - 10, width - 10)
+    edges = pcv.canny_edge_detect(k_mblur, sigma=CANNY_SIGMA)
+    edges_crop = pcv.crop(edges, CROP_MARGIN, CROP_MARGIN, height - pot_limit - 2 * CROP_MARGIN,
+                          width - 2 * CROP_MARGIN)
     new_height = edges_crop.shape[0]
     edges_filled = pcv.fill(edges_crop, fill_size)
-    pcv.print_image(edges_filled, path)
     non_zero = np.nonzero(edges_filled)
+    if len(non_zero[0]) == 0:
+        raise KeyError("No edges found above the pot")
     # height = position of the last non-zero pixel
     plant_height_pix = new_height - min(non_zero[0])
 
     return plant_height_pix
 
 
-def get_segment_list(image_path: str, channel: str = 'k', kernel_size: int = 20) -> list[int]:
+class PlantTraits(NamedTuple):
+    """
+    Plant traits computed by analyse_image (lengths in full resolution pixels)
+    """
+    growth: float  # total length of the plant skeleton
+    branch_points: int  # number of branch points of the skeleton
+    tips: int  # number of end points of the skeleton
+    height: int  # height of the plant above the pot (-1 if no edges were found above the pot)
+    area: float  # area of the plant contour
+    bbox_x: int  # bounding box of the plant contour
+    bbox_y: int
+    bbox_width: int
+    bbox_height: int
+
+
+class _PlantShape(NamedTuple):
+    """
+    Intermediate results shared by the traits computations (in the processed image coordinates)
+    """
+    mask: np.ndarray  # filled plant contour in the analysed region
+    box: tuple[int, int, int, int]  # bounding box (x, y, width, height) of the plant contour in the image
+    area: float  # area of the plant contour
+    top: int | None  # row of the highest edge above the pot (None if not computed or not found)
+
+
+class RoiTracker:
+    """
+    Region of interest tracker, remembers the bounding box of the plant between consecutive measurements so that only
+    this box, expanded by a growth margin, is analysed in the next image.
+    The whole frame is analysed instead if the plant touches the border of the region or if no plant is found in it.
+    """
+
+    def __init__(self, margin: int = 50) -> None:
+        """
+        Initialize the tracker
+        :param margin: growth margin around the previous bounding box (in full resolution pixels)
+        """
+        self.margin = margin
+        self.box = None  # Bounding box (x, y, width, height) of the plant in the previous image (full resolution)
+        self.hits = 0  # Number of analyses done in the region of interest
+        self.fallbacks = 0  # Number of analyses that fell back to the whole frame
+
+    def region(self, downscale: float = 1.0) -> tuple[int, int, int, int] | None:
+        """
+        Get the region of interest in the processed image coordinates
+        :param downscale: resolution reduction factor of the processed image
+        :return: the region (x0, y0, x1, y1), or None if no plant was tracked yet
+        """
+        if self.box is None:
+            return None
+        x, y, width, height = (v / downscale for v in self.box)
+        margin = self.margin / downscale
+        return (int(x - margin), int(y - margin),
+                int(np.ceil(x + width + margin)), int(np.ceil(y + height + margin)))
+
+    def update(self, box: tuple[int, int, int, int], downscale: float = 1.0) -> None:
+        """
+        Remember the bounding box of the plant
+        :param box: bounding box (x, y, width, height) in the processed image coordinates
+        :param downscale: resolution reduction factor of the processed image
+        """
+        self.box = tuple(v * downscale for v in box)
+
+    def reset(self) -> None:
+        """
+        Forget the tracked plant, the next image will be analysed on the whole frame
+        """
+        self.box = None
+
+
+def get_segment_list(image_path: str, channel: str = 'k', kernel_size: int = 20, engine: str = "plantcv",
+                     image: np.ndarray | None = None, downscale: float = 1.0,
+                     tracker: RoiTracker | None = None, memory: WorkMemory | None = None) -> list[float]:
     """
     Get the list of segments lengths from the plant skeleton
     :param image_path: path to the image
     :param channel: CMYK channel for conversion from RGB to CMYK colorspace
     (c = cyan, m = magenta, y = yellow, k=black)
     :param kernel_size: kernel size for the closing operation
+    :param engine: growth engine used to process the image, one of ENGINES (default = "plantcv")
+    :param image: optional image already in memory (BGR), used instead of reading image_path
+    :param downscale: the image is processed at 1/downscale of its resolution, the lengths are scaled back to full
+    resolution pixels (default = 1, full resolution)
+    :param tracker: optional region of interest tracker, only the region around the plant of the previous image is
+    analysed (default = None, the whole image is analysed)
+    :param memory: optional working memory of the low-memory mode, its buffers are reused and its budget may increase
+    the downscale factor (default = None, the intermediate images are allocated for each call)
     :raises: KeyError if no segments are found in the image
+    :raises: ValueError if the engine is unknown
     :return: list of segments lengths
     """
-    pcv.params.debug = None
+    if downscale < 1:
+        raise ValueError(f"Downscale factor must be greater or equal to 1, got {downscale}")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown growth engine '{engine}', should be one of {ENGINES}")
+    edges_function, segments_function = _ENGINE_FUNCTIONS[engine]
 
     # Read image
-    img, _, _ = pcv.readimage(image_path)
+    img, downscale = _read_within_budget(image_path, image, downscale, memory)
+
+    # Get the plant shape, then its skeleton segments
+    shape = _find_plant(img, channel, kernel_size, downscale, edges_function, tracker, memory=memory)
+    del img
+    segments = segments_function(shape.mask, memory).segment_lengths
+    if downscale != 1:
+        segments = [length * downscale for length in segments]
+    return segments
+
+
+def get_total_length(image_path: str, channel: str = 'k', kernel_size: int = 20, engine: str = "plantcv",
+                     cache: AnalysisCache | None = None, image: np.ndarray | None = None,
+                     downscale: float = 1.0, tracker: RoiTracker | None = None,
+                     memory: WorkMemory | None = None) -> float:
+    """
+    Get the total length of the plant skeleton
+    :param image_path: path to the image
+    :param channel: CMYK channel for conversion from RGB to CMYK colorspace
+    (c = cyan, m = magenta, y = yellow, k=black)
+    :param kernel_size: kernel size for the closing operation
+    :param engine: growth engine used to process the image, one of ENGINES (default = "plantcv")
+    :param cache: optional analysis cache, checked before the image is decoded
+    :param image: optional image already in memory (BGR), used instead of reading image_path
+    :param downscale: the image is processed at 1/downscale of its resolution (default = 1, full resolution)
+    :param tracker: optional region of interest tracker (default = None, the whole image is analysed)
+    :param memory: optional working memory of the low-memory mode (default = None)
+    :raises: KeyError if no segments are found in the image
+    :return: the total length of the plant skeleton (in full resolution pixels)
+    """
+    key = None
+    if cache is not None:
+        key = cache.make_key(_image_content(image_path, image), "total_length", channel, kernel_size, downscale,
+                             _memory_budget(memory), engine, ENGINE_VERSIONS.get(engine))
+        total_length = cache.get(key)
+        if total_length is not None:
+            return total_length
+
+    # May raise a KeyError if no segments are found
+    segment_list = get_segment_list(image_path, channel, kernel_size, engine, image, downscale, tracker, memory)
+
+    # Get the sum of segment lengths
+    total_length = sum(segment_list)
+    if cache is not None:
+        cache.put(key, total_length)
+    return total_length
+
+
+def analyse_image(image_path: str, channel: str = 'k', kernel_size: int = 20, engine: str = "plantcv",
+                  pot_limit: int = 0, fill_size: int = 1, cache: AnalysisCache | None = None,
+                  image: np.ndarray | None = None, downscale: float = 1.0,
+                  tracker: RoiTracker | None = None, memory: WorkMemory | None = None) -> PlantTraits:
+    """
+    Compute all the plant traits in a single pass: the image is decoded once, and the channel extraction and edge
+    detection are shared by the skeleton length, the plant height, the contour area and the bounding box.
+    The height is measured on the same edges as the other traits (no median blur, unlike get_height_pix).
+    :param image_path: path to the image
+    :param channel: CMYK channel for conversion from RGB to CMYK colorspace
+    (c = cyan, m = magenta, y = yellow, k=black)
+    :param kernel_size: kernel size for the closing operation
+    :param engine: growth engine used to process the image, one of ENGINES (default = "plantcv")
+    :param pot_limit: height of the pot in pixels, the edges below are ignored for the height (default = 0)
+    :param fill_size: edge objects smaller than fill_size pixels are ignored for the height (default = 1)
+    :param cache: optional analysis cache, checked before the image is decoded
+    :param image: optional image already in memory (BGR), used instead of reading image_path
+    :param downscale: the image is processed at 1/downscale of its resolution (default = 1, full resolution)
+    :param tracker: optional region of interest tracker (default = None, the whole image is analysed)
+    :param memory: optional working memory of the low-memory mode, its buffers are reused, its budget may increase
+    the downscale factor and the memory peak of each stage is recorded in its report if profiling is enabled
+    (default = None)
+    :raises: KeyError if no segments are found in the image
+    :raises: ValueError if the engine is unknown
+    :return: the plant traits (in full resolution pixels)
+    """
+    if downscale < 1:
+        raise ValueError(f"Downscale factor must be greater or equal to 1, got {downscale}")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown growth engine '{engine}', should be one of {ENGINES}")
+
+    key = None
+    if cache is not None:
+        key = cache.make_key(_image_content(image_path, image), "traits", channel, kernel_size, pot_limit, fill_size,
+                             downscale, _memory_budget(memory), engine, ENGINE_VERSIONS.get(engine))
+        traits = cache.get(key)
+        if traits is not None:
+            return PlantTraits(*traits)
+
+    edges_function, segments_function = _ENGINE_FUNCTIONS[engine]
+    with _stage(memory, "decode"):
+        img, downscale = _read_within_budget(image_path, image, downscale, memory)
+    pot_bottom = img.shape[0] - _scaled(CROP_MARGIN, downscale) - round(pot_limit / downscale)
+    shape = _find_plant(img, channel, kernel_size, downscale, edges_function, tracker, pot_bottom, fill_size, memory)
+    # Release the decoded image before the skeleton analysis
+    del img
+    # May raise a KeyError if no segments are found
+    graph = segments_function(shape.mask, memory)
+    growth = sum(graph.segment_lengths) * downscale
+
+    x, y, width, height = shape.box
+    traits = PlantTraits(
+        growth=growth,
+        branch_points=graph.branch_points,
+        tips=graph.tips,
+        height=-1 if shape.top is None else round((pot_bottom - shape.top) * downscale),
+        area=shape.area * downscale ** 2,
+        bbox_x=round(x * downscale),
+        bbox_y=round(y * downscale),
+        bbox_width=round(width * downscale),
+        bbox_height=round(height * downscale)
+    )
+    if cache is not None:
+        cache.put(key, list(traits))
+    return traits
+
+
+def _image_content(image_path: str, image: np.ndarray | None) -> bytes | memoryview:
+    """
+    Get the raw content of an image, used to compute its cache key
+    :param image_path: path to the image (read if image is None)
+    :param image: image already in memory, or None
+    :return: the file bytes, or the pixel buffer of the image in memory
+    """
+    if image is not None:
+        return memoryview(np.ascontiguousarray(image)).cast("B")
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+def _read_image(image_path: str, image: np.ndarray | None, downscale: float = 1.0,
+                memory: WorkMemory | None = None) -> np.ndarray:
+    """
+    Read an image (BGR) unless it is already in memory, and reduce its resolution
+    :param image_path: path to the image (read if image is None)
+    :param image: image already in memory, or None
+    :param downscale: resolution reduction factor (default = 1, full resolution)
+    :param memory: optional working memory, the reduced image is written in its buffer
+    :raises: FileNotFoundError if the image could not be read
+    :return: the image
+    """
+    if image is None:
+        if downscale in REDUCED_READ_FLAGS:
+            # The JPEG decoder can skip the full resolution decoding
+            image = cv2.imread(image_path, REDUCED_READ_FLAGS[int(downscale)])
+            downscale = 1.0
+        else:
+            image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image {image_path}")
+    if downscale != 1:
+        height, width = image.shape[0], image.shape[1]
+        size = (max(1, round(width / downscale)), max(1, round(height / downscale)))
+        out = None if memory is None else memory.buffer("image", (size[1], size[0]) + image.shape[2:])
+        image = cv2.resize(image, size, dst=out, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def _read_within_budget(image_path: str, image: np.ndarray | None, downscale: float,
+                        memory: WorkMemory | None) -> tuple[np.ndarray, float]:
+    """
+    Read an image at the requested resolution, or at a lower resolution if its working memory would exceed the budget
+    of the low-memory mode. The size of the previous image is used to choose the factor before decoding, so that the
+    JPEG decoder can skip the full resolution decoding.
+    :param image_path: path to the image (read if image is None)
+    :param image: image already in memory, or None
+    :param downscale: requested resolution reduction factor
+    :param memory: working memory of the low-memory mode, or None
+    :raises: FileNotFoundError if the image could not be read
+    :return: the image and the resolution reduction factor actually applied
+    """
+    if memory is None:
+        return _read_image(image_path, image, downscale), downscale
+
+    if image is not None:
+        memory.frame_size = image.shape[:2]
+    if memory.frame_size is not None:
+        downscale = memory.required_downscale(memory.frame_size, downscale)
+    img = _read_image(image_path, image, downscale, memory)
+    frame_size = (round(img.shape[0] * downscale), round(img.shape[1] * downscale))
+    required = memory.required_downscale(frame_size, downscale)
+    if required > downscale:
+        # First image (or larger than the previous one): reduce it further (in a new array, img may be a buffer)
+        img = _read_image(image_path, img, required / downscale)
+        downscale = required
+    memory.frame_size = frame_size
+    memory.downscale = downscale
+    return img, downscale
+
+
+def _memory_budget(memory: WorkMemory | None) -> int:
+    """
+    Memory budget of the low-memory mode, part of the cache keys since it may change the processing resolution
+    :param memory: working memory of the low-memory mode, or None
+    :return: the budget in bytes (0 = no budget)
+    """
+    return 0 if memory is None else memory.budget
+
+
+def _stage(memory: WorkMemory | None, name: str) -> contextlib.AbstractContextManager:
+    """
+    Context manager recording the memory peak of an analysis stage in the report of the working memory
+    :param memory: working memory of the low-memory mode, or None
+    :param name: name of the stage
+    :return: the context manager
+    """
+    return contextlib.nullcontext() if memory is None else memory.stage(name)
+
+
+def _scaled(value: float, downscale: float) -> int:
+    """
+    Scale a length in pixels to a reduced resolution
+    :param value: length at full resolution
+    :param downscale: resolution reduction factor
+    :return: the length at the reduced resolution (at least 1)
+    """
+    return max(1, round(value / downscale))
+
 
-    # Get image dimension
+def _find_plant(img: np.ndarray, channel: str, kernel_size: int, downscale: float, edges_function,
+                tracker: RoiTracker | None, pot_bottom: int | None = None, fill_size: int = 1,
+                memory: WorkMemory | None = None) -> _PlantShape:
+    """
+    Compute the plant shape, in the region of interest of the tracker if possible, otherwise in the whole frame
+    (minus a margin on each side to remove the border artefacts)
+    :param img: BGR image
+    :param channel: CMYK channel for conversion from RGB to CMYK colorspace
+    :param kernel_size: kernel size for the closing operation (at full resolution)
+    :param downscale: resolution reduction factor of the image
+    :param edges_function: engine function computing the edges of a BGR image
+    :param tracker: region of interest tracker, or None
+    :param pot_bottom: row of the top of the pot, the highest edge above it is searched if given (default = None)
+    :param fill_size: edge objects smaller than fill_size pixels are ignored when searching the highest edge
+    :param memory: optional working memory of the low-memory mode
+    :raises: KeyError if no contour is found in the image
+    :return: the plant shape
+    """
     height, width = img.shape[0], img.shape[1]
+    margin = _scaled(CROP_MARGIN, downscale)
+    kernel_size = _scaled(kernel_size, downscale)
+    sigma = CANNY_SIGMA / downscale
+    frame = (margin, margin, width - margin, height - margin)
 
-    # Extract channel (grey image)
-    k = pcv.rgb2gray_cmyk(rgb_img=img, channel=channel)
+    region = tracker.region(downscale) if tracker is not None else None
+    if region is not None:
+        region = (max(region[0], frame[0]), max(region[1], frame[1]),
+                  min(region[2], frame[2]), min(region[3], frame[3]))
+        shape = None
+        if region[2] > region[0] and region[3] > region[1]:
+            try:
+                shape = _region_shape(img, region, channel, kernel_size, sigma, edges_function, pot_bottom, fill_size,
+                                      memory)
+            except KeyError:
+                shape = None
+        if shape is not None and not _touches_border(shape.box, region, frame):
+            tracker.hits += 1
+            tracker.update(shape.box, downscale)
+            return shape
+        # The plant grew out of the region of interest (or was not found), analyse the whole frame
+        tracker.fallbacks += 1
 
-    # Perform canny=edge detection
-    edges = pcv.canny_edge_detect(k, sigma=2)
+    shape = _region_shape(img, frame, channel, kernel_size, sigma, edges_function, pot_bottom, fill_size, memory)
+    if tracker is not None:
+        tracker.update(shape.box, downscale)
+    return shape
+
+
+def _region_shape(img: np.ndarray, region: tuple[int, int, int, int], channel: str, kernel_size: int, sigma: float,
+                  edges_function, pot_bottom: int | None = None, fill_size: int = 1,
+                  memory: WorkMemory | None = None) -> _PlantShape:
+    """
+    Compute the plant shape in a region of the image.
+    The edges are computed with some context around the region so that they are the same as in the whole image.
+    :param img: BGR image
+    :param region: region (x0, y0, x1, y1) to analyse
+    :param channel: CMYK channel for conversion from RGB to CMYK colorspace
+    :param kernel_size: kernel size for the closing operation
+    :param sigma: standard deviation of the gaussian filter of the edge detection
+    :param edges_function: engine function computing the edges of a BGR image
+    :param pot_bottom: row of the top of the pot, the highest edge above it is searched if given (default = None)
+    :param fill_size: edge objects smaller than fill_size pixels are ignored when searching the highest edge
+    :param memory: optional working memory of the low-memory mode
+    :raises: KeyError if no contour is found in the region
+    :return: the plant shape
+    """
+    height, width = img.shape[0], img.shape[1]
+    x0, y0, x1, y1 = region
+    pad = int(np.ceil(4 * sigma)) + 2
+    px0, py0, px1, py1 = max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad)
+
+    # Extract channel and perform canny-edge detection, then crop the context (view, no copy)
+    with _stage(memory, "edges"):
+        edges = edges_function(img[py0:py1, px0:px1], channel, sigma, memory)
+    edges_crop = edges[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+    # Highest edge above the pot, before the edges are overwritten by the mask
+    top = None
+    if pot_bottom is not None and min(y1, pot_bottom) > y0:
+        row = _top_edge_row(edges_crop[:min(y1, pot_bottom) - y0], fill_size)
+        top = None if row is None else row + y0
+
+    # Close gaps in plant contour and fill the biggest contour to get maize shape
+    with _stage(memory, "mask"):
+        mask, (x, y, w, h), area = _plant_mask(edges_crop, kernel_size, out=edges_crop)
+    return _PlantShape(mask, (x + x0, y + y0, w, h), area, top)
+
+
+def _top_edge_row(edges: np.ndarray, fill_size: int) -> int | None:
+    """
+    Find the highest edge pixel, ignoring the edge objects smaller than fill_size (same as plantcv.fill)
+    :param edges: edge image (uint8, 0 or 255)
+    :param fill_size: minimum size of the edge objects in pixels
+    :return: the row of the highest edge pixel, or None if there is none
+    """
+    if fill_size > 1:
+        _, _, stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8)
+        tops = stats[1:, cv2.CC_STAT_TOP][stats[1:, cv2.CC_STAT_AREA] >= fill_size]
+        return int(tops.min()) if tops.size else None
+    rows = np.flatnonzero(edges.any(axis=1))
+    return int(rows[0]) if rows.size else None
 
-    # Crop image edges
-    edges_crop = pcv.crop(edges, 5, 5, height - 10, width - 10)
 
+def _touches_border(box: tuple[int, int, int, int], region: tuple[int, int, int, int],
+                    frame: tuple[int, int, int, int]) -> bool:
+    """
+    Check if a bounding box touches a border of the region of interest that is not a border of the frame
+    :param box: bounding box (x, y, width, height)
+    :param region: region of interest (x0, y0, x1, y1)
+    :param frame: analysed area of the whole frame (x0, y0, x1, y1)
+    :return: True if the box touches an inner border of the region
+    """
+    x, y, w, h = box
+    return ((x <= region[0] and region[0] > frame[0]) or (y <= region[1] and region[1] > frame[1]) or
+            (x + w >= region[2] and region[2] < frame[2]) or (y + h >= region[3] and region[3] < frame[3]))
+
+
+def _plant_mask(edges: np.ndarray, kernel_size: int,
+                out: np.ndarray | None = None) -> tuple[np.ndarray, tuple[int, int, int, int], float]:
+    """
+    Close the gaps in the plant contour and fill the biggest contour to get the plant shape
+    :param edges: edge image (uint8, 0 or 255)
+    :param kernel_size: kernel size for the closing operation
+    :param out: optional buffer with the same shape as edges to write the mask in (may be edges itself)
+    :raises: KeyError if no contour is found in the image
+    :return: the plant mask (uint8, 0 or 255), the bounding box (x, y, width, height) and the area of the plant contour
+    """
     # Close gaps in plant contour
     kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    closing = cv2.morphologyEx(edges_crop, cv2.MORPH_CLOSE, kernel)
+    closing = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, dst=out)
 
     # Find contours
-    thresh = cv2.threshold(closing, 128, 255, cv2.THRESH_BINARY)[1]
+    thresh = cv2.threshold(closing, 128, 255, cv2.THRESH_BINARY, dst=closing)[1]
     contours = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     contours = contours[0]
+    if len(contours) == 0:
+        raise KeyError("No contour found in the image")
     big_contour = max(contours, key=cv2.contourArea)
 
     # Fill contour to get maize shape
-    result = np.zeros_like(closing)
+    result = closing
+    result.fill(0)
     cv2.drawContours(result, [big_contour], 0, (255, 255, 255), cv2.FILLED)
+    return result, cv2.boundingRect(big_contour), cv2.contourArea(big_contour)
+
 
+def _plantcv_edges(img: np.ndarray, channel: str, sigma: float, memory: WorkMemory | None = None) -> np.ndarray:
+    """
+    Plantcv engine: extract the CMYK channel and perform the canny-edge detection
+    :param img: BGR image
+    :param channel: CMYK channel for conversion from RGB to CMYK colorspace
+    :param sigma: standard deviation of the gaussian filter
+    :param memory: ignored, plantcv allocates its own intermediate images
+    :return: the edges image (uint8, 0 or 255)
+    """
+    pcv = _plantcv()
+    pcv.params.debug = None
+    # Extract channel (grey image)
+    k = pcv.rgb2gray_cmyk(rgb_img=img, channel=channel)
+    # Perform canny=edge detection
+    return pcv.canny_edge_detect(k, sigma=sigma)
+
+
+def _plantcv_segments(mask: np.ndarray, memory: WorkMemory | None = None) -> SkeletonGraph:
+    """
+    Plantcv engine: skeletonize the plant mask and measure the skeleton segments
+    The plantcv outputs are global: this engine must not be used by concurrent analyses
+    :param mask: plant mask (uint8, 0 or 255)
+    :param memory: optional working memory, only used for the stages report
+    :raises: KeyError if no segments are found in the image
+    :return: the skeleton graph (segment lengths measured by plantcv)
+    """
+    pcv = _plantcv()
     # Draw plant skeleton and segment
     pcv.params.line_thickness = 3
-    skeleton = pcv.morphology.skeletonize(mask=result)
-    segmented_img, obj = pcv.morphology.segment_skeleton(skel_img=skeleton)
+    with _stage(memory, "skeleton"):
+        skeleton = pcv.morphology.skeletonize(mask=mask)
+    with _stage(memory, "graph"):
+        segmented_img, obj = pcv.morphology.segment_skeleton(skel_img=skeleton)
 
-    if pcv.params.debug is not None:
-        # The labelled image is only useful for debugging purposes
-        _ = pcv.morphology.segment_path_length(segmented_img=segmented_img,
-                                               objects=obj, label="default")
-    # Get segment lengths
-    # Will raise a KeyError if no segments are found
-    path_lengths = pcv.outputs.observations['default']['segment_path_length']['value']
-    return path_lengths
+        # Measure the segments, the lengths are stored in the plantcv outputs (the labelled image is only useful for
+        # debugging purposes)
+        pcv.outputs.clear()
+        _ = pcv.morphology.segment_path_length(segmented_img=segmented_img, objects=obj, label="default")
+        del segmented_img, obj
+        # Get segment lengths
+        # Will raise a KeyError if no segments are found
+        path_lengths = pcv.outputs.observations['default']['segment_path_length']['value']
+        graph = analyse_skeleton(skeleton)
+    return SkeletonGraph(path_lengths, graph.branch_points, graph.tips)
 
 
-def get_total_length(image_path: str, channel: str = 'k', kernel_size: int = 20) -> int:
+def _opencv_edges(img: np.ndarray, channel: str, sigma: float, memory: WorkMemory | None = None) -> np.ndarray:
     """
-    Get the total length of the plant skeleton
-    :param image_path: path to the image
+    Native engine: extract the CMYK channel and perform the canny-edge detection, reusing the same buffer
+    :param img: BGR image
     :param channel: CMYK channel for conversion from RGB to CMYK colorspace
-    (c = cyan, m = magenta, y = yellow, k=black)
-    :param kernel_size: kernel size for the closing operation
-    :raises: KeyError if no segments are found in the image
-    :return: the total length of the plant skeleton
+    :param sigma: standard deviation of the gaussian filter
+    :param memory: optional working memory, the intermediate images are written in its buffers
+    :return: the edges image (uint8, 0 or 255)
     """
-    # May raise a KeyError if no segments are found
-    segment_list = get_segment_list(image_path, channel, kernel_size)
+    if memory is None:
+        grey = cmyk_channel(img, channel)
+        return canny_edges(grey, sigma=sigma, out=grey)
+    size = img.shape[:2]
+    grey = cmyk_channel(img, channel, out=memory.buffer("grey", size), tmp=memory.buffer("blurred", size))
+    return canny_edges(grey, sigma=sigma, out=grey, tmp=memory.buffer("blurred", size))
 
-    # Get the sum of segment lengths
-    return sum(segment_list)
+
+def _opencv_segments(mask: np.ndarray, memory: WorkMemory | None = None) -> SkeletonGraph:
+    """
+    Native engine: skeletonize the plant mask and analyse the skeleton graph (no global state)
+    :param mask: plant mask (uint8, 0 or 255)
+    :param memory: optional working memory, the skeleton is written in its buffer
+    :raises: KeyError if no segments are found in the skeleton
+    :return: the skeleton graph
+    """
+    with _stage(memory, "skeleton"):
+        skeleton = skeletonize(mask, out=None if memory is None else memory.buffer("skeleton", mask.shape))
+    with _stage(memory, "graph"):
+        return analyse_skeleton(skeleton)
+
+
+def frame_signature(image_path: str, image: np.ndarray | None = None, size: int = 32) -> np.ndarray:
+    """
+    Compute a cheap signature of an image to detect unchanged images: the grey image reduced to size x size pixels
+    :param image_path: path to the image (read at 1/8 of its resolution if image is None)
+    :param image: optional image already in memory (BGR)
+    :param size: size of the signature in pixels (default = 32)
+    :raises: FileNotFoundError if the image could not be read
+    :return: the signature (uint8)
+    """
+    if image is None:
+        image = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image {image_path}")
+    signature = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    if signature.ndim == 3:
+        signature = cv2.cvtColor(signature, cv2.COLOR_BGR2GRAY)
+    return signature
+
+
+def frame_difference(signature: np.ndarray, other: np.ndarray) -> float:
+    """
+    Difference between two image signatures (see frame_signature)
+    :param signature: signature of the first image
+    :param other: signature of the second image
+    :return: the mean absolute difference, in grey levels (0-255)
+    """
+    return float(cv2.absdiff(signature, other).mean())
+
+
+def cmyk_channel(img: np.ndarray, channel: str = 'k', out: np.ndarray | None = None,
+                 tmp: np.ndarray | None = None) -> np.ndarray:
+    """
+    Extract a CMYK channel from a BGR image (same conversion as plantcv.rgb2gray_cmyk)
+    :param img: BGR image (uint8)
+    :param channel: CMYK channel to extract (c = cyan, m = magenta, y = yellow, k=black)
+    :param out: optional single channel uint8 buffer to write the result in
+    :param tmp: optional single channel uint8 buffer for the intermediate difference (c, m and y channels)
+    :raises: ValueError if the channel is not one of c, m, y or k
+    :return: the channel as a grey image (uint8)
+    """
+    channel = channel.lower()
+    if channel not in CMYK_CHANNELS:
+        raise ValueError(f"Channel {channel} is not valid, should be one of {list(CMYK_CHANNELS.keys())}")
+
+    # max(B, G, R) = 255 * (1 - k)
+    out = np.max(img, axis=2, out=out)
+    if channel == 'k':
+        return np.subtract(255, out, out=out)
+
+    # c = (1 - r - k) / (1 - k) = (max - r) / max, and similarly for m (green) and y (blue)
+    diff = np.subtract(out, img[..., CMYK_CHANNELS[channel]], out=tmp)
+    return cv2.divide(diff, out, dst=out, scale=255)
+
+
+def canny_edges(grey: np.ndarray, sigma: float = CANNY_SIGMA, out: np.ndarray | None = None,
+                tmp: np.ndarray | None = None) -> np.ndarray:
+    """
+    Canny edge detection with a gaussian pre-smoothing (same parameters as plantcv.canny_edge_detect)
+    :param grey: grey image (uint8)
+    :param sigma: standard deviation of the gaussian filter
+    :param out: optional buffer to write the result in (may be grey itself)
+    :param tmp: optional buffer with the same shape as grey for the smoothed image
+    :return: the edges image (uint8, 0 or 255)
+    """
+    blurred = cv2.GaussianBlur(grey, (0, 0), sigma, dst=tmp)
+    return cv2.Canny(blurred, CANNY_LOW, CANNY_HIGH, edges=out, L2gradient=True)
+
+
+def skeletonize(mask: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Skeletonize a binary mask (Zhang-Suen thinning), only the bounding box of the mask is processed
+    :param mask: binary mask (uint8, 0 or 255)
+    :param out: optional uint8 buffer with the same shape as the mask to write the skeleton in
+    :return: the skeleton (uint8, 0 or 255) with the same shape as the mask
+    """
+    if out is None:
+        skeleton = np.zeros_like(mask)
+    else:
+        skeleton = out
+        skeleton.fill(0)
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        return skeleton
+
+    roi = mask[y:y + h, x:x + w]
+    if hasattr(cv2, "ximgproc"):
+        # opencv-contrib provides a native implementation
+        skeleton[y:y + h, x:x + w] = cv2.ximgproc.thinning(roi, thinningType=cv2.ximgproc.THINNING_ZHANGSUEN)
+        return skeleton
+
+    img = np.zeros((h + 2, w + 2), np.uint8)
+    img[1:-1, 1:-1] = roi > 0
+    center = img[1:-1, 1:-1]
+    changed = True
+    while changed:
+        changed = False
+        for step in (0, 1):
+            # Neighbours, clockwise starting from the top
+            p2, p3, p4 = img[:-2, 1:-1], img[:-2, 2:], img[1:-1, 2:]
+            p5, p6, p7 = img[2:, 2:], img[2:, 1:-1], img[2:, :-2]
+            p8, p9 = img[1:-1, :-2], img[:-2, :-2]
+            neighbours = (p2, p3, p4, p5, p6, p7, p8, p9, p2)
+            count = sum(neighbours[:-1])
+            transitions = sum((neighbours[i] == 0) & (neighbours[i + 1] == 1) for i in range(8))
+            if step == 0:
+                border = ((p2 & p4 & p6) == 0) & ((p4 & p6 & p8) == 0)
+            else:
+                border = ((p2 & p4 & p8) == 0) & ((p2 & p6 & p8) == 0)
+            remove = (center == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & border
+            if remove.any():
+                center[remove] = 0
+                changed = True
+
+    skeleton[y:y + h, x:x + w] = center * 255
+    return skeleton
+
+
+# Edge detection and skeleton measurement functions of each engine
+_ENGINE_FUNCTIONS = {
+    "plantcv": (_plantcv_edges, _plantcv_segments),
+    "opencv": (_opencv_edges, _opencv_segments)
+}
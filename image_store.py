@@ -0,0 +1,116 @@
+"""
+Content-addressed store of the photos: each photo is stored once, under the SHA-256 hash of its JPEG data, so that the
+DB points only carry the hash, a small thumbnail and the dimensions of the photo. The full photos are shipped separately
+by tools/transfer_images.py, on their own schedule and bandwidth budget.
+"""
+import base64
+import hashlib
+import os
+import shutil
+from typing import Iterator
+import cv2
+import numpy as np
+from PIL import Image
+from camera import encode_jpeg
+
+THUMBNAIL_WIDTH = 160  # Width of the thumbnails sent to the DB (in pixels)
+THUMBNAIL_QUALITY = 70  # JPEG quality of the thumbnails
+HASH_CHUNK = 2 ** 20  # Size of the chunks read to hash a file (in bytes)
+
+
+def file_hash(path: str) -> str:
+    """
+    Hash a file
+    :param path: path to the file
+    :return: the SHA-256 hash of the file content (hexadecimal)
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_thumbnail(path: str, frame: np.ndarray | None = None, width: int = THUMBNAIL_WIDTH,
+                   quality: int = THUMBNAIL_QUALITY) -> tuple[str, tuple[int, int]]:
+    """
+    Make the thumbnail of a photo
+    :param path: path to the photo (read if frame is None, at a reduced resolution)
+    :param frame: the photo in memory (BGR), or None
+    :param width: width of the thumbnail (in pixels)
+    :param quality: JPEG quality of the thumbnail
+    :raises RuntimeError: If the photo could not be read
+    :return: the thumbnail as a base64 JPEG string, and the size (width, height) of the full photo
+    """
+    if frame is None:
+        with Image.open(path) as image:
+            size = image.size  # Only the header is read
+        # The JPEG is decoded directly at a reduced resolution
+        frame = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+        if frame is None:
+            raise RuntimeError(f"Could not read the photo {path}")
+    else:
+        size = (frame.shape[1], frame.shape[0])
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    thumbnail = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return base64.b64encode(encode_jpeg(thumbnail, quality)).decode('utf-8'), size
+
+
+class ImageStore:
+    """
+    Photos stored by hash in a folder (folder/<first 2 characters of the hash>/<hash>.jpg).
+    The photos of the image folder are hard-linked into the store when possible, so that they are not stored twice.
+    """
+
+    def __init__(self, folder: str) -> None:
+        """
+        Open (or create) the store
+        :param folder: folder of the store
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+
+    def path(self, digest: str) -> str:
+        """
+        Path of a photo in the store
+        :param digest: hash of the photo
+        :return: the path to the photo
+        """
+        return os.path.join(self.folder, digest[:2], f"{digest}.jpg")
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put_file(self, path: str) -> str:
+        """
+        Add a photo to the store (a photo already in the store is not stored again)
+        :param path: path to the photo
+        :return: the hash of the photo
+        """
+        digest = file_hash(path)
+        destination = self.path(digest)
+        if os.path.exists(destination):
+            return digest
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temporary = destination + ".tmp"
+        try:
+            os.link(path, temporary)
+        except OSError:
+            # Different file system, or hard links not supported
+            shutil.copyfile(path, temporary)
+        os.replace(temporary, destination)
+        return digest
+
+    def digests(self) -> Iterator[tuple[str, str]]:
+        """
+        List the photos of the store, oldest first
+        :return: an iterator of (hash, path) tuples
+        """
+        entries = []
+        for directory in os.scandir(self.folder):
+            if not directory.is_dir():
+                continue
+            entries.extend(entry for entry in os.scandir(directory.path)
+                           if entry.is_file() and entry.name.endswith(".jpg"))
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            yield entry.name[:-len(".jpg")], entry.path
@@ -0,0 +1,46 @@
+"""
+HX711 load cell driver of the station (requires the hx711 package and a Raspberry Pi, see hardware.py for the simulated
+load cell)
+"""
+import time
+import hx711
+import RPi.GPIO as GPIO
+from load_cell_sampler import ReadHealth, READ_TIMEOUT, read_samples
+
+
+class DebugHx711(hx711.HX711):
+    """
+    DebugHx711 class, inherits from hx711.HX711
+    Modified to bound the time of the reads: each read waits for the data-ready signal of the HX711 (DOUT low) with a
+    timeout, and get_raw_data stops at a deadline or when the load cell does not answer
+    """
+
+    def __init__(self, dout_pin, pd_sck_pin, read_timeout: float = READ_TIMEOUT):
+        self.read_timeout = read_timeout  # Maximum time to wait for a sample (in seconds)
+        self.health = ReadHealth()  # Reads per second, failed-read ratio and read latency
+        super().__init__(dout_pin, pd_sck_pin)
+
+    def wait_ready(self, timeout: float) -> bool:
+        """
+        Wait until a sample is ready (DOUT goes low), without polling
+        :param timeout: maximum time to wait (in seconds)
+        :return: True if a sample is ready
+        """
+        if GPIO.input(self._dout) == GPIO.LOW:
+            return True
+        GPIO.wait_for_edge(self._dout, GPIO.FALLING, timeout=max(1, int(timeout * 1000)))
+        # DOUT stays low until the sample is read, the level is checked in case the edge came before the wait
+        return GPIO.input(self._dout) == GPIO.LOW
+
+    def _read(self, times: int = 1):
+        # Custom read function: wait for the data-ready signal, then read the sample (times is the number of ready
+        # checks of hx711, the sample is already ready). Returns False if no sample is ready before the timeout
+        start = time.monotonic()
+        data = super()._read(times) if self.wait_ready(self.read_timeout) else False
+        self.health.record(time.monotonic() - start, data not in [False, -1])
+        return data
+
+    def get_raw_data(self, times: int = 5):
+        # Modified read function with a deadline and a consecutive-failure limit to avoid infinite loops, only the valid
+        # samples (not False or -1) are returned (see load_cell_sampler.read_samples)
+        return read_samples(self._read, times, self.read_timeout)
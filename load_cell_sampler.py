@@ -0,0 +1,265 @@
+"""
+Continuous sampling of the load cell: a background thread reads the HX711 into a fixed-size ring buffer, so that the
+weight is available immediately from the last samples. The weight statistics are robust to the outliers of the HX711
+(samples far from the median in median absolute deviations are rejected), with the precision of the median to stop the
+weighing as soon as it is precise enough. Also contains the read-health metrics of the load cell drivers.
+"""
+import collections
+import logging
+import math
+import threading
+import time
+from typing import NamedTuple
+import numpy as np
+
+LOGGER = logging.getLogger("PhenoHive")
+BUFFER_SIZE = 100  # Number of samples kept in the ring buffer (10 s at the 10 SPS data rate of the HX711)
+REJECTION = 3.5  # Samples further from the median than this number of (scaled) median absolute deviations are rejected
+MAD_SCALE = 1.4826  # Scale of the median absolute deviation to estimate the standard deviation of normal samples
+Z_95 = 1.96  # Quantile of the normal distribution for a 95% confidence interval
+MEDIAN_EFFICIENCY = 1.2533  # Standard error of the median / standard error of the mean, for normal samples (sqrt(pi/2))
+RETRY_DELAY = 0.1  # Time to wait after a failed read before the next read (in seconds)
+READ_TIMEOUT = 0.5  # Maximum time to wait for a sample of the HX711 (the data rate is 10 samples per second)
+MAX_FAILURES = 3  # Number of consecutive failed reads after which the load cell is considered absent
+
+
+class WeightStats(NamedTuple):
+    """
+    Statistics of the load cell samples of a window
+    """
+    median: float  # Median of the kept samples (-1 if there is no sample)
+    std: float  # Standard deviation of the kept samples
+    mad: float  # Scaled median absolute deviation of the samples
+    samples: int  # Number of samples of the window
+    rejected: float  # Ratio of the samples rejected as outliers
+    sample_rate: float  # Number of samples per second over the window
+
+    def precision(self) -> float:
+        """
+        Half-width of the 95% confidence interval of the median, from the standard deviation of the kept samples
+        :return: the precision in raw load cell units (infinity if there are less than two kept samples)
+        """
+        kept = round(self.samples * (1 - self.rejected))
+        if kept < 2:
+            return math.inf
+        return Z_95 * MEDIAN_EFFICIENCY * self.std / math.sqrt(kept)
+
+
+def robust_stats(values: np.ndarray, times: np.ndarray, rejection: float = REJECTION) -> WeightStats:
+    """
+    Compute the statistics of a window of samples, rejecting the outliers
+    :param values: raw samples, in reading order
+    :param times: monotonic reading time of the samples (in seconds)
+    :param rejection: rejection threshold, in scaled median absolute deviations (0 = no rejection)
+    :return: the statistics of the window
+    """
+    if values.size == 0:
+        return WeightStats(-1.0, -1.0, -1.0, 0, 0.0, 0.0)
+    median = np.median(values)
+    mad = MAD_SCALE * np.median(np.abs(values - median))
+    if rejection > 0 and mad > 0:
+        kept = values[np.abs(values - median) <= rejection * mad]
+    else:
+        # The samples are all equal to the median (or the rejection is disabled)
+        kept = values
+    span = times[-1] - times[0]
+    return WeightStats(
+        median=float(np.median(kept)),
+        std=float(np.std(kept, ddof=1)) if kept.size > 1 else 0.0,
+        mad=float(mad),
+        samples=int(values.size),
+        rejected=1 - kept.size / values.size,
+        sample_rate=(values.size - 1) / span if span > 0 else 0.0
+    )
+
+
+class ReadHealth:
+    """
+    Health metrics of the reads of a load cell driver, over a rolling window of the last reads: reads per second,
+    failed-read ratio and read latency. The reads may be recorded from several threads.
+    """
+
+    def __init__(self, history: int = 100) -> None:
+        """
+        Initialize the metrics
+        :param history: number of reads kept in the window
+        """
+        self.reads = 0  # Total number of reads
+        self.failed = 0  # Total number of failed reads
+        self._window = collections.deque(maxlen=history)  # (end time, latency, success) of the last reads
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, success: bool) -> None:
+        """
+        Record a read
+        :param latency: duration of the read, including the wait for the data (in seconds)
+        :param success: False if the read failed (timeout or invalid data)
+        """
+        with self._lock:
+            self.reads += 1
+            self.failed += not success
+            self._window.append((time.monotonic(), latency, success))
+
+    def stats(self) -> dict[str, float]:
+        """
+        Metrics of the last reads
+        :return: a dictionary with the reads per second, the failed-read ratio and the p50, p95 and max of the read
+                 latency (in seconds), all 0 if there was no read
+        """
+        with self._lock:
+            window = list(self._window)
+        if not window:
+            return {"reads_per_second": 0.0, "failed_ratio": 0.0, "latency_p50": 0.0, "latency_p95": 0.0,
+                    "latency_max": 0.0}
+        latencies = sorted(latency for _, latency, _ in window)
+        # The rate is measured from the start of the first read of the window
+        span = window[-1][0] - (window[0][0] - window[0][1])
+        return {
+            "reads_per_second": len(window) / span if span > 0 else 0.0,
+            "failed_ratio": sum(not success for _, _, success in window) / len(window),
+            "latency_p50": latencies[len(latencies) // 2],
+            "latency_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+            "latency_max": latencies[-1]
+        }
+
+
+def read_samples(read, times: int, read_timeout: float) -> list[int]:
+    """
+    Read valid samples from a load cell driver, with a deadline (read_timeout per sample) to avoid infinite loops, and
+    failing fast after MAX_FAILURES consecutive failed reads (e.g. disconnected load cell)
+    Shared by the get_raw_data methods of the real and simulated drivers.
+    :param read: function reading one sample, returning False or -1 for a failed read (e.g. DebugHx711._read)
+    :param times: number of samples
+    :param read_timeout: maximum time to wait for a sample (in seconds)
+    :return: the valid samples (fewer than times if the deadline was reached or the reads kept failing)
+    """
+    data_list = []
+    failures = 0
+    deadline = time.monotonic() + times * read_timeout
+    while len(data_list) < times and failures < MAX_FAILURES and time.monotonic() < deadline:
+        data = read()
+        if data not in [False, -1]:
+            data_list.append(data)
+            failures = 0
+        else:
+            failures += 1
+    return data_list
+
+
+class LoadCellSampler:
+    """
+    Background sampling of the load cell into a ring buffer of the last samples and their reading times.
+    The load cell must not be read by another thread while the sampler is running.
+    """
+
+    def __init__(self, hx, size: int = BUFFER_SIZE, rejection: float = REJECTION) -> None:
+        """
+        Initialize the sampler (see start)
+        :param hx: load cell driver (DebugHx711 or ReplayHx711)
+        :param size: number of samples kept in the ring buffer
+        :param rejection: outlier rejection threshold, in scaled median absolute deviations (0 = no rejection)
+        """
+        self.hx = hx
+        self.size = size
+        self.rejection = rejection
+        self.reads = 0  # Number of successful reads
+        self.failed = 0  # Number of failed reads
+        self.last_error = None  # Last exception raised by a read
+        self._values = np.zeros(size, np.float64)
+        self._times = np.zeros(size, np.float64)
+        self._lock = threading.Lock()
+        self._new_sample = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Start the sampling thread (if not already running)
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="load_cell_sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Stop the sampling thread after its current read
+        :param timeout: maximum time to wait for the thread (in seconds, default = None, wait forever)
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        """
+        Sampling loop, run by the sampling thread
+        """
+        while not self._stop.is_set():
+            try:
+                sample = self.hx._read()
+            except Exception as e:
+                sample = False
+                if self.last_error is None or str(e) != str(self.last_error):
+                    LOGGER.warning(f"Load cell read failed: {type(e).__name__}: {e}")
+                self.last_error = e
+            if sample in [False, -1]:
+                self.failed += 1
+                self._stop.wait(RETRY_DELAY)
+                continue
+            self.append(sample, time.monotonic())
+
+    def append(self, sample: float, timestamp: float) -> None:
+        """
+        Add a sample to the ring buffer (the oldest sample is overwritten when the buffer is full)
+        :param sample: raw sample
+        :param timestamp: monotonic reading time of the sample (in seconds)
+        """
+        with self._new_sample:
+            index = self.reads % self.size
+            self._values[index] = sample
+            self._times[index] = timestamp
+            self.reads += 1
+            self._new_sample.notify_all()
+
+    def _window(self, n: int | None, since: float | None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Copy the last samples of the buffer, in reading order (the lock must be held)
+        :param n: maximum number of samples (default = None, the whole buffer)
+        :param since: only the samples read after this monotonic time (default = None, all the samples)
+        :return: the samples and their reading times
+        """
+        count = min(self.reads, self.size if n is None else min(n, self.size))
+        indices = np.arange(self.reads - count, self.reads) % self.size
+        values, times = self._values[indices], self._times[indices]
+        if since is not None:
+            recent = times >= since
+            values, times = values[recent], times[recent]
+        return values, times
+
+    def _count(self, since: float | None) -> int:
+        return self._window(None, since)[0].size if since is not None else min(self.reads, self.size)
+
+    def snapshot(self, n: int | None = None, since: float | None = None) -> WeightStats:
+        """
+        Statistics of the last samples, without waiting
+        :param n: maximum number of samples (default = None, the whole buffer)
+        :param since: only use the samples read after this monotonic time (default = None, all the samples)
+        :return: the statistics of the samples
+        """
+        with self._lock:
+            values, times = self._window(n, since)
+        return robust_stats(values, times, self.rejection)
+
+    def wait_samples(self, n: int, since: float | None = None, timeout: float | None = None) -> bool:
+        """
+        Wait until the buffer contains at least n samples
+        :param n: number of samples (at most the size of the buffer)
+        :param since: only count the samples read after this monotonic time (default = None, all the samples)
+        :param timeout: maximum time to wait (in seconds, default = None, wait forever)
+        :return: True if the samples are available, False if the timeout was reached
+        """
+        n = min(n, self.size)
+        with self._new_sample:
+            return self._new_sample.wait_for(lambda: self._count(since) >= n, timeout)
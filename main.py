@@ -4,10 +4,11 @@ This script starts the main loop of the station, and handles the different menus
 """
 from PhenoHiveStation import PhenoHiveStation
 from utils import setup_logger, create_folders
-import time
+from scheduler import MeasurementScheduler
+from profiling import TIMER, profile_round
 import datetime
-import RPi.GPIO as GPIO
 import argparse
+import contextlib
 import configparser
 import logging
 import cv2
@@ -15,6 +16,7 @@ import numpy as np
 
 CONFIG_FILE = "config.ini"
 LOGGER = None
+PROFILE_ROUND = False  # Profile the next measurement round with cProfile (--profile option)
 
 
 def main() -> None:
@@ -43,7 +45,7 @@ def main() -> None:
                 LOGGER.critical("Critical: too many exception raised, exiting.")
                 raise RuntimeError("Too many exception raised, exiting. Check logs for more details.")
             else:
-                time.sleep(5)
+                station.hardware.sleep(5)
 
 
 def handle_main_menu(station: PhenoHiveStation, running: int, n_round: int) -> None:
@@ -53,16 +55,19 @@ def handle_main_menu(station: PhenoHiveStation, running: int, n_round: int) -> N
     :param running: flag to indicate if the station is running (1) or not (0)
     :param n_round: number of measurement rounds done
     """
-    if not GPIO.input(station.BUT_LEFT):
+    # Wait for a button press (unless the measurements must be restarted), ignoring the presses made before the menu
+    station.buttons.clear()
+    button = None if running else station.buttons.wait()
+    if button == "left":
         station.disp.show_cal_prev_menu()
-        time.sleep(1)
+        station.hardware.sleep(1)
         handle_configuration_menu(station)
 
-    if not GPIO.input(station.BUT_RIGHT) or running:
+    if button == "right" or running:
         station.parser['Station']['running'] = "1"
         with open(CONFIG_FILE, 'w') as configfile:
             station.parser.write(configfile)
-        time.sleep(1)
+        station.hardware.sleep(1)
         handle_measurement_loop(station, n_round)
 
 
@@ -71,16 +76,13 @@ def handle_configuration_menu(station: PhenoHiveStation) -> None:
     Configuration menu
     :param station: station object
     """
-    while True:
-        if not GPIO.input(station.BUT_RIGHT):
-            handle_preview_loop(station)
-            time.sleep(1)
-            break
-
-        if not GPIO.input(station.BUT_LEFT):
-            handle_calibration_menu(station)
-            time.sleep(1)
-            break
+    station.buttons.clear()
+    button = station.buttons.wait()
+    if button == "right":
+        handle_preview_loop(station)
+    else:
+        handle_calibration_menu(station)
+    station.hardware.sleep(1)
 
 
 def handle_preview_loop(station: PhenoHiveStation) -> None:
@@ -88,10 +90,15 @@ def handle_preview_loop(station: PhenoHiveStation) -> None:
     Preview loop: takes a preview photo and displays it on the screen to check the camera position
     :param station: station object
     """
+    station.buttons.clear()
     while True:
-        path_img = station.save_photo(preview=True, time_to_wait=1)
-        station.disp.show_image(path_img)
-        if not GPIO.input(station.BUT_RIGHT):
+        if station.CAPTURE_MODE == "memory":
+            # The exposure only needs to converge for the first frame of a warm camera
+            station.disp.show_array(station.camera.capture_array(timeout=1, settle=not station.camera.running))
+        else:
+            path_img = station.save_photo(preview=True, time_to_wait=1)
+            station.disp.show_image(path_img)
+        if station.buttons.poll() == "right":
             break
 
 
@@ -107,9 +114,11 @@ def handle_calibration_menu(station: PhenoHiveStation) -> None:
         station.parser.write(configfile)
     raw_weight = 0
     weight_g = 0
+    station.buttons.clear()
     while True:
         station.disp.show_cal_menu(raw_weight, weight_g, station.tare)
-        if not GPIO.input(station.BUT_LEFT):
+        button = station.buttons.wait()
+        if button == "left":
             # Compute the calibration coefficient
             raw_weight = station.get_weight()[0]
             reference_weight = station.parser['cal_coef']["calibration_weight"]
@@ -119,8 +128,8 @@ def handle_calibration_menu(station: PhenoHiveStation) -> None:
             with open("config.ini", 'w') as configfile:
                 station.parser.write(configfile)
             weight_g = (raw_weight - station.tare) * load_cell_cal
-            time.sleep(1)
-        if not GPIO.input(station.BUT_RIGHT):
+            station.hardware.sleep(1)
+        if button == "right":
             break
 
 
@@ -130,16 +139,15 @@ def handle_status_menu(station: PhenoHiveStation) -> bool:
     :param station: station object
     :return: True if the measurement loop should continue, False otherwise
     """
-    while True:
-        station.disp.show_status()
-        if not GPIO.input(station.BUT_RIGHT):
-            # Resume
-            time.sleep(1)
-            return True
-        if not GPIO.input(station.BUT_LEFT):
-            # Stop
-            time.sleep(1)
-            return False
+    station.disp.show_status()
+    station.buttons.clear()
+    if station.buttons.wait() == "right":
+        # Resume
+        station.hardware.sleep(1)
+        return True
+    # Stop
+    station.hardware.sleep(1)
+    return False
 
 
 def handle_measurement_loop(station: PhenoHiveStation, n_round: int) -> None:
@@ -148,35 +156,56 @@ def handle_measurement_loop(station: PhenoHiveStation, n_round: int) -> None:
     :param station: station object
     :param n_round: number of measurement rounds done
     """
+    global PROFILE_ROUND
     LOGGER.debug("Entering measurement loop")
     growth_value = 0.0
     weight = 0.0
-    time_delta = datetime.timedelta(seconds=station.time_interval)
-    time_now = datetime.datetime.now()
-    time_nxt_measure = time_now + time_delta
+    # Fixed-rate measurement slots on the monotonic clock
+    scheduler = MeasurementScheduler(station.time_interval / station.hardware.speedup, station.catchup_policy)
     continue_measurements = True
+    station.buttons.clear()
     while continue_measurements:
         time_now = datetime.datetime.now()
+        time_nxt_measure = time_now + datetime.timedelta(seconds=scheduler.time_until_next())
         station.disp.show_measuring_menu(round(weight, 2), round(growth_value, 2),
                                          time_now.strftime("%Y/%m/%d %H:%M:%S"),
                                          time_nxt_measure.strftime("%H:%M:%S"), n_round)
 
-        if time_now >= time_nxt_measure:
+        if scheduler.due():
             LOGGER.info("Measuring time reached, starting measurement")
+            jitter = scheduler.begin_round()
+            station.data["start_jitter"] = round(jitter, 3)
             station.disp.show_collecting_data("")
-            growth_value, weight = station.measurement_pipeline()
-            time_nxt_measure = datetime.datetime.now() + time_delta
+            profile_path = f"{station.parser['Paths']['log_folder']}/round_{n_round}.prof"
+            with profile_round(profile_path) if PROFILE_ROUND else contextlib.nullcontext() as profile:
+                growth_value, weight = station.measurement_pipeline()
+            # The presses made during the round are not meant for the measurement menu
+            station.buttons.clear()
+            if PROFILE_ROUND:
+                PROFILE_ROUND = False
+                LOGGER.info(f"Profile of round {n_round} saved to {profile_path}:\n{profile[0]}")
+            duration = scheduler.end_round()
+            TIMER.record("round", duration)
+            LOGGER.info(f"Round {n_round} started {jitter:.3f}s after its slot and took {duration:.1f}s, "
+                        f"scheduler statistics: {scheduler.stats()}")
+            try:
+                station.save_timings()
+            except Exception as e:
+                station.register_error(type(e)(f"Error while saving the stage timings: {e}"))
             n_round += 1
+            continue
 
-        if not GPIO.input(station.BUT_RIGHT):
+        # Wait for a button press until the next slot, refreshing the clock of the display every second
+        button = station.buttons.wait(timeout=min(1.0, scheduler.time_until_next()))
+        if button == "right":
             # Stop the measurements
             station.parser['Station']['running'] = "0"
             with open(CONFIG_FILE, 'w') as configfile:
                 station.parser.write(configfile)
-            time.sleep(1)
+            station.hardware.sleep(1)
             break
 
-        if not GPIO.input(station.BUT_LEFT):
+        if button == "left":
             continue_measurements = handle_status_menu(station)
             if not continue_measurements:
                 # Stop the measurements
@@ -184,8 +213,10 @@ def handle_measurement_loop(station: PhenoHiveStation, n_round: int) -> None:
                 with open(CONFIG_FILE, 'w') as configfile:
                     station.parser.write(configfile)
                 break
-            time.sleep(1)
-    time.sleep(1)
+            station.hardware.sleep(1)
+    # Wait for the last measurements to be sent (concurrent pipeline)
+    station.wait_pending_send()
+    station.hardware.sleep(1)
 
 
 if __name__ == "__main__":
@@ -193,7 +224,10 @@ if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(description='Définition du niveau de log')
     arg_parser.add_argument('-l', '--logger', type=str, help='Niveau de log (DEBUG, INFO, WARNING, ERROR,'
                                                              'CRITICAL). Défaut = DEBUG', default='DEBUG')
+    arg_parser.add_argument('-p', '--profile', action='store_true',
+                            help='Profile the first measurement round with cProfile (saved in the log folder)')
     args = arg_parser.parse_args()
+    PROFILE_ROUND = args.profile
 
     # Read configuration file and create folders if they do not exist
     config_parser = configparser.ConfigParser()
@@ -0,0 +1,396 @@
+"""
+Buffered, rotating store of the measurements in CSV files, with a time index
+The rows are appended to an open file and only flushed (and optionally fsynced) every few rows or seconds, to limit the
+writes to the SD card. The files are rotated by day and/or size, and each file has a compact sidecar index (.idx) giving
+the time range and the byte range of each block of rows, so that a time range is read by seeking to the matching
+blocks instead of scanning the whole history.
+"""
+import logging
+import os
+import re
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+LOGGER = logging.getLogger("PhenoHive")
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"  # Format of the time column
+FILE_TIME_FORMAT = "%Y-%m-%dT%H-%M-%SZ"  # Format of the start time in the names of the rotated files
+ROTATIONS = ("none", "day")
+INDEX_SUFFIX = ".idx"
+INDEX_RECORD = struct.Struct("<QQdd")  # Index block: start offset, end offset, min time, max time
+INDEX_ROWS = 100  # Default number of rows per index block
+
+
+def parse_time(timestamp: str) -> float:
+    """
+    Convert a measurement time to a number, to compare and index the rows
+    :param timestamp: time in TIME_FORMAT
+    :raises ValueError: If the time is not in TIME_FORMAT
+    :return: the time in seconds since the epoch (the time is taken as UTC, like it is written)
+    """
+    return datetime.strptime(timestamp, TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+def format_time(seconds: float, time_format: str = TIME_FORMAT) -> str:
+    """
+    Convert a number from parse_time back to a measurement time
+    :param seconds: time in seconds since the epoch
+    :param time_format: format of the result (default = TIME_FORMAT)
+    :return: the formatted time
+    """
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime(time_format)
+
+
+def segments(path: str) -> list[str]:
+    """
+    List the files of a measurement store, oldest first: the file at the configured path (if it exists), then the
+    rotated files <name>_<start time>.csv next to it
+    :param path: configured path of the store (e.g. data/measurements.csv)
+    :return: the paths of the files
+    """
+    folder, name = os.path.split(path)
+    stem, extension = os.path.splitext(name)
+    pattern = re.compile(re.escape(stem) + r"_\d{4}-\d{2}-\d{2}T\d{2}-\d{2}-\d{2}Z" + re.escape(extension) + "$")
+    rotated = sorted(entry.path for entry in os.scandir(folder or ".") if entry.is_file() and pattern.match(entry.name))
+    return ([path] if os.path.exists(path) else []) + rotated
+
+
+def load_index(path: str) -> list[tuple[int, int, float, float]]:
+    """
+    Load the sidecar index of a file, ignoring the blocks beyond the end of the file (not flushed before a crash)
+    :param path: path to the CSV file
+    :return: the blocks as (start offset, end offset, min time, max time) tuples
+    """
+    if not os.path.exists(path + INDEX_SUFFIX):
+        return []
+    size = os.path.getsize(path)
+    with open(path + INDEX_SUFFIX, "rb") as f:
+        data = f.read()
+    blocks = []
+    for block in INDEX_RECORD.iter_unpack(data[:len(data) - len(data) % INDEX_RECORD.size]):
+        if block[1] > size:
+            break
+        blocks.append(block)
+    return blocks
+
+
+def scan_blocks(f, start: int, end: int, index_rows: int = INDEX_ROWS) -> list[tuple[int, int, float, float]]:
+    """
+    Build the index blocks of a range of complete rows
+    :param f: CSV file open in binary mode
+    :param start: offset of the first row
+    :param end: offset of the end of the last row
+    :param index_rows: number of rows per block
+    :return: the blocks as (start offset, end offset, min time, max time) tuples
+    """
+    blocks = []
+    f.seek(start)
+    offset = block_start = start
+    times = []
+    while offset < end:
+        line = f.readline()
+        offset += len(line)
+        try:
+            times.append(parse_time(line.split(b",", 1)[0].decode()))
+        except (UnicodeDecodeError, ValueError):
+            pass  # Malformed row, its block is still read
+        if len(times) >= index_rows or offset >= end:
+            if times:
+                blocks.append((block_start, offset, min(times), max(times)))
+            elif blocks:
+                blocks[-1] = blocks[-1][:1] + (offset,) + blocks[-1][2:]
+            block_start = offset
+            times = []
+    return blocks
+
+
+def block_ranges(path: str, start: float | None = None, end: float | None = None,
+                 size: int | None = None) -> list[tuple[int, int]]:
+    """
+    Find the byte ranges of a file that may hold rows within a time range: the index blocks that overlap the range, and
+    the rows after the last indexed block (not indexed yet)
+    :param path: path to the CSV file
+    :param start: start of the range (seconds since the epoch, see parse_time, included), None for no start
+    :param end: end of the range (excluded), None for no end
+    :param size: size of the file to consider (default = current size of the file)
+    :return: the (start offset, end offset) ranges, in file order
+    """
+    start = -float("inf") if start is None else start
+    end = float("inf") if end is None else end
+    size = os.path.getsize(path) if size is None else size
+    blocks = load_index(path)
+    ranges = [(first, last) for first, last, low, high in blocks if low < end and high >= start]
+    if blocks:
+        tail = blocks[-1][1]
+    else:
+        with open(path, "rb") as f:
+            tail = len(f.readline())
+    if tail < size:
+        ranges.append((tail, size))
+    return ranges
+
+
+def read_range(path: str, start: float | None = None, end: float | None = None) -> tuple[list[str], list[list[str]]]:
+    """
+    Read the rows of a file within a time range, seeking to the index blocks that overlap the range
+    :param path: path to the CSV file
+    :param start: start of the range (seconds since the epoch, see parse_time, included), None for no start
+    :param end: end of the range (excluded), None for no end
+    :return: the header and the rows (lists of values as strings, the time first), in file order
+    """
+    low = -float("inf") if start is None else start
+    high = float("inf") if end is None else end
+    rows = []
+    with open(path, "rb") as f:
+        header = f.readline().decode().rstrip("\n").split(",")
+        for first, last in block_ranges(path, start, end, os.fstat(f.fileno()).st_size):
+            f.seek(first)
+            for line in f.read(last - first).decode(errors="replace").split("\n"):
+                values = line.split(",")
+                try:
+                    if low <= parse_time(values[0]) < high:
+                        rows.append(values)
+                except ValueError:
+                    continue  # Malformed or incomplete row
+    return header, rows
+
+
+class MeasurementStore:
+    """
+    Append-only CSV files of the measurements (one row per measurement, the time first), written through a buffered
+    handle and rotated by day and/or size. Thread-safe: the rows may be appended by the DB sending and analysis threads.
+    """
+
+    def __init__(self, path: str, fields: list[str], rotation: str = "none", max_mb: float = 0, flush_rows: int = 1,
+                 flush_interval: float = 0, fsync: bool = False, index_rows: int = INDEX_ROWS,
+                 clock=time.monotonic) -> None:
+        """
+        Open the store, the last file is reopened for appending
+        :param path: path to the CSV file, or name of the rotated files (<name>_<start time>.csv) if rotated
+        :param fields: names of the columns after the time
+        :param rotation: none (a single file, unless max_mb is set) or day (a new file each day, by measurement time)
+        :param max_mb: a new file is started once the file reaches this size (in MB, 0 = no size limit)
+        :param flush_rows: the rows are written to the file every flush_rows rows (1 = each row)
+        :param flush_interval: the rows are also written once the oldest buffered row is older than this (in seconds,
+        0 = no limit), checked when a row is appended
+        :param fsync: force the written rows to the SD card (fsync) at each flush, otherwise the OS writes them later
+        :param index_rows: number of rows per index block
+        :param clock: monotonic clock function (default = time.monotonic)
+        :raises ValueError: If the rotation is unknown
+        """
+        if rotation not in ROTATIONS:
+            raise ValueError(f"Unknown rotation '{rotation}', should be one of {ROTATIONS}")
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.header = ",".join(["time"] + fields) + "\n"
+        self.rotation = rotation
+        self.max_size = int(max_mb * 2 ** 20)
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.index_rows = max(1, index_rows)
+        self.clock = clock
+        self.rows = 0  # Number of rows appended
+        self._lock = threading.Lock()
+        self._file = None  # Current file, open for appending in binary mode
+        self._index = None  # Sidecar index of the current file
+        self._day = ""  # Day of the first row of the current file (day rotation)
+        self._offset = 0  # End of the current file, buffered rows included
+        self._block = None  # Index block being filled: [start offset, end offset, min time, max time, rows]
+        self._pending_blocks = []  # Completed index blocks not written yet
+        self._pending_rows = 0  # Rows not written to the file yet
+        self._first_pending = 0.0  # Time at which the oldest buffered row was appended
+        with self._lock:
+            # A file written with other columns (by another version of the station) is not appended to
+            if self.rotated:
+                files = [file for file in segments(path) if file != path]
+                # Otherwise, the first row starts a new rotated file
+                if files:
+                    self._open(files[-1])
+            elif not self._open(path):
+                self._archive(path)
+                self._open(path)
+
+    @property
+    def rotated(self) -> bool:
+        """
+        True if the rows are written to rotated files instead of a single file
+        """
+        return self.rotation != "none" or self.max_size > 0
+
+    def current_path(self) -> str | None:
+        """
+        Path of the file the rows are appended to
+        :return: the path, or None if no row was appended to a rotated store yet
+        """
+        with self._lock:
+            return None if self._file is None else self._file.name
+
+    def _open(self, path: str) -> bool:
+        """
+        Open a file for appending, repairing the end of the file and the index after a crash (the lock must be held)
+        :param path: path to the CSV file
+        :return: True if the file was opened, False if its columns differ from the measurements (it is not opened)
+        """
+        self._close()
+        with open(path, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size > 0:
+                # A row torn by a crash during its write is removed
+                f.seek(max(0, size - 4096))
+                tail = f.read()
+                if not tail.endswith(b"\n"):
+                    cut = tail.rfind(b"\n")
+                    size = size - len(tail) + cut + 1 if cut >= 0 else 0
+                    LOGGER.warning(f"Removed an incomplete row at the end of {path}")
+                    f.truncate(size)
+            if size == 0:
+                f.write(self.header.encode())
+                size = len(self.header)
+            f.seek(0)
+            header = f.readline()
+            f.flush()
+            blocks = load_index(path)
+            indexed = blocks[-1][1] if blocks else len(header)
+            blocks += scan_blocks(f, indexed, size, self.index_rows)
+        # Rewrite the index if it had blocks beyond the end of the file or rows were not indexed
+        with open(path + INDEX_SUFFIX, "wb") as index:
+            index.write(b"".join(INDEX_RECORD.pack(*block) for block in blocks))
+        if header.decode(errors="replace") != self.header:
+            LOGGER.warning(f"The columns of {path} differ from the measurements, the rows go to a new file")
+            return False
+        self._file = open(path, "ab")
+        self._index = open(path + INDEX_SUFFIX, "ab")
+        self._offset = size
+        with open(path, "rb") as f:
+            f.readline()
+            first = f.readline().split(b",", 1)[0].decode(errors="replace")
+        self._day = first[:10]
+        return True
+
+    def _archive(self, path: str) -> None:
+        """
+        Rename a file written with other columns to a rotated file name, after the time of its first row, so that it
+        stays in the history (the lock must be held)
+        :param path: path to the CSV file
+        """
+        with open(path, "rb") as f:
+            f.readline()
+            first = f.readline().split(b",", 1)[0].decode(errors="replace")
+        try:
+            seconds = parse_time(first)
+        except ValueError:
+            seconds = os.path.getmtime(path)
+        folder, name = os.path.split(path)
+        stem, extension = os.path.splitext(name)
+        while True:
+            archive = os.path.join(folder, f"{stem}_{format_time(seconds, FILE_TIME_FORMAT)}{extension}")
+            if not os.path.exists(archive):
+                break
+            seconds += 1
+        os.replace(path + INDEX_SUFFIX, archive + INDEX_SUFFIX)
+        os.replace(path, archive)
+        LOGGER.info(f"Measurements with other columns moved to {archive}")
+
+    def _rotate(self, timestamp: str, seconds: float) -> None:
+        """
+        Start a new rotated file, named after the time of its first row (the lock must be held)
+        :param timestamp: time of the first row
+        :param seconds: the same time, in seconds since the epoch
+        """
+        folder, name = os.path.split(self.path)
+        stem, extension = os.path.splitext(name)
+        while True:
+            path = os.path.join(folder, f"{stem}_{format_time(seconds, FILE_TIME_FORMAT)}{extension}")
+            if not os.path.exists(path) and (self._file is None or path > self._file.name):
+                break
+            seconds += 1  # Keep the names in order if a late row comes after a newer file
+        self._open(path)
+        self._day = timestamp[:10]
+
+    def append(self, timestamp: str, values: list) -> None:
+        """
+        Append a measurement row, written to the file according to the flush policy
+        :param timestamp: time of the measurement, in TIME_FORMAT
+        :param values: values of the fields, in the order of the columns
+        """
+        seconds = parse_time(timestamp)
+        line = (",".join(str(value) for value in [timestamp] + list(values)) + "\n").encode()
+        with self._lock:
+            if self._file is None:
+                self._rotate(timestamp, seconds)
+            elif self.rotated and ((self.rotation == "day" and timestamp[:10] > self._day) or
+                                   (self.max_size > 0 and self._offset + len(line) > self.max_size and
+                                    self._offset > len(self.header))):
+                self._flush()
+                self._rotate(timestamp, seconds)
+            if not self._day:
+                self._day = timestamp[:10]
+            if self._pending_rows == 0:
+                self._first_pending = self.clock()
+            self._file.write(line)
+            if self._block is None:
+                self._block = [self._offset, self._offset, seconds, seconds, 0]
+            self._offset += len(line)
+            block = self._block
+            block[1] = self._offset
+            block[2] = min(block[2], seconds)
+            block[3] = max(block[3], seconds)
+            block[4] += 1
+            if block[4] >= self.index_rows:
+                self._pending_blocks.append(tuple(block[:4]))
+                self._block = None
+            self.rows += 1
+            self._pending_rows += 1
+            if self._pending_rows >= self.flush_rows or \
+                    (self.flush_interval > 0 and self.clock() - self._first_pending >= self.flush_interval):
+                self._flush()
+
+    def _flush(self) -> None:
+        """
+        Write the buffered rows, then the completed index blocks (the lock must be held)
+        """
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        if self._pending_blocks:
+            self._index.write(b"".join(INDEX_RECORD.pack(*block) for block in self._pending_blocks))
+            self._index.flush()
+            if self.fsync:
+                os.fsync(self._index.fileno())
+            self._pending_blocks = []
+        self._pending_rows = 0
+
+    def flush(self) -> None:
+        """
+        Write the buffered rows to the file
+        """
+        with self._lock:
+            self._flush()
+
+    def _close(self) -> None:
+        """
+        Write the buffered rows and the partial index block, and close the current file (the lock must be held)
+        """
+        if self._file is None:
+            return
+        if self._block is not None:
+            self._pending_blocks.append(tuple(self._block[:4]))
+            self._block = None
+        self._flush()
+        self._file.close()
+        self._index.close()
+        self._file = self._index = None
+
+    def close(self) -> None:
+        """
+        Write the buffered rows and close the store
+        """
+        with self._lock:
+            self._close()
@@ -0,0 +1,121 @@
+"""
+Lightweight timing instrumentation of the pipeline stages: a context manager / decorator recording the duration of each
+stage, with rolling percentiles kept in memory, and an optional cProfile of a single measurement round
+"""
+import collections
+import contextlib
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+
+class _Stage(contextlib.ContextDecorator):
+    """
+    Timing of a stage, used as a context manager or as a decorator (see StageTimer.stage)
+    """
+
+    def __init__(self, timer: 'StageTimer', name: str) -> None:
+        self.timer = timer
+        self.name = name
+        self._start = threading.local()
+
+    def __enter__(self) -> '_Stage':
+        self._start.value = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.timer.record(self.name, time.perf_counter() - self._start.value)
+        return False
+
+
+class StageTimer:
+    """
+    Durations of the pipeline stages: the last duration of each stage and a rolling window of durations to compute the
+    p50, p95 and max. The stages may be timed from several threads.
+    """
+
+    def __init__(self, history: int = 100) -> None:
+        """
+        Initialize the timer
+        :param history: number of durations kept for each stage
+        """
+        self.history = history
+        self.durations = {}  # Rolling window of the durations of each stage (in seconds)
+        self.last = {}  # Last duration of each stage (in seconds)
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> _Stage:
+        """
+        Time a stage, e.g. `with TIMER.stage("camera"):` or `@TIMER.stage("display")`
+        :param name: name of the stage
+        :return: the context manager / decorator
+        """
+        return _Stage(self, name)
+
+    def record(self, name: str, duration: float) -> None:
+        """
+        Record the duration of a stage
+        :param name: name of the stage
+        :param duration: duration of the stage (in seconds)
+        """
+        with self._lock:
+            if name not in self.durations:
+                self.durations[name] = collections.deque(maxlen=self.history)
+            self.durations[name].append(duration)
+            self.last[name] = duration
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Statistics of the stages
+        :return: for each stage, a dictionary with the last duration, the p50, p95 and max of the rolling window
+                (in seconds) and the number of durations in the window
+        """
+        with self._lock:
+            windows = {name: sorted(values) for name, values in self.durations.items()}
+            last = dict(self.last)
+        stats = {}
+        for name, ordered in windows.items():
+            stats[name] = {
+                "last": last[name],
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                "max": ordered[-1],
+                "count": len(ordered)
+            }
+        return stats
+
+    def reset(self) -> None:
+        """
+        Forget all the recorded durations
+        """
+        with self._lock:
+            self.durations.clear()
+            self.last.clear()
+
+
+@contextlib.contextmanager
+def profile_round(path: str, top: int = 25):
+    """
+    Profile a block (e.g. a measurement round) with cProfile, only the calling thread is profiled
+    :param path: path of the file where the profile is saved (readable with pstats or snakeviz)
+    :param top: number of functions of the summary
+    :return: a context manager yielding a list, filled with the summary of the most expensive functions (cumulative
+            time) when the block exits
+    """
+    profiler = cProfile.Profile()
+    summary = []
+    profiler.enable()
+    try:
+        yield summary
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(top)
+        summary.append(output.getvalue())
+
+
+# Timer of the station stages
+TIMER = StageTimer()
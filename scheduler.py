@@ -0,0 +1,122 @@
+"""
+Measurement scheduler: fixed-rate measurement slots on the monotonic clock (no drift with the pipeline duration, and not
+affected by the wall-clock jumps when the time is synchronised after boot), with a policy for the missed slots and
+statistics of the start jitter and duration of the rounds
+"""
+import collections
+import time
+
+# Policies for the slots missed while a round (or a menu) was running:
+#   skip: the missed slots are dropped, the next round waits for the next slot
+#   catchup: the missed slots are run back-to-back until the schedule is caught up (at most MAX_CATCHUP rounds)
+#   coalesce: the missed slots are merged into a single round, run immediately
+POLICIES = ("skip", "catchup", "coalesce")
+# A round starting later than this after its slot is considered as missing it (in seconds)
+LATE_TOLERANCE = 1.0
+# Maximum number of missed slots run back-to-back by the catchup policy, the older slots are dropped
+MAX_CATCHUP = 10
+
+
+class MeasurementScheduler:
+    """
+    Fixed-rate scheduler of the measurement rounds: the slots are at start + k * interval on the monotonic clock
+    """
+
+    def __init__(self, interval: float, policy: str = "skip", history: int = 100, clock=time.monotonic) -> None:
+        """
+        Initialize the scheduler, the first slot is one interval from now
+        :param interval: time between two slots (in seconds)
+        :param policy: policy for the missed slots, one of POLICIES (default = "skip")
+        :param history: number of rounds kept for the statistics (default = 100)
+        :param clock: monotonic clock function (default = time.monotonic)
+        :raises ValueError: If the interval is not positive or the policy is unknown
+        """
+        if interval <= 0:
+            raise ValueError(f"The interval must be positive, got {interval}")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy '{policy}', should be one of {POLICIES}")
+        self.interval = interval
+        self.policy = policy
+        self.clock = clock
+        self.deadline = clock() + interval  # Time of the next slot
+        self.rounds = 0
+        self.skipped = 0  # Number of slots dropped (skip policy, coalesced slots or catchup limit)
+        self.jitters = collections.deque(maxlen=history)  # Start delay of the rounds from their slot (in seconds)
+        self.durations = collections.deque(maxlen=history)  # Duration of the rounds (in seconds)
+        self._round_start = None
+
+    def time_until_next(self) -> float:
+        """
+        Time until the next slot
+        :return: the time in seconds (0 if the slot is reached)
+        """
+        return max(0.0, self.deadline - self.clock())
+
+    def due(self) -> bool:
+        """
+        Check if a round must start now, applying the policy to the missed slots
+        :return: True if a round must start
+        """
+        now = self.clock()
+        late = now - self.deadline
+        if late < 0:
+            return False
+        if late <= LATE_TOLERANCE:
+            return True
+
+        # Number of slots whose time has passed, including the current one
+        missed = int(late // self.interval) + 1
+        if self.policy == "skip":
+            self._drop(missed)
+            return False
+        if self.policy == "coalesce":
+            # Run a single round for the latest missed slot
+            self._drop(missed - 1)
+        elif missed > MAX_CATCHUP:
+            self._drop(missed - MAX_CATCHUP)
+        return True
+
+    def _drop(self, slots: int) -> None:
+        """
+        Drop missed slots
+        :param slots: number of slots to drop
+        """
+        self.deadline += slots * self.interval
+        self.skipped += slots
+
+    def begin_round(self) -> float:
+        """
+        Start a round in the current slot
+        :return: the start jitter of the round (delay from its slot, in seconds)
+        """
+        now = self.clock()
+        jitter = now - self.deadline
+        self.jitters.append(jitter)
+        self.deadline += self.interval
+        self._round_start = now
+        return jitter
+
+    def end_round(self) -> float:
+        """
+        End the current round
+        :return: the duration of the round (in seconds)
+        """
+        duration = self.clock() - self._round_start
+        self.durations.append(duration)
+        self.rounds += 1
+        self._round_start = None
+        return duration
+
+    def stats(self) -> dict:
+        """
+        Statistics of the last rounds
+        :return: a dictionary with the number of rounds and skipped slots, the mean, 95th percentile and maximum of the
+                start jitter and of the round duration (in seconds)
+        """
+        stats = {"rounds": self.rounds, "skipped": self.skipped}
+        for name, values in (("jitter", self.jitters), ("duration", self.durations)):
+            ordered = sorted(values)
+            stats[f"{name}_mean"] = sum(ordered) / len(ordered) if ordered else 0.0
+            stats[f"{name}_p95"] = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0
+            stats[f"{name}_max"] = ordered[-1] if ordered else 0.0
+        return stats
@@ -1,6 +1,7 @@
 from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
+from profiling import TIMER
 
 FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
 LOGO = "assets/logo_phenohive.jpg"
@@ -66,6 +67,7 @@ class Display:
             draw.rectangle((i, i, self.WIDTH-1-i, self.HEIGHT-1-i), outline=self.get_status())
         return img, draw
 
+    @TIMER.stage("display")
     def show_image(self, path_img: str) -> None:
         """
         Show an image on the display
@@ -75,6 +77,17 @@ class Display:
         image = image.rotate(0).resize(self.SIZE)
         self.SCREEN.display(image)
 
+    @TIMER.stage("display")
+    def show_array(self, frame: np.ndarray) -> None:
+        """
+        Show an image already in memory on the display (the frame is resized before the color conversion)
+        :param frame: BGR image to show
+        """
+        thumbnail = cv2.resize(frame, self.SIZE, interpolation=cv2.INTER_AREA)
+        image = Image.fromarray(cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB))
+        self.SCREEN.display(image)
+
+    @TIMER.stage("display")
     def show_measuring_menu(self, weight: float, growth: int, time_now: str, time_next_measure: str,
                             n_rounds: int) -> None:
         """
@@ -100,6 +113,7 @@ class Display:
         img_np = np.array(img)
         cv2.imwrite("menu/mesuring.jpg", img_np)
 
+    @TIMER.stage("display")
     def show_menu(self) -> None:
         """
         Show the main menu
@@ -116,6 +130,7 @@ class Display:
         img_np = np.array(img)
         cv2.imwrite("menu/main_menu.jpg", img_np)
 
+    @TIMER.stage("display")
     def show_cal_prev_menu(self) -> None:
         """
         Show the preview menu
@@ -131,6 +146,7 @@ class Display:
         img_np = np.array(img)
         cv2.imwrite("menu/cal_prev_menu.jpg", img_np)
 
+    @TIMER.stage("display")
     def show_cal_menu(self, raw_weight, weight_g, tare) -> None:
         """
         Show the calibration menu
@@ -152,6 +168,7 @@ class Display:
         img_np = np.array(img)
         cv2.imwrite("menu/cal_menu.jpg", img_np)
 
+    @TIMER.stage("display")
     def show_collecting_data(self, action):
         """
         Show the collecting data menu
@@ -168,6 +185,7 @@ class Display:
         img_np = np.array(img)
         cv2.imwrite("menu/collecting_data.jpg", img_np)
 
+    @TIMER.stage("display")
     def show_status(self) -> None:
         """
         Show the status menu
@@ -187,6 +205,10 @@ class Display:
             font = ImageFont.truetype(FONT, 7)
             draw.text((3, 95), f"Error at {self.STATION.last_error[0]}", font=font, fill=(0, 0, 0))
             draw.text((3, 110), f"{self.STATION.last_error[1]}", font=font, fill=(0, 0, 0))
+        if self.STATION.analysis_queue is not None:
+            # Photos waiting for the background analysis
+            font = ImageFont.truetype(FONT, 7)
+            draw.text((3, 120), f"Analysis queue: {self.STATION.analysis_queue.depth()}", font=font, fill=(0, 0, 0))
 
         # Button
         font = ImageFont.truetype(FONT, 10)
@@ -0,0 +1,106 @@
+"""
+Vectorised skeleton graph analysis: end points (tips), branch points and segment path lengths of a plant skeleton.
+Replaces plantcv segment_skeleton/segment_path_length, without global state so that analyses can run concurrently.
+"""
+import cv2
+import numpy as np
+from typing import NamedTuple
+
+DIAGONAL_STEP = float(np.sqrt(2))
+
+
+class SkeletonGraph(NamedTuple):
+    """
+    Result of the skeleton analysis
+    """
+    segment_lengths: list[float]  # path length of each segment (in pixels)
+    branch_points: int  # number of branch points (junctions of 3 segments or more)
+    tips: int  # number of end points
+
+
+def branch_count(skeleton: np.ndarray) -> np.ndarray:
+    """
+    Count the branches leaving each pixel of a skeleton: its 4-connected neighbours, plus its diagonal neighbours that
+    are not next to one of them. A diagonal neighbour next to a 4-connected one is on the same branch (e.g. the corners
+    of the 4-connected staircases left by the Zhang-Suen thinning), so it is not counted.
+    :param skeleton: skeleton image (uint8 0/255 or boolean)
+    :return: the number of branches of each pixel (uint8), 0 outside the skeleton
+    """
+    sk = np.pad(skeleton > 0, 1)
+    centre = sk[1:-1, 1:-1]
+    n, s, w, e = sk[:-2, 1:-1], sk[2:, 1:-1], sk[1:-1, :-2], sk[1:-1, 2:]
+    nw, ne, sw, se = sk[:-2, :-2], sk[:-2, 2:], sk[2:, :-2], sk[2:, 2:]
+    count = (n.astype(np.uint8) + s + w + e + (nw & ~n & ~w) + (ne & ~n & ~e) + (sw & ~s & ~w) + (se & ~s & ~e))
+    count *= centre
+    return count
+
+
+def remove_staircases(skeleton: np.ndarray) -> np.ndarray:
+    """
+    Thin a skeleton to 8-connectivity: remove the corners of the 4-connected staircases left by the Zhang-Suen
+    thinning, so that a diagonal run is measured as diagonal steps rather than twice as many 4-connected steps.
+    A corner is a pixel with exactly one vertical and one horizontal 4-connected neighbour and no other branch, the
+    corners of each orientation are removed in a separate pass so that the skeleton stays connected.
+    :param skeleton: skeleton image (boolean)
+    :return: the thinned skeleton (boolean, a copy)
+    """
+    sk = np.pad(skeleton, 1)
+    centre = sk[1:-1, 1:-1]
+    n, s, w, e = sk[:-2, 1:-1], sk[2:, 1:-1], sk[1:-1, :-2], sk[1:-1, 2:]
+    nw, ne, sw, se = sk[:-2, :-2], sk[:-2, 2:], sk[2:, :-2], sk[2:, 2:]
+    # (vertical, horizontal, other 4-neighbours, diagonal between them, opposite diagonal) of each orientation
+    for vertical, horizontal, others, inner, outer in ((s, w, (n, e), sw, ne), (n, e, (s, w), ne, sw),
+                                                       (s, e, (n, w), se, nw), (n, w, (s, e), nw, se)):
+        # The views follow the padded image, so each pass sees the corners removed by the previous ones
+        corners = vertical & horizontal & ~others[0] & ~others[1] & ~inner & ~outer
+        centre &= ~corners
+    return sk[1:-1, 1:-1].copy()
+
+
+def analyse_skeleton(skeleton: np.ndarray) -> SkeletonGraph:
+    """
+    Analyse a skeleton: thin its staircases (see remove_staircases), find its tips (pixels with one branch) and branch
+    points (pixels with three branches or more, adjacent branch pixels counting as a single branch point, see
+    branch_count), split it into segments at the branch points and compute the path length of each segment.
+    Steps between 4-connected pixels count for 1 and diagonal steps for sqrt(2) (unless the diagonal is already covered
+    by two 4-connected steps). The steps linking a segment to the pixels around a branch point are counted in the
+    segment, the steps within these pixels are not counted.
+    :param skeleton: skeleton image (uint8 0/255 or boolean), one pixel wide
+    :raises: KeyError if no segment is found in the skeleton
+    :return: the skeleton graph
+    """
+    sk = skeleton > 0
+    if not sk.any():
+        raise KeyError("No segment found in the skeleton")
+    sk = remove_staircases(sk)
+
+    # The staircase corners left around the branch points have three 8-neighbours but only two branches
+    count = branch_count(sk)
+    tips = int(np.count_nonzero(count == 1))
+    branches = (count >= 3).astype(np.uint8)
+    n_branch_points = cv2.connectedComponents(branches, connectivity=8)[0] - 1
+    del count
+
+    # Label the segments (skeleton without the pixels around its branch points, like plantcv segment_skeleton, so that
+    # the branches leaving a branch point through diagonal neighbours are not joined)
+    segments = (sk & (cv2.dilate(branches, np.ones((3, 3), np.uint8)) == 0)).astype(np.uint8)
+    n_labels, labels = cv2.connectedComponents(segments, connectivity=8)
+    del segments, branches
+    if n_labels <= 1:
+        # Only branch pixels (e.g. a small blob), no measurable segment
+        raise KeyError("No segment found in the skeleton")
+
+    lengths = np.zeros(n_labels, np.float64)
+    steps = (
+        # (first pixels, second pixels, step mask, weight)
+        (labels[:, :-1], labels[:, 1:], sk[:, :-1] & sk[:, 1:], 1.0),
+        (labels[:-1, :], labels[1:, :], sk[:-1, :] & sk[1:, :], 1.0),
+        (labels[:-1, :-1], labels[1:, 1:], sk[:-1, :-1] & sk[1:, 1:] & ~sk[:-1, 1:] & ~sk[1:, :-1], DIAGONAL_STEP),
+        (labels[:-1, 1:], labels[1:, :-1], sk[:-1, 1:] & sk[1:, :-1] & ~sk[:-1, :-1] & ~sk[1:, 1:], DIAGONAL_STEP)
+    )
+    for first, second, mask, weight in steps:
+        # A step belongs to the segment of its pixels, or to the segment it links to a branch point region (label 0)
+        # Steps within a branch point region end up in label 0 and are discarded
+        owners = np.maximum(first[mask], second[mask])
+        lengths += weight * np.bincount(owners, minlength=n_labels)
+    return SkeletonGraph(lengths[1:].tolist(), n_branch_points, tips)
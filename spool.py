@@ -0,0 +1,250 @@
+"""
+Durable offline spool of the InfluxDB points
+The points that could not be sent to the DB are appended in line protocol (with their measurement time) to segment
+files, written with fsync so that they survive a crash or a power loss, and are sent again in large batches once the DB
+is reachable. The spool is size-bounded: when it is full, the oldest segment is dropped.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+LOGGER = logging.getLogger("PhenoHive")
+SEGMENT_SIZE = 2 ** 20  # Size of a segment file before a new one is started (in bytes)
+MAX_SIZE_MB = 50  # Default maximum size of the spool (in MB)
+BATCH_SIZE = 5000  # Default number of points sent per write when draining the spool
+SEGMENT_SUFFIX = ".lp"
+REJECTED_FILE = "rejected.txt"  # Points rejected by the DB, kept aside in the spool folder (not sent again)
+
+
+def read_lines(path: str) -> list[str]:
+    """
+    Read the complete lines of a segment (a line torn by a crash during its write is ignored)
+    :param path: path to the segment file
+    :return: the lines, without the line breaks
+    """
+    with open(path) as f:
+        lines = f.read().split("\n")
+    # The last element is "" if the file ends with a line break, or an incomplete line
+    return [line for line in lines[:-1] if line]
+
+
+def line_time(line: str) -> int | None:
+    """
+    Get the timestamp of a line protocol point
+    :param line: the point in line protocol
+    :return: the timestamp in nanoseconds, or None if the point has no timestamp
+    """
+    try:
+        return int(line.rsplit(" ", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def drop_field(line: str, field: str) -> str:
+    """
+    Remove a field from a line protocol point (e.g. the picture, too large to be spooled)
+    :param line: the point in line protocol
+    :param field: name of the field
+    :return: the point without the field (unchanged if the field is not found or is the only field of the point)
+    """
+    value = r'(?:"(?:[^"\\]|\\.)*"|[^,\s"]*)'
+    # Field after another field, or first field followed by another field
+    dropped = re.sub(rf",{re.escape(field)}={value}(?=[ ,]|$)", "", line, count=1)
+    if dropped != line:
+        return dropped
+    return re.sub(rf" {re.escape(field)}={value},", " ", line, count=1)
+
+
+def rejected_by_db(exception: Exception) -> bool:
+    """
+    Check if a write error is a rejection of the points by the DB (HTTP 4xx, e.g. a malformed point or a field type
+    conflict): the DB is reachable, and writing the same points again would fail the same way
+    429 (too many requests) is a transient error, not a rejection
+    :param exception: the error of the write
+    :return: True if the points were rejected
+    """
+    status = getattr(exception, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+class Spool:
+    """
+    Append-only spool of line protocol points, stored in numbered segment files in a folder and sent oldest first.
+    A segment is only deleted once all its points were written to the DB, so that the points of a segment interrupted by
+    a failed write or a crash are sent again (the DB overwrites a point with the same series and timestamp).
+    """
+
+    def __init__(self, folder: str, max_mb: float = MAX_SIZE_MB, segment_size: int = SEGMENT_SIZE) -> None:
+        """
+        Open (or create) the spool, the points left by a previous run are kept
+        :param folder: folder of the segment files
+        :param max_mb: maximum size of the spool (in MB), the oldest segments are dropped beyond
+        :param segment_size: size of a segment file before a new one is started (in bytes)
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.max_size = int(max_mb * 2 ** 20)
+        self.segment_size = segment_size
+        self.dropped = 0  # Number of points dropped because the spool was full
+        self.rejected = 0  # Number of points rejected by the DB and moved to the rejected file
+        self._lock = threading.Lock()
+        self._current = None  # Segment file open for appending
+        self._segments = sorted(entry.path for entry in os.scandir(folder)
+                                if entry.is_file() and entry.name.endswith(SEGMENT_SUFFIX))
+        self._counts = {path: len(read_lines(path)) for path in self._segments}
+        self._size = sum(os.path.getsize(path) for path in self._segments)
+
+    def put(self, lines: list[str]) -> None:
+        """
+        Append points to the spool, the points are on the disk when the method returns
+        :param lines: points in line protocol, with their timestamp
+        """
+        if not lines:
+            return
+        data = "".join(line + "\n" for line in lines)
+        with self._lock:
+            if self._current is None or self._current.tell() >= self.segment_size:
+                self._open_segment()
+            self._current.write(data)
+            self._current.flush()
+            os.fsync(self._current.fileno())
+            self._counts[self._current.name] += len(lines)
+            self._size += len(data.encode())
+            self._enforce_limit()
+
+    def quarantine(self, lines: list[str]) -> None:
+        """
+        Keep aside points rejected by the DB: they are appended to the rejected file of the spool folder for inspection,
+        and are not sent again
+        :param lines: points in line protocol
+        """
+        if not lines:
+            return
+        with self._lock:
+            with open(os.path.join(self.folder, REJECTED_FILE), "a") as f:
+                f.writelines(line + "\n" for line in lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.rejected += len(lines)
+
+    def _open_segment(self) -> None:
+        """
+        Start a new segment file (the lock must be held)
+        """
+        self._close_segment()
+        number = int(os.path.basename(self._segments[-1])[:-len(SEGMENT_SUFFIX)]) + 1 if self._segments else 0
+        path = os.path.join(self.folder, f"{number:012d}{SEGMENT_SUFFIX}")
+        self._current = open(path, "a")
+        self._segments.append(path)
+        self._counts[path] = 0
+        # Make the new file entry durable
+        directory = os.open(self.folder, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _close_segment(self) -> None:
+        """
+        Close the segment open for appending, the next points start a new segment (the lock must be held)
+        """
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+    def _remove_segment(self, path: str) -> int:
+        """
+        Delete a segment (the lock must be held)
+        :param path: path to the segment file
+        :return: the number of points of the segment
+        """
+        if self._current is not None and self._current.name == path:
+            self._close_segment()
+        self._size -= os.path.getsize(path)
+        os.remove(path)
+        self._segments.remove(path)
+        return self._counts.pop(path)
+
+    def _enforce_limit(self) -> None:
+        """
+        Drop the oldest segments while the spool exceeds its maximum size, the last segment is kept (the lock must be
+        held)
+        """
+        while self._size > self.max_size and len(self._segments) > 1:
+            path = self._segments[0]
+            dropped = self._remove_segment(path)
+            self.dropped += dropped
+            LOGGER.warning(f"Spool full ({self.max_size / 2 ** 20:g} MB), dropped the {dropped} oldest points")
+
+    def drain(self, write, max_points: int = 0, batch_size: int = BATCH_SIZE) -> int:
+        """
+        Send the spooled points oldest first, in batches, and delete the segments that were completely sent.
+        The drain stops at the first failed write (the points stay in the spool) or once max_points were sent, so that
+        a large backlog is sent over several calls without delaying the new measurements. A batch rejected by the DB
+        (see rejected_by_db) is moved to the rejected file, so that it does not block the spool.
+        :param write: function writing a list of line protocol points to the DB synchronously, raising an exception on
+                      failure
+        :param max_points: maximum number of points sent by this call (0 = no limit), complete segments are sent
+        :param batch_size: number of points per write
+        :return: the number of points sent
+        """
+        sent = 0
+        while max_points <= 0 or sent < max_points:
+            with self._lock:
+                if not self._segments:
+                    break
+                path = self._segments[0]
+                if self._current is not None and self._current.name == path:
+                    # The points appended from now on go to a new segment
+                    self._close_segment()
+            lines = read_lines(path)
+            try:
+                for start in range(0, len(lines), batch_size):
+                    batch = lines[start:start + batch_size]
+                    try:
+                        write(batch)
+                    except Exception as e:
+                        if not rejected_by_db(e):
+                            raise
+                        LOGGER.error(f"{len(batch)} spooled points rejected by the DB, moved to {REJECTED_FILE}: "
+                                     f"{type(e).__name__}: {e}")
+                        self.quarantine(batch)
+            except Exception as e:
+                LOGGER.warning(f"Spool drain stopped after {sent} points: {type(e).__name__}: {e}")
+                break
+            with self._lock:
+                if path in self._segments:
+                    self._remove_segment(path)
+            sent += len(lines)
+        return sent
+
+    def stats(self) -> dict:
+        """
+        Report of the spooled points
+        :return: a dictionary with the number of points and segments, the size (in bytes), the age of the oldest point
+                 (in seconds, 0 if the spool is empty), the number of points dropped because the spool was full and the
+                 number of points rejected by the DB
+        """
+        with self._lock:
+            segments = list(self._segments)
+            points = sum(self._counts.values())
+            size = self._size
+        age = 0.0
+        for path in segments:
+            with open(path) as f:
+                first = f.readline()
+            if first.endswith("\n"):
+                oldest = line_time(first[:-1])
+                age = max(0.0, time.time() - oldest / 1e9) if oldest is not None else 0.0
+                break
+        return {"points": points, "segments": len(segments), "bytes": size, "age": age, "dropped": self.dropped,
+                "rejected": self.rejected}
+
+    def close(self) -> None:
+        """
+        Close the segment open for appending
+        """
+        with self._lock:
+            self._close_segment()
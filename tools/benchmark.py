@@ -0,0 +1,355 @@
+"""
+Benchmark and parity checks of the image processing pipeline
+Run from the PhenoHive directory, e.g. `python3 tools/benchmark.py engines data/images/`
+(see `python3 tools/benchmark.py --help` for the other benchmarks)
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import image_processing  # noqa: E402
+import skeleton  # noqa: E402
+from work_memory import WorkMemory, rss  # noqa: E402
+from buttons import ButtonEvents, SimulatedGPIO  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def list_images(folder: str, limit: int) -> list[str]:
+    """
+    List the sample images of a folder
+    :param folder: path to the folder containing the images
+    :param limit: maximum number of images to return (0 = no limit)
+    :return: the sorted list of image paths
+    """
+    images = sorted(entry.path for entry in os.scandir(folder)
+                    if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    if limit > 0:
+        images = images[:limit]
+    if not images:
+        raise RuntimeError(f"No image found in {folder}")
+    return images
+
+
+def timed(function, *args, **kwargs) -> tuple[object, float]:
+    """
+    Call a function and measure its duration
+    :param function: function to call
+    :return: the result of the function (None if it raised a KeyError) and the duration in seconds
+    """
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    except KeyError:
+        result = None
+    return result, time.perf_counter() - start
+
+
+def relative_error(value: float | None, reference: float | None) -> float:
+    """
+    Relative error of a value with respect to a reference
+    :return: the relative error (0 if both are missing, infinity if only one is missing)
+    """
+    if value is None and reference is None:
+        return 0.0
+    if value is None or reference is None:
+        return float("inf")
+    if reference == 0:
+        return 0.0 if value == 0 else float("inf")
+    return abs(value - reference) / abs(reference)
+
+
+def compare_engines(args: argparse.Namespace) -> bool:
+    """
+    Parity check and timing comparison of the growth engines: get_total_length must agree with the plantcv
+    engine within the given tolerance
+    :param args: command line arguments
+    :return: True if every image is within the tolerance
+    """
+    images = list_images(args.folder, args.limit)
+    durations = {engine: 0.0 for engine in image_processing.ENGINES}
+    ok = True
+    print(f"{'image':<30} " + " ".join(f"{engine:>12}" for engine in image_processing.ENGINES) + f" {'error':>8}")
+    for path in images:
+        lengths = {}
+        for engine in image_processing.ENGINES:
+            lengths[engine], elapsed = timed(image_processing.get_total_length, path, args.channel,
+                                             args.kernel_size, engine)
+            durations[engine] += elapsed
+        error = relative_error(lengths["opencv"], lengths["plantcv"])
+        ok = ok and error <= args.tolerance
+        print(f"{os.path.basename(path):<30} " +
+              " ".join(f"{str(None) if lengths[e] is None else round(lengths[e], 1):>12}" for e in lengths) +
+              f" {error:>8.2%}{'' if error <= args.tolerance else '  FAIL'}")
+
+    print("\nMean time per image:")
+    for engine, total in durations.items():
+        print(f"  {engine:<10} {total / len(images):.3f}s")
+    print(f"Speed-up (plantcv / opencv): {durations['plantcv'] / max(durations['opencv'], 1e-9):.1f}x")
+    print("Parity: " + ("OK" if ok else f"FAILED (tolerance {args.tolerance:.0%})"))
+    return ok
+
+
+def compare_scales(args: argparse.Namespace) -> bool:
+    """
+    Accuracy report of the multi-resolution processing: for each downscale factor, the error of get_total_length with
+    respect to the full resolution result and the mean processing time
+    :param args: command line arguments
+    :return: True if at least one factor greater than 1 is within the error budget
+    """
+    images = list_images(args.folder, args.limit)
+    factors = sorted(set([1.0] + args.factors))
+    errors = {factor: [] for factor in factors}
+    durations = {factor: 0.0 for factor in factors}
+    for path in images:
+        reference = None
+        for factor in factors:
+            length, elapsed = timed(image_processing.get_total_length, path, args.channel, args.kernel_size,
+                                    args.engine, downscale=factor)
+            durations[factor] += elapsed
+            if factor == 1.0:
+                reference = length
+            errors[factor].append(relative_error(length, reference))
+
+    print(f"{'factor':>8} {'mean error':>12} {'max error':>12} {'time/image':>12} {'speed-up':>10}")
+    best = 1.0
+    for factor in factors:
+        mean_error = sum(errors[factor]) / len(errors[factor])
+        max_error = max(errors[factor])
+        print(f"{factor:>8g} {mean_error:>12.2%} {max_error:>12.2%} {durations[factor] / len(images):>11.3f}s "
+              f"{durations[1.0] / max(durations[factor], 1e-9):>9.1f}x")
+        if max_error <= args.budget and durations[factor] < durations[best]:
+            best = factor
+    print(f"Fastest factor within the {args.budget:.0%} error budget: {best:g} (set `downscale = {best:g}` in the "
+          f"[image_arg] section of config.ini)")
+    return best > 1.0
+
+
+def compare_roi(args: argparse.Namespace) -> bool:
+    """
+    Region of interest tracking check: the images are analysed in order (as consecutive measurements) on the whole frame
+    and with the tracker, the results must be identical
+    :param args: command line arguments
+    :return: True if the tracked results are within the tolerance of the whole frame results
+    """
+    images = list_images(args.folder, args.limit)
+    tracker = image_processing.RoiTracker(args.margin)
+    full_time, roi_time = 0.0, 0.0
+    max_error = 0.0
+    for path in images:
+        full, elapsed = timed(image_processing.get_total_length, path, args.channel, args.kernel_size, args.engine)
+        full_time += elapsed
+        tracked, elapsed = timed(image_processing.get_total_length, path, args.channel, args.kernel_size, args.engine,
+                                 tracker=tracker)
+        roi_time += elapsed
+        max_error = max(max_error, relative_error(tracked, full))
+
+    print(f"Whole frame: {full_time / len(images):.3f}s/image, region of interest: {roi_time / len(images):.3f}s/image "
+          f"({full_time / max(roi_time, 1e-9):.1f}x)")
+    print(f"Region of interest analyses: {tracker.hits}, fallbacks to the whole frame: {tracker.fallbacks}")
+    print(f"Maximum relative error: {max_error:.2%}")
+    return max_error <= args.tolerance
+
+
+def plantcv_segment_lengths(skeleton_img) -> list[float] | None:
+    """
+    Measure the segments of a skeleton with plantcv (segment_skeleton and segment_path_length)
+    :param skeleton_img: skeleton image (uint8, 0 or 255)
+    :return: the segment lengths, or None if no segment is found
+    """
+    pcv = image_processing._plantcv()
+    segmented_img, obj = pcv.morphology.segment_skeleton(skel_img=skeleton_img)
+    pcv.outputs.clear()
+    _ = pcv.morphology.segment_path_length(segmented_img=segmented_img, objects=obj, label="default")
+    return pcv.outputs.observations['default']['segment_path_length']['value']
+
+
+def compare_skeleton(args: argparse.Namespace) -> bool:
+    """
+    Comparison of the skeleton measurement on the same skeletons: plantcv segment_skeleton/segment_path_length against
+    the vectorised skeleton graph analysis (total length and timing)
+    :param args: command line arguments
+    :return: True if the total lengths are within the tolerance for every image
+    """
+    images = list_images(args.folder, args.limit)
+    plantcv_time, native_time = 0.0, 0.0
+    ok = True
+    print(f"{'image':<30} {'plantcv':>12} {'skeleton':>12} {'branches':>9} {'tips':>6} {'error':>8}")
+    for path in images:
+        img = image_processing._read_image(path, None)
+        try:
+            shape = image_processing._find_plant(img, args.channel, args.kernel_size, 1.0,
+                                                 image_processing._opencv_edges, None)
+        except KeyError:
+            print(f"{os.path.basename(path):<30} no plant found")
+            continue
+        skeleton_img = image_processing.skeletonize(shape.mask)
+        lengths, elapsed = timed(plantcv_segment_lengths, skeleton_img)
+        plantcv_time += elapsed
+        graph, elapsed = timed(skeleton.analyse_skeleton, skeleton_img)
+        native_time += elapsed
+        reference = None if lengths is None else sum(lengths)
+        total = None if graph is None else sum(graph.segment_lengths)
+        error = relative_error(total, reference)
+        ok = ok and error <= args.tolerance
+        print(f"{os.path.basename(path):<30} {str(None) if reference is None else round(reference, 1):>12} "
+              f"{str(None) if total is None else round(total, 1):>12} "
+              f"{'-' if graph is None else graph.branch_points:>9} {'-' if graph is None else graph.tips:>6} "
+              f"{error:>8.2%}{'' if error <= args.tolerance else '  FAIL'}")
+
+    print(f"\nMean time per skeleton: plantcv {plantcv_time / len(images):.4f}s, "
+          f"skeleton graph {native_time / len(images):.4f}s ({plantcv_time / max(native_time, 1e-9):.1f}x)")
+    return ok
+
+
+def memory_report(args: argparse.Namespace) -> bool:
+    """
+    Memory report of the image analysis: peak traced memory (tracemalloc) and resident set size of each stage, with and
+    without the low-memory mode
+    :param args: command line arguments
+    :return: True if the peak traced memory of the low-memory mode is within the budget for every image
+    """
+    images = list_images(args.folder, args.limit)
+    memory = WorkMemory(args.budget, profile=True)
+    reference = WorkMemory(0, profile=True)
+    ok = True
+    mb = 2 ** 20
+    print(f"{'image':<30} {'stage':<10} {'peak (MB)':>10} {'low-mem (MB)':>13} {'rss (MB)':>9} {'peak rss (MB)':>14}")
+    for path in images:
+        # Reference run: the intermediate images are allocated by each call (only the total is recorded)
+        with reference.stage("total"):
+            timed(image_processing.analyse_image, path, args.channel, args.kernel_size, args.engine,
+                  downscale=args.downscale)
+
+        memory.report.clear()
+        with memory.stage("total"):
+            traits, _ = timed(image_processing.analyse_image, path, args.channel, args.kernel_size, args.engine,
+                              downscale=args.downscale, memory=memory)
+        if traits is None:
+            print(f"{os.path.basename(path):<30} no plant found")
+        for name, (peak, current_rss, peak_rss) in memory.report.items():
+            reference_peak = reference.report["total"][0] if name == "total" else None
+            print(f"{os.path.basename(path):<30} {name:<10} "
+                  f"{'-' if reference_peak is None else f'{reference_peak / mb:.1f}':>10} {peak / mb:>13.1f} "
+                  f"{current_rss / mb:>9.1f} {peak_rss / mb:>14.1f}")
+        if memory.budget and memory.report["total"][0] > memory.budget:
+            ok = False
+            print(f"{'':<30} over the {args.budget:g} MB budget")
+
+    print(f"\nWorking buffers: {memory.nbytes / mb:.1f} MB, last downscale factor: {memory.downscale:g}")
+    process_rss = rss()
+    if process_rss is not None:
+        print(f"Process resident set size: {process_rss[0] / mb:.1f} MB (peak {process_rss[1] / mb:.1f} MB)")
+    return ok
+
+
+def cpu_usage(function, *args) -> float:
+    """
+    Measure the CPU usage of the process while a function runs
+    :param function: function to call
+    :return: the CPU time divided by the elapsed time (1 = one core fully used)
+    """
+    cpu, start = time.process_time(), time.perf_counter()
+    function(*args)
+    return (time.process_time() - cpu) / max(time.perf_counter() - start, 1e-9)
+
+
+def idle_cpu(args: argparse.Namespace) -> bool:
+    """
+    Idle CPU usage of a menu waiting for a button press: busy polling of the button (previous menus) against waiting on
+    the button events queue
+    :param args: command line arguments
+    :return: True if the event-driven wait uses less CPU than the polling
+    """
+    if args.rpi:
+        import RPi.GPIO as gpio
+        gpio.setmode(gpio.BCM)
+    else:
+        gpio = SimulatedGPIO()
+    gpio.setup(args.pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+
+    def polling(duration: float) -> None:
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            if not gpio.input(args.pin):
+                break
+
+    buttons = ButtonEvents(gpio, {"button": args.pin})
+    try:
+        polling_usage = cpu_usage(polling, args.duration)
+        event_usage = cpu_usage(buttons.wait, args.duration)
+    finally:
+        buttons.close()
+    print(f"Idle CPU usage over {args.duration:g}s ({'RPi.GPIO' if args.rpi else 'simulated GPIO'}):")
+    print(f"  busy polling: {polling_usage:.1%}")
+    print(f"  button events: {event_usage:.1%}")
+    return event_usage < polling_usage
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the PhenoHive image processing")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    engines_parser = subparsers.add_parser("engines", help="Parity and timing comparison of the growth engines")
+    engines_parser.add_argument("folder", help="Folder containing the sample images")
+    engines_parser.add_argument("-c", "--channel", default="k", help="CMYK channel (default = k)")
+    engines_parser.add_argument("-k", "--kernel_size", type=int, default=20, help="Closing kernel size (default = 20)")
+    engines_parser.add_argument("-t", "--tolerance", type=float, default=0.05,
+                                help="Maximum relative error of the opencv engine (default = 0.05)")
+    engines_parser.add_argument("-n", "--limit", type=int, default=0, help="Maximum number of images (default = all)")
+    engines_parser.set_defaults(function=compare_engines)
+
+    scale_parser = subparsers.add_parser("scale", help="Accuracy report of the downscaled processing")
+    scale_parser.add_argument("folder", help="Folder containing the sample images")
+    scale_parser.add_argument("-f", "--factors", type=float, nargs="+", default=[1.5, 2, 3, 4],
+                              help="Downscale factors to evaluate (default = 1.5 2 3 4)")
+    scale_parser.add_argument("-b", "--budget", type=float, default=0.05,
+                              help="Maximum relative error with respect to full resolution (default = 0.05)")
+    scale_parser.add_argument("-e", "--engine", default="opencv", help="Growth engine (default = opencv)")
+    scale_parser.add_argument("-c", "--channel", default="k", help="CMYK channel (default = k)")
+    scale_parser.add_argument("-k", "--kernel_size", type=int, default=20, help="Closing kernel size (default = 20)")
+    scale_parser.add_argument("-n", "--limit", type=int, default=0, help="Maximum number of images (default = all)")
+    scale_parser.set_defaults(function=compare_scales)
+
+    roi_parser = subparsers.add_parser("roi", help="Region of interest tracking check on consecutive images")
+    roi_parser.add_argument("folder", help="Folder containing consecutive images of the same plant")
+    roi_parser.add_argument("-m", "--margin", type=int, default=50, help="Growth margin in pixels (default = 50)")
+    roi_parser.add_argument("-t", "--tolerance", type=float, default=0.0,
+                            help="Maximum relative error with respect to the whole frame (default = 0)")
+    roi_parser.add_argument("-e", "--engine", default="opencv", help="Growth engine (default = opencv)")
+    roi_parser.add_argument("-c", "--channel", default="k", help="CMYK channel (default = k)")
+    roi_parser.add_argument("-k", "--kernel_size", type=int, default=20, help="Closing kernel size (default = 20)")
+    roi_parser.add_argument("-n", "--limit", type=int, default=0, help="Maximum number of images (default = all)")
+    roi_parser.set_defaults(function=compare_roi)
+
+    skeleton_parser = subparsers.add_parser("skeleton", help="Skeleton measurement comparison (plantcv vs skeleton.py)")
+    skeleton_parser.add_argument("folder", help="Folder containing the sample images")
+    skeleton_parser.add_argument("-t", "--tolerance", type=float, default=0.05,
+                                 help="Maximum relative error of the total length (default = 0.05)")
+    skeleton_parser.add_argument("-c", "--channel", default="k", help="CMYK channel (default = k)")
+    skeleton_parser.add_argument("-k", "--kernel_size", type=int, default=20,
+                                 help="Closing kernel size (default = 20)")
+    skeleton_parser.add_argument("-n", "--limit", type=int, default=0, help="Maximum number of images (default = all)")
+    skeleton_parser.set_defaults(function=compare_skeleton)
+
+    memory_parser = subparsers.add_parser("memory", help="Memory report of the image analysis stages")
+    memory_parser.add_argument("folder", help="Folder containing the sample images")
+    memory_parser.add_argument("-b", "--budget", type=float, default=0,
+                               help="Peak working memory budget of the low-memory mode in MB (default = 0, no budget)")
+    memory_parser.add_argument("-d", "--downscale", type=float, default=1, help="Downscale factor (default = 1)")
+    memory_parser.add_argument("-e", "--engine", default="opencv", help="Growth engine (default = opencv)")
+    memory_parser.add_argument("-c", "--channel", default="k", help="CMYK channel (default = k)")
+    memory_parser.add_argument("-k", "--kernel_size", type=int, default=20, help="Closing kernel size (default = 20)")
+    memory_parser.add_argument("-n", "--limit", type=int, default=0, help="Maximum number of images (default = all)")
+    memory_parser.set_defaults(function=memory_report)
+
+    idle_parser = subparsers.add_parser("idle", help="Idle CPU usage of the menus (polling vs button events)")
+    idle_parser.add_argument("-d", "--duration", type=float, default=5, help="Duration of each measure (default = 5s)")
+    idle_parser.add_argument("-p", "--pin", type=int, default=16, help="GPIO pin of the button (default = 16)")
+    idle_parser.add_argument("--rpi", action="store_true", help="Use RPi.GPIO instead of the simulated GPIO")
+    idle_parser.set_defaults(function=idle_cpu)
+
+    arguments = parser.parse_args()
+    sys.exit(0 if arguments.function(arguments) else 1)
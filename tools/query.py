@@ -0,0 +1,127 @@
+"""
+Query and export of the measurement history of the station (see history.py), without InfluxDB
+`range` reads the measurements of a time range, `last` the most recent measurements and `downsample` aggregates a time
+range per bucket (mean, min and max). The results are printed as CSV, or exported to a csv, npz or parquet file.
+Run from the PhenoHive directory (or on a copy of the data folder), e.g.
+`python3 tools/query.py downsample 1h --start=-7d -f weight_g growth -o week.npz`
+"""
+import argparse
+import configparser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from history import History, STATISTICS, EXPORT_FORMATS, export, parse_duration, parse_when, write_csv  # noqa: E402
+
+
+def csv_path(args: argparse.Namespace) -> str:
+    """
+    Path to the measurement files: the --csv option, or csv_path in the config file
+    :param args: arguments of the command
+    :return: the path
+    """
+    if args.csv:
+        return args.csv
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    return config["Paths"].get("csv_path", "data/measurements.csv") if config.has_section("Paths") \
+        else "data/measurements.csv"
+
+
+def output(args: argparse.Namespace, columns: dict, elapsed: float) -> None:
+    """
+    Print or export the result of a query
+    :param args: arguments of the command
+    :param columns: the result
+    :param elapsed: duration of the query (in seconds)
+    """
+    rows = len(columns["time"])
+    if args.output:
+        export(columns, args.output, args.format)
+        print(f"{rows} rows exported to {args.output} (query in {elapsed:.2f}s)")
+    else:
+        write_csv(columns, sys.stdout)
+        print(f"{rows} rows (query in {elapsed:.2f}s)", file=sys.stderr)
+
+
+def time_range(args: argparse.Namespace) -> tuple[float | None, float | None]:
+    """
+    Parse the --start and --end options
+    :param args: arguments of the command
+    :return: the start and end in seconds since the epoch, or None
+    """
+    return (parse_when(args.start) if args.start else None), (parse_when(args.end) if args.end else None)
+
+
+def query_range(args: argparse.Namespace) -> bool:
+    """
+    Read the measurements of a time range
+    :param args: arguments of the command
+    :return: True once the result is printed or exported
+    """
+    start = time.monotonic()
+    columns = History(csv_path(args)).range(*time_range(args), fields=args.fields)
+    output(args, columns, time.monotonic() - start)
+    return True
+
+
+def query_last(args: argparse.Namespace) -> bool:
+    """
+    Read the most recent measurements
+    :param args: arguments of the command
+    :return: True once the result is printed or exported
+    """
+    start = time.monotonic()
+    columns = History(csv_path(args)).last(args.n, fields=args.fields)
+    output(args, columns, time.monotonic() - start)
+    return True
+
+
+def query_downsample(args: argparse.Namespace) -> bool:
+    """
+    Aggregate the measurements of a time range per bucket
+    :param args: arguments of the command
+    :return: True once the result is printed or exported
+    """
+    start = time.monotonic()
+    columns = History(csv_path(args)).downsample(parse_duration(args.bucket), *time_range(args), fields=args.fields,
+                                                 statistics=tuple(args.statistics), missing=args.missing)
+    output(args, columns, time.monotonic() - start)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query and export the measurement history of the station")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", default="config.ini", help="Path to the config file (default = config.ini)")
+    common.add_argument("--csv", default="", help="Path to the measurement files (default = csv_path of the config)")
+    common.add_argument("-f", "--fields", nargs="+", default=None, help="Columns to read (default = all)")
+    common.add_argument("-o", "--output", default="", help="File where the result is exported (default = stdout)")
+    common.add_argument("--format", default="", choices=("",) + EXPORT_FORMATS,
+                        help="Export format (default = from the extension of the output file)")
+    period = argparse.ArgumentParser(add_help=False)
+    period.add_argument("-s", "--start", default="",
+                        help="Start of the range: 2024-05-01, 2024-05-01T12:00:00 or relative to now, e.g. --start=-7d")
+    period.add_argument("-e", "--end", default="", help="End of the range, excluded (default = no end)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    range_parser = subparsers.add_parser("range", parents=[common, period],
+                                         help="Read the measurements of a time range")
+    range_parser.set_defaults(function=query_range)
+
+    last_parser = subparsers.add_parser("last", parents=[common], help="Read the most recent measurements")
+    last_parser.add_argument("n", type=int, help="Number of measurements")
+    last_parser.set_defaults(function=query_last)
+
+    downsample_parser = subparsers.add_parser("downsample", parents=[common, period],
+                                              help="Aggregate the measurements of a time range per bucket")
+    downsample_parser.add_argument("bucket", help="Duration of the buckets, e.g. 15m, 1h or 1d")
+    downsample_parser.add_argument("--statistics", nargs="+", default=list(STATISTICS), choices=STATISTICS,
+                                   help="Statistics per bucket (default = mean min max)")
+    downsample_parser.add_argument("--missing", type=float, default=-1,
+                                   help="Value of the missing measurements, ignored by the statistics (default = -1)")
+    downsample_parser.set_defaults(function=query_downsample)
+
+    arguments = parser.parse_args()
+    sys.exit(0 if arguments.function(arguments) else 1)
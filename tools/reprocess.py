@@ -0,0 +1,191 @@
+"""
+Offline batch reprocessing of the image archive
+Recomputes the growth value of every image of the image folder with the current (or given) image processing
+parameters, using a process pool sized to the number of cores. Intended to run on a workstation, not on the station.
+The results are appended to a csv file keyed by the image timestamp; already processed images are skipped, so an
+interrupted run can be resumed by running the same command again (use one results file per parameter set).
+Run from the PhenoHive directory, e.g. `python3 tools/reprocess.py -o data/reprocessed.csv`
+"""
+import argparse
+import collections
+import configparser
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Iterator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from image_processing import get_total_length  # noqa: E402
+from analysis_cache import AnalysisCache  # noqa: E402
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+DATE_FORMAT_FILE = "%Y-%m-%dT%H-%M-%SZ"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+HEADER = ["time", "image", "growth", "error"]
+REPORT_EVERY = 50  # Number of processed images between two progress reports
+
+# Analysis cache of the worker process (opened by init_worker)
+_cache = None
+
+
+def init_worker(cache_path: str | None, cache_size: int, cache_max_mb: float) -> None:
+    """
+    Initialise a worker process, opening its own connection to the analysis cache
+    :param cache_path: path to the analysis cache (None to disable the cache)
+    :param cache_size: maximum number of entries of the cache
+    :param cache_max_mb: maximum size of the cache file (in MB, 0 = no limit)
+    """
+    global _cache
+    if cache_path is not None:
+        _cache = AnalysisCache(cache_path, cache_size, cache_max_mb)
+
+
+def scan_images(folder: str) -> Iterator[tuple[str, str]]:
+    """
+    Walk the image folder (and its sub-folders) lazily, without listing the whole archive in memory
+    Files whose name is not a capture timestamp (e.g. preview.jpg) are ignored
+    :param folder: path to the image folder
+    :return: an iterator of (timestamp, path) tuples
+    """
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from scan_images(entry.path)
+                continue
+            name, extension = os.path.splitext(entry.name)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            try:
+                timestamp = datetime.strptime(name, DATE_FORMAT_FILE).strftime(DATE_FORMAT)
+            except ValueError:
+                continue
+            yield timestamp, entry.path
+
+
+def load_done(results_path: str) -> set[str]:
+    """
+    Load the timestamps of the images already present in the results file
+    :param results_path: path to the results csv file
+    :return: the set of processed timestamps
+    """
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, newline="") as f:
+        for row in csv.DictReader(f):
+            done.add(row["time"])
+    return done
+
+
+def process_image(task: tuple[str, str, str, int, str]) -> tuple[tuple[str, str, float, str], bool]:
+    """
+    Compute the growth value of an image (run in a worker process)
+    :param task: tuple (timestamp, path, channel, kernel_size, engine)
+    :return: the result row (timestamp, path, growth value (-1 in case of error), error message) and whether the
+            result came from the analysis cache
+    """
+    timestamp, path, channel, kernel_size, engine = task
+    hits = _cache.hits if _cache is not None else 0
+    try:
+        row = timestamp, path, get_total_length(path, channel, kernel_size, engine, _cache), ""
+    except KeyError:
+        row = timestamp, path, -1.0, "no segment found"
+    except Exception as e:
+        row = timestamp, path, -1.0, f"{type(e).__name__}: {e}"
+    return row, _cache is not None and _cache.hits > hits
+
+
+def reprocess(folder: str, results_path: str, channel: str, kernel_size: int, engine: str, jobs: int,
+              cache_path: str | None = None, cache_size: int = 10000, cache_max_mb: float = 50) -> int:
+    """
+    Reprocess the image folder with a process pool and append the results to the results file
+    :param folder: path to the image folder
+    :param results_path: path to the results csv file
+    :param channel: CMYK channel used for the processing
+    :param kernel_size: kernel size for the closing operation
+    :param engine: growth engine used for the processing
+    :param jobs: number of worker processes
+    :param cache_path: path to the analysis cache (default = None, no cache)
+    :param cache_size: maximum number of entries of the analysis cache
+    :param cache_max_mb: maximum size of the analysis cache file (in MB, 0 = no limit)
+    :return: the number of processed images
+    """
+    done = load_done(results_path)
+    tasks = ((timestamp, path, channel, kernel_size, engine)
+             for timestamp, path in scan_images(folder) if timestamp not in done)
+
+    # Bound the number of pending tasks in the main thread so that the directory is streamed instead of being queued
+    # entirely (the pool feeder thread never blocks, so Ctrl+C stops the run)
+    pending = collections.deque()
+    new_file = not os.path.exists(results_path)
+    count = 0
+    cache_hits = 0
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(processes=jobs, initializer=init_worker,
+                                initargs=(cache_path, cache_size, cache_max_mb))
+    try:
+        with open(results_path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(HEADER)
+            while True:
+                for task in itertools.islice(tasks, jobs * 4 - len(pending)):
+                    pending.append(pool.apply_async(process_image, (task,)))
+                if not pending:
+                    break
+                row, cache_hit = pending.popleft().get()
+                writer.writerow(row)
+                cache_hits += cache_hit
+                # Flush each row so that an interrupted run can be resumed
+                f.flush()
+                count += 1
+                if count % REPORT_EVERY == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"{count} images processed ({count / elapsed:.2f} images/s)")
+    except KeyboardInterrupt:
+        print(f"Interrupted after {count} images, run the same command again to resume")
+        raise
+    finally:
+        # Stop the workers without waiting for the pending tasks (none are left once the folder is processed)
+        pool.terminate()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {count} images processed in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.2f} images/s), "
+          f"{len(done)} already in {results_path}")
+    if cache_path is not None:
+        print(f"Analysis cache: {cache_hits} hits, {count - cache_hits} misses")
+    return count
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Reprocess the image archive with new image parameters")
+    arg_parser.add_argument("--config", default="config.ini", help="Path to the config file (default = config.ini)")
+    arg_parser.add_argument("-i", "--images", help="Image folder (default = image_folder of the config file)")
+    arg_parser.add_argument("-o", "--output", default="data/reprocessed.csv",
+                            help="Results csv file (default = data/reprocessed.csv)")
+    arg_parser.add_argument("-c", "--channel", help="CMYK channel (default = channel of the config file)")
+    arg_parser.add_argument("-k", "--kernel_size", type=int, help="Closing kernel size (default = config file)")
+    arg_parser.add_argument("-e", "--engine", help="Growth engine (default = engine of the config file)")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                            help="Number of worker processes (default = number of cores)")
+    arg_parser.add_argument("--cache", action="store_true",
+                            help="Use the analysis cache of the config file (cache_path) to skip known images")
+    args = arg_parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    reprocess(folder=args.images or config["Paths"]["image_folder"],
+              results_path=args.output,
+              channel=args.channel or config["image_arg"]["channel"],
+              kernel_size=args.kernel_size or int(config["image_arg"]["kernel_size"]),
+              engine=args.engine or config["image_arg"].get("engine", "plantcv"),
+              jobs=max(1, args.jobs),
+              cache_path=config["Paths"].get("cache_path", "data/analysis_cache.sqlite") if args.cache else None,
+              # --cache uses the analysis cache even if it is disabled on the station (cache_size = 0)
+              cache_size=int(config["image_arg"].get("cache_size", "0")) or 10000,
+              cache_max_mb=float(config["image_arg"].get("cache_max_mb", "50")))
@@ -0,0 +1,184 @@
+"""
+Headless simulation of the station, with the simulated hardware backend (see hardware.py)
+`run` runs measurement rounds at accelerated speed, reports the pipeline stage timings and compares them with a baseline
+(load and regression benchmark), `record` records raw HX711 samples on the station to be replayed by the simulation.
+Run from the PhenoHive directory, e.g. `python3 tools/simulate.py run -n 20 -o data/simulation.json`
+"""
+import argparse
+import configparser
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from PhenoHiveStation import PhenoHiveStation  # noqa: E402
+from hardware import Hardware  # noqa: E402
+from profiling import TIMER  # noqa: E402
+from scheduler import MeasurementScheduler  # noqa: E402
+from utils import create_folders  # noqa: E402
+
+QUEUE_TIMEOUT = 600  # Maximum time to wait for the analysis queue to be drained at the end of a run (in seconds)
+
+
+def simulation_config(args: argparse.Namespace, folder: str) -> str:
+    """
+    Write the config file of the simulation: the station config with the simulated backend, and the data files in a
+    separate folder
+    :param args: arguments of the run command
+    :param folder: folder of the simulation data
+    :return: the path to the config file
+    """
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    if not config.has_section("Hardware"):
+        config.add_section("Hardware")
+    config["Hardware"]["backend"] = "simulated"
+    for device in ("display", "load_cell", "camera", "gpio", "database"):
+        config["Hardware"].pop(device, None)
+    config["Hardware"]["speedup"] = str(args.speedup)
+    if args.images:
+        config["Hardware"]["sample_images"] = args.images
+    if args.samples:
+        config["Hardware"]["hx711_samples"] = args.samples
+    if args.interval:
+        config["time_interval"]["time_interval"] = str(args.interval)
+    config["Station"]["running"] = "0"
+    config["Paths"]["data_folder"] = folder
+    config["Paths"]["image_folder"] = os.path.join(folder, "images")
+    config["Paths"]["spool_folder"] = os.path.join(folder, "spool")
+    config["Paths"]["image_store"] = os.path.join(folder, "image_store")
+    for key, name in (("csv_path", "measurements.csv"), ("cache_path", "analysis_cache.sqlite"),
+                      ("queue_path", "analysis_queue.sqlite"), ("timings_path", "timings.csv")):
+        config["Paths"][key] = os.path.join(folder, name)
+    create_folders([folder, config["Paths"]["image_folder"], "menu"])
+    path = os.path.join(folder, "config.ini")
+    with open(path, "w") as f:
+        config.write(f)
+    return path
+
+
+def find_regressions(stages: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare the stage timings of a run with a baseline run
+    :param stages: stage statistics of the run (see profiling.StageTimer.stats)
+    :param baseline: stage statistics of the baseline run
+    :param tolerance: maximum relative increase of the median duration of a stage
+    :return: the description of the stages slower than the baseline
+    """
+    regressions = []
+    for stage, reference in sorted(baseline.items()):
+        if stage not in stages or reference["p50"] <= 0:
+            continue
+        increase = stages[stage]["p50"] / reference["p50"] - 1
+        if increase > tolerance:
+            regressions.append(f"{stage}: p50 {stages[stage]['p50']:.4f}s vs {reference['p50']:.4f}s "
+                               f"(+{increase:.0%})")
+    return regressions
+
+
+def run(args: argparse.Namespace) -> bool:
+    """
+    Run measurement rounds with the simulated hardware
+    :param args: arguments of the run command
+    :return: True if no stage is slower than the baseline
+    """
+    folder = args.folder or tempfile.mkdtemp(prefix="phenohive_simulation_")
+    station = PhenoHiveStation.get_instance(simulation_config(args, folder))
+    print(f"Simulating {args.rounds} rounds every {station.time_interval}s at x{station.hardware.speedup:g} "
+          f"(data in {folder})")
+
+    scheduler = MeasurementScheduler(station.time_interval / station.hardware.speedup, station.catchup_policy)
+    TIMER.reset()
+    start = time.monotonic()
+    while scheduler.rounds < args.rounds:
+        time.sleep(scheduler.time_until_next())
+        if not scheduler.due():
+            continue
+        station.data["start_jitter"] = round(scheduler.begin_round(), 3)
+        station.measurement_pipeline()
+        TIMER.record("round", scheduler.end_round())
+    station.wait_pending_send()
+    if station.analysis_queue is not None:
+        deadline = time.monotonic() + QUEUE_TIMEOUT
+        while station.analysis_queue.depth() > 0 and time.monotonic() < deadline:
+            time.sleep(0.1)
+    elapsed = time.monotonic() - start
+
+    stages = TIMER.stats()
+    results = {
+        "rounds": scheduler.rounds,
+        "elapsed": elapsed,
+        "speedup": station.hardware.speedup,
+        "scheduler": scheduler.stats(),
+        "stages": stages,
+        "points": len(getattr(station.client, "points", [])),
+        "screens": getattr(station.st7735, "frames", 0),
+        "status": station.status,
+        "last_error": str(station.last_error[1])
+    }
+    print(f"{scheduler.rounds} rounds in {elapsed:.1f}s, {results['points']} points written, "
+          f"{results['screens']} screens displayed, status {station.status}")
+    print(f"{'stage':<16}{'p50':>10}{'p95':>10}{'max':>10}{'count':>8}")
+    for stage, values in sorted(stages.items()):
+        print(f"{stage:<16}{values['p50']:>10.4f}{values['p95']:>10.4f}{values['max']:>10.4f}{values['count']:>8}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if not args.baseline:
+        return station.status != -1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(stages, baseline["stages"], args.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return not regressions and station.status != -1
+
+
+def record(args: argparse.Namespace) -> bool:
+    """
+    Record raw HX711 samples (on the station), replayed by the simulated load cell
+    :param args: arguments of the record command
+    :return: True if the samples were recorded
+    """
+    hx = Hardware().load_cell()
+    hx.reset()
+    failed = 0
+    with open(args.output, "w") as f:
+        f.write(f"# {args.samples} raw HX711 samples recorded on {time.strftime('%Y-%m-%dT%H:%M:%S')}\n")
+        for _ in range(args.samples):
+            sample = hx._read()
+            failed += sample in [False, -1]
+            f.write(f"{sample}\n")
+    print(f"{args.samples} samples recorded to {args.output} ({failed} failed reads)")
+    return failed < args.samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless simulation of the PhenoHive station")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run measurement rounds with the simulated hardware")
+    run_parser.add_argument("--config", default="config.ini", help="Path to the config file (default = config.ini)")
+    run_parser.add_argument("-n", "--rounds", type=int, default=10, help="Number of rounds (default = 10)")
+    run_parser.add_argument("-s", "--speedup", type=float, default=60, help="Speed-up factor (default = 60)")
+    run_parser.add_argument("-i", "--interval", type=int, default=0,
+                            help="Simulated time between two rounds in seconds (default = time_interval of the config)")
+    run_parser.add_argument("--images", default="", help="Glob pattern of the sample images (default = synthetic)")
+    run_parser.add_argument("--samples", default="", help="File of recorded HX711 samples (default = synthetic)")
+    run_parser.add_argument("-d", "--folder", default="", help="Folder of the simulation data (default = temporary)")
+    run_parser.add_argument("-o", "--output", default="", help="JSON file where the results are saved")
+    run_parser.add_argument("-b", "--baseline", default="", help="JSON results of a baseline run to compare with")
+    run_parser.add_argument("-t", "--tolerance", type=float, default=0.25,
+                            help="Maximum relative increase of the median stage durations (default = 0.25)")
+    run_parser.set_defaults(function=run)
+
+    record_parser = subparsers.add_parser("record", help="Record raw HX711 samples on the station")
+    record_parser.add_argument("output", help="Path to the samples file")
+    record_parser.add_argument("-n", "--samples", type=int, default=1000, help="Number of samples (default = 1000)")
+    record_parser.set_defaults(function=record)
+
+    arguments = parser.parse_args()
+    sys.exit(0 if arguments.function(arguments) else 1)
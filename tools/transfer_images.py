@@ -0,0 +1,170 @@
+"""
+Bulk transfer of the photos of the image store (see image_store.py) to a server or a folder, with a bandwidth limit and
+a data budget per run. The transferred photos are recorded in a manifest, so that each photo is only sent once and an
+interrupted run is resumed by the next one. Run it on its own schedule, e.g. every night with cron:
+`0 2 * * * cd /home/pi/PhenoHive && python3 tools/transfer_images.py http://10.42.0.1:8000/images -r 200 -b 500`
+"""
+import argparse
+import configparser
+import os
+import shutil
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from image_store import ImageStore  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024  # Size of the chunks sent (in bytes)
+MANIFEST = "transferred.txt"  # Manifest of the transferred photos, in the image store folder
+
+
+class Throttle:
+    """
+    Bandwidth limit: waits so that the average rate stays below the limit
+    """
+
+    def __init__(self, rate_kbps: float) -> None:
+        """
+        :param rate_kbps: maximum rate in kB/s (0 = no limit)
+        """
+        self.rate = rate_kbps * 1000
+        self.start = time.monotonic()
+        self.sent = 0
+
+    def __call__(self, size: int) -> None:
+        """
+        Account for sent data, waiting if the rate is above the limit
+        :param size: size of the data (in bytes)
+        """
+        self.sent += size
+        if self.rate > 0:
+            delay = self.sent / self.rate - (time.monotonic() - self.start)
+            if delay > 0:
+                time.sleep(delay)
+
+
+def read_chunks(path: str, throttle: Throttle):
+    """
+    Read a file in chunks, at the throttled rate
+    :param path: path to the file
+    :param throttle: bandwidth limit
+    :return: an iterator over the chunks of the file
+    """
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            throttle(len(chunk))
+            yield chunk
+
+
+def send_http(url: str, digest: str, path: str, throttle: Throttle, timeout: float) -> None:
+    """
+    Upload a photo with an HTTP PUT request to <url>/<hash>.jpg
+    :param url: URL of the server
+    :param digest: SHA-256 hash of the photo
+    :param path: path to the photo in the image store
+    :param throttle: bandwidth limit
+    :param timeout: timeout of the request (in seconds)
+    :raises OSError: If the upload failed (urllib.error.URLError is a subclass)
+    """
+    request = urllib.request.Request(f"{url.rstrip('/')}/{digest}.jpg", data=read_chunks(path, throttle), method="PUT",
+                                     headers={"Content-Type": "image/jpeg",
+                                              "Content-Length": str(os.path.getsize(path))})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        if response.status >= 300:
+            raise OSError(f"Upload of {digest} failed with HTTP status {response.status}")
+
+
+def send_folder(folder: str, digest: str, path: str, throttle: Throttle) -> None:
+    """
+    Copy a photo to <folder>/<hash>.jpg (e.g. a mounted network share), the file is renamed once complete
+    :param folder: path to the destination folder
+    :param digest: SHA-256 hash of the photo
+    :param path: path to the photo in the image store
+    :param throttle: bandwidth limit
+    :raises OSError: If the copy failed
+    """
+    destination = os.path.join(folder, f"{digest}.jpg")
+    temporary = destination + ".part"
+    with open(temporary, "wb") as f:
+        for chunk in read_chunks(path, throttle):
+            f.write(chunk)
+    shutil.copystat(path, temporary)
+    os.replace(temporary, destination)
+
+
+def load_manifest(path: str) -> set[str]:
+    """
+    Load the hashes of the photos already transferred
+    :param path: path to the manifest
+    :return: the set of hashes
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def transfer(store: ImageStore, destination: str, budget_mb: float, rate_kbps: float,
+             timeout: float) -> tuple[int, int]:
+    """
+    Transfer the photos not transferred yet, oldest first, until the data budget is reached
+    :param store: image store
+    :param destination: URL of the server (http:// or https://) or path to the destination folder
+    :param budget_mb: maximum amount of data sent by this run (in MB, 0 = no limit)
+    :param rate_kbps: maximum rate (in kB/s, 0 = no limit)
+    :param timeout: timeout of an HTTP upload (in seconds)
+    :return: the number of photos and of bytes transferred
+    """
+    manifest_path = os.path.join(store.folder, MANIFEST)
+    done = load_manifest(manifest_path)
+    budget = budget_mb * 2 ** 20
+    throttle = Throttle(rate_kbps)
+    photos = sent = 0
+    with open(manifest_path, "a") as manifest:
+        for digest, path in store.digests():
+            if digest in done:
+                continue
+            size = os.path.getsize(path)
+            if 0 < budget < sent + size:
+                print(f"Data budget of {budget_mb:g} MB reached")
+                break
+            try:
+                if destination.startswith(("http://", "https://")):
+                    send_http(destination, digest, path, throttle, timeout)
+                else:
+                    send_folder(destination, digest, path, throttle)
+            except OSError as e:
+                # The remaining photos are sent by the next run
+                print(f"Transfer of {digest} failed, stopping: {type(e).__name__}: {e}")
+                break
+            manifest.write(digest + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            photos += 1
+            sent += size
+    return photos, sent
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Transfer the photos of the image store")
+    arg_parser.add_argument("destination", help="URL of the server receiving the photos (HTTP PUT <url>/<hash>.jpg) "
+                                                "or path to a destination folder")
+    arg_parser.add_argument("--config", default="config.ini", help="Path to the config file (default = config.ini)")
+    arg_parser.add_argument("-b", "--budget", type=float, default=0,
+                            help="Maximum amount of data sent by this run in MB (default = 0, no limit)")
+    arg_parser.add_argument("-r", "--rate", type=float, default=0,
+                            help="Maximum rate in kB/s (default = 0, no limit)")
+    arg_parser.add_argument("-t", "--timeout", type=float, default=60,
+                            help="Timeout of an HTTP upload in seconds (default = 60)")
+    args = arg_parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    image_store = ImageStore(config["Paths"].get("image_store", "data/image_store/"))
+    if not args.destination.startswith(("http://", "https://")):
+        os.makedirs(args.destination, exist_ok=True)
+    start = time.monotonic()
+    count, total = transfer(image_store, args.destination, args.budget, args.rate, args.timeout)
+    elapsed = time.monotonic() - start
+    print(f"{count} photos transferred ({total / 2 ** 20:.1f} MB in {elapsed:.0f}s)")
@@ -0,0 +1,143 @@
+"""
+Low-memory mode of the image analysis, for the 512 MB of the Raspberry Pi Zero: preallocated working buffers reused
+between analyses, a peak memory budget and a per-stage memory report (tracemalloc and resident set size)
+"""
+import contextlib
+import math
+import tracemalloc
+import numpy as np
+
+# Estimated peak working memory of the opencv engine, in bytes per pixel of the processed image: the BGR image (3),
+# the grey/edges/mask buffer (1), the blurred buffer (1), the skeleton (1) and the skeleton analysis (int32 labels,
+# neighbour counts and boolean masks, about 10)
+BYTES_PER_PIXEL = 16
+# Downscale factors that can be applied directly while decoding a JPEG file (see image_processing.REDUCED_READ_FLAGS)
+REDUCED_READ_FACTORS = (2, 4, 8)
+
+
+def rss() -> tuple[int, int] | None:
+    """
+    Get the resident set size of the process (Linux only)
+    :return: the current and peak resident set size in bytes, or None if not available
+    """
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset the peak resident set size of the process (Linux only, ignored if not permitted)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class WorkMemory:
+    """
+    Working memory of the image analysis in low-memory mode.
+    The uint8 working buffers are allocated once and reused by the following analyses (they are only reallocated when a
+    larger image is processed). The images are processed at a reduced resolution if their estimated working memory
+    exceeds the budget. The buffers are shared between analyses: use one instance per thread.
+    """
+
+    def __init__(self, budget_mb: float = 0, profile: bool = False) -> None:
+        """
+        Initialize the working memory
+        :param budget_mb: peak working memory budget of an analysis in MB (0 = no budget)
+        :param profile: record the memory peak of each analysis stage (starts tracemalloc, slows down the analysis)
+        """
+        self.budget = int(budget_mb * 2 ** 20)
+        self.profile = profile
+        self.frame_size = None  # Size (height, width) at full resolution of the last analysed image
+        self.downscale = 1.0  # Downscale factor used for the last analysed image
+        self.report = {}  # Memory peak of each stage of the last analysis: name -> (traced peak, rss, peak rss)
+        self._buffers = {}
+        self._open_stages = []  # Running [traced peak, peak rss] of the stages being recorded (stages can be nested)
+        if profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def buffer(self, name: str, shape: tuple[int, ...]) -> np.ndarray:
+        """
+        Get a working buffer, reusing the memory of the previous analyses
+        :param name: name of the buffer (a buffer must not be used for two intermediate images at the same time)
+        :param shape: shape of the buffer
+        :return: an uninitialised uint8 array of the given shape
+        """
+        size = math.prod(shape)
+        buf = self._buffers.get(name)
+        if buf is None or buf.size < size:
+            # Release the old buffer before allocating the new one
+            self._buffers.pop(name, None)
+            del buf
+            buf = np.empty(size, np.uint8)
+            self._buffers[name] = buf
+        return buf[:size].reshape(shape)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Total size of the working buffers in bytes
+        """
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+    def release(self) -> None:
+        """
+        Release the working buffers (they will be allocated again by the next analysis)
+        """
+        self._buffers.clear()
+
+    def required_downscale(self, frame_size: tuple[int, int], downscale: float = 1.0) -> float:
+        """
+        Get the smallest downscale factor keeping the estimated working memory of an image within the budget.
+        The factor is rounded up to a factor that can be applied while decoding a JPEG file when possible.
+        :param frame_size: size (height, width) of the image at full resolution
+        :param downscale: requested downscale factor
+        :return: the downscale factor to use (at least the requested one)
+        """
+        if self.budget <= 0:
+            return downscale
+        estimate = frame_size[0] * frame_size[1] * BYTES_PER_PIXEL
+        required = math.sqrt(estimate / self.budget)
+        if required <= downscale:
+            return downscale
+        return next((factor for factor in REDUCED_READ_FACTORS if factor >= required), required)
+
+    def stage(self, name: str) -> contextlib.AbstractContextManager:
+        """
+        Context manager recording the memory peak of an analysis stage in the report (if profiling is enabled)
+        :param name: name of the stage
+        :return: the context manager
+        """
+        return self._profiled_stage(name) if self.profile else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def _profiled_stage(self, name: str):
+        # The peaks are reset for each stage: fold them into the enclosing stages first
+        self._fold_peaks()
+        tracemalloc.reset_peak()
+        reset_peak_rss()
+        self._open_stages.append([0, -1])
+        try:
+            yield
+        finally:
+            self._fold_peaks()
+            peak, peak_rss = self._open_stages.pop()
+            current_rss = (rss() or (-1, -1))[0]
+            self.report[name] = (peak, current_rss, peak_rss)
+
+    def _fold_peaks(self) -> None:
+        """
+        Update the running peaks of the open stages with the current tracemalloc and rss peaks
+        """
+        _, peak = tracemalloc.get_traced_memory()
+        peak_rss = (rss() or (-1, -1))[1]
+        for stage in self._open_stages:
+            stage[0] = max(stage[0], peak)
+            stage[1] = max(stage[1], peak_rss)